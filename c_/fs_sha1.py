@@ -6,16 +6,20 @@
 imported by c.py
 """
 
-from typing import Any, Callable, Iterable, Iterator, Literal, NewType
+from typing import Any, Callable, Container, Iterable, Iterator, Literal, NewType
 import argparse
+import array
 import asyncio
 import base64
+import bisect
 import collections
+import concurrent.futures
 import contextlib
 import dataclasses
 import datetime
 import difflib
 import enum
+import errno
 import fcntl
 import fileinput
 import functools
@@ -27,6 +31,7 @@ import ipaddress
 import itertools
 import json
 import logging
+import mmap
 import os
 import pathlib
 import pty
@@ -39,6 +44,8 @@ import shlex
 import shutil
 import signal
 import socket
+import sqlite3
+import stat
 import struct
 import subprocess
 import sys
@@ -51,6 +58,7 @@ import traceback
 import tty
 import types
 import typing
+import unittest.mock
 
 import lib
 from lib import CLI, logger, MyException
@@ -63,23 +71,53 @@ epilog = r'''
 
 head ~/sha/xxh3.txt | sed -E 's/^(\S+) (\S+) (\S+) ( *\S+) (.+)$/1:\1|2:\2|3:\3|4:\4|5:\5/'
 head ~/sha/xxh3.txt | sed -E 's/^(\S+) (\S+) (\S+) ( *\S+) (.+)$/\1 \2 \3 \4 \5/'
+
+--incremental: reuse hashes of files whose (size, mtime_ns, inode, ctime_ns) are unchanged since the last --incremental run
+stat cache: {hash_txt}.stat (written by --incremental runs)
+ino size mtime_ns ctime_ns path
+1234567 23299441890 1726060362511661000 1726060362511661000 /home/wsh/Documents/downloaded/WinDev2407Eval.HyperV.zip
+
+--hash_txt=*.sqlite: indexed store (see fs_hash_export); fs_hash_mv/fs_hash_rm update it in place
 '''
 
 
 # noinspection PyPep8Naming
 class fs_hash(CLI.Cmd):
+    metrics: 'fs_hash.Metrics | None' = None  # set by main(); hooks in calc_hash() and hash_file_with_progress()
+
     @dataclasses.dataclass(frozen=True, kw_only=True)
     class Args:
         alg: str
         hash_txt: str
-        files_txt: str
+        files_txt: str | None
+        root: list[str] | None
+        exclude: list[str]
+        walk_jobs: int
+        jobs: int
+        read_strategy: str
+        incremental: bool
+        verify_fraction: float
+        progress: bool
+        metrics_jsonl: str | None
+        metrics_interval: float
 
     @classmethod
     def add_parser(cls):
         subparser = CLI.subparsers.add_parser('fs_hash', aliases=['fs_sha1'], help='', epilog=epilog, formatter_class=CLI.ArgumentDefaultsRawTextHelpFormatter)
-        subparser.add_argument('--alg', choices=['sha1', 'xxh32', 'xxh64', 'xxh3', 'xxh128'], default='xxh3')
+        subparser.add_argument('--alg', choices=cls.ALGS, default='xxh3')
         subparser.add_argument('--hash_txt', required=True)
-        subparser.add_argument('--files_txt', required=True)
+        group = subparser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--files_txt', help='rsync --list-only output')
+        group.add_argument('--root', action='append', help='walk this directory instead of --files_txt (repeatable)')
+        subparser.add_argument('--exclude', action='append', default=[], help='with --root: rsync-like exclude pattern (repeatable): /anchored/, dir_only/, *, **, dir/***')
+        subparser.add_argument('--walk_jobs', type=CLI.validator(int, lambda x: x >= 1, 'must be >= 1'), default=4, help='with --root: number of directory walker threads')
+        subparser.add_argument('--jobs', '-j', type=CLI.validator(int, lambda x: x >= 1, 'must be >= 1'), default=1, help='number of hashing threads (rotational disks are limited to 1)')
+        subparser.add_argument('--read_strategy', choices=cls.STRATEGIES, default='readinto', help='see hash_file_with_progress(); compare with fs_hash_bench')
+        subparser.add_argument('--incremental', action='store_true', help='skip files unchanged since the last --incremental run (see {hash_txt}.stat)')
+        subparser.add_argument('--progress', action='store_true', help='live status line (totals, throughput, ETA) on stderr')
+        subparser.add_argument('--metrics_jsonl', help='append throughput/latency/read-vs-hash metrics every --metrics_interval seconds to this file')
+        subparser.add_argument('--metrics_interval', type=CLI.validator(float, lambda x: x > 0, 'must be > 0'), default=10.0, help='seconds')
+        subparser.add_argument('--verify_fraction', '--verify-fraction', type=CLI.validator(float, lambda x: 0 <= x <= 1, 'must be in [0, 1]'), default=0.0, help='with --incremental: rehash this random fraction of unchanged files (bit rot check)')
         subparser.set_defaults(func=lambda args: cls(**args))
 
     def __init__(self, **kwargs):
@@ -90,38 +128,61 @@ class fs_hash(CLI.Cmd):
     def main(args: 'fs_hash.Args') -> None:
         logger.debug(f'{args=}')
 
-        hash_fn = hashlib.sha1
-        if args.alg in ['xxh32', 'xxh64', 'xxh3', 'xxh128']:
-            import xxhash
-            hash_fn = {
-                'sha1': hashlib.sha1,
-                'xxh32': xxhash.xxh32,
-                'xxh64': xxhash.xxh64,
-                'xxh3': xxhash.xxh3_64,
-                'xxh128': xxhash.xxh3_128,
-            }[args.alg]
+        hash_fn = fs_hash.hash_fn_of(alg=args.alg)
 
-        files_calced: dict[str, fs_hash.File] = {}
-
-        for line in pathlib.Path(args.files_txt).read_text().splitlines():
-            m = re.match(r'^(?P<mode>[\w-]+)\s+(?P<size>[\d,]+)\s+(?P<mdate>\d{4}/\d\d/\d\d \d\d:\d\d:\d\d)\s+(?P<path>.+)$', line)
-            if m is None:
-                logger.warning(f'{args.files_txt}: discard invalid line: {line}')
-                continue
-            m.groupdict()
-            if m['mode'][0] == 'd':
-                logger.debug(f'skip directory: {m['path']=}')
-                del line, m
-                continue
+        entries: Iterable[tuple[str, os.stat_result | None]]
+        if args.files_txt is not None:
+            files_txt_entries = [*fs_hash.read_files_txt(txt_path=args.files_txt)]
+            fs_hash.metrics = fs_hash.Metrics(files_total=len(files_txt_entries), bytes_total=sum(size for path_, size in files_txt_entries))
+            entries = ((path_, None) for path_, size in files_txt_entries)
+        else:
+            fs_hash.metrics = fs_hash.Metrics(files_total=None, bytes_total=None)  # unknown until the walk ends
+            entries = fs_hash.walk(roots=[os.path.abspath(os.path.expanduser(root)) for root in args.root], excludes=args.exclude, jobs=args.walk_jobs)
 
-            path_ = f'/{m['path']}'
-            logger.debug(f'{m.groupdict()=} {path_=}')
-            file = fs_hash.calc_hash(path_=path_, hash_fn=hash_fn)
-            logger.debug(f'{file=}')
-            if file is not None:
-                files_calced[path_] = file
-            del line, m, path_, file
+        files_calced: dict[str, fs_hash.File] = {}
+        stats_calced: dict[str, fs_hash.StatKey] = {}
+        paths_to_verify: dict[str, fs_hash.File] = {}
+        paths_rotten: list[str] = []
+        n_entries = n_reused = 0
+
+        def entries_to_hash() -> Iterator[tuple[str, os.stat_result | None]]:
+            nonlocal n_entries, n_reused
+            files_prev = fs_hash.Db(args.hash_txt) if fs_hash.Db.is_db(args.hash_txt) else fs_hash.read_hash_txt(txt_path=args.hash_txt)
+            stats_prev = fs_hash.read_stat_cache(txt_path=f'{args.hash_txt}.stat')
+            for path_, st in entries:
+                n_entries += 1
+                if st is None:
+                    try:
+                        st = os.stat(path_, follow_symlinks=False)
+                    except FileNotFoundError as e:
+                        yield path_, None  # calc_hash() warns
+                        continue
+                stat_key = fs_hash.StatKey.from_stat(st)
+                stats_calced[path_] = stat_key
+                if stats_prev.get(path_) == stat_key and (file_prev := files_prev.get(path_)) is not None:
+                    if random.random() >= args.verify_fraction:
+                        files_calced[path_] = file_prev
+                        n_reused += 1
+                        fs_hash.metrics.file_reused(size=st.st_size)
+                        continue
+                    paths_to_verify[path_] = file_prev
+                yield path_, st
 
+        with fs_hash.metrics.reporting(progress=args.progress, metrics_jsonl=args.metrics_jsonl, interval=args.metrics_interval):
+            for path_, file in fs_hash.calc_hashes(entries=entries_to_hash() if args.incremental else entries, hash_fn=hash_fn, jobs=args.jobs, strategy=args.read_strategy):
+                logger.debug(f'{file=}')
+                if file is not None:
+                    files_calced[path_] = file
+                    if path_ in paths_to_verify and paths_to_verify[path_].hash_val != file.hash_val:
+                        logger.warning(f'hash changed but stat unchanged (bit rot?): {path_=} {paths_to_verify[path_].hash_val=} {file.hash_val=}')
+                        files_calced[path_] = paths_to_verify[path_]  # keep the known-good hash as evidence
+                        paths_rotten.append(path_)
+                else:
+                    stats_calced.pop(path_, None)
+                del path_, file
+        fs_hash.metrics.log_summary()
+        if args.incremental:
+            logger.info(f'incremental: hash {n_entries - n_reused - len(paths_to_verify)} + verify {len(paths_to_verify)}, reuse {n_reused} (of {n_entries})')
         # assert set(locals().keys()) == {'args', 'hash_fn', 'xxhash', 'files_calced'}, f'{locals().keys()=}'
 
         files_calced = dict(sorted(files_calced.items()))
@@ -129,13 +190,26 @@ class fs_hash(CLI.Cmd):
             logger.info(f'flock {f_lock.name}')
             fcntl.flock(f_lock, fcntl.LOCK_EX)
             logger.info(f'got flock {f_lock.name}')
-            files_from_txt = fs_hash.read_hash_txt(txt_path=args.hash_txt)
-            files_from_txt.update(files_calced)
-            del files_calced
-            files_from_txt = dict(sorted(files_from_txt.items()))
-            logger.info(f'write {args.hash_txt}')
-            fs_hash.write_hash_txt(txt_path=args.hash_txt, files=files_from_txt)
+            if fs_hash.Db.is_db(args.hash_txt):
+                logger.info(f'upsert {len(files_calced)} files into {args.hash_txt}')
+                with fs_hash.Db(args.hash_txt) as db, db.transaction():
+                    db.upsert(files_calced.values())
+            else:
+                fs_hash_apply.recover(txt_path=args.hash_txt)
+                files_from_txt = fs_hash.read_hash_txt(txt_path=args.hash_txt)
+                files_from_txt.update(files_calced)
+                del files_calced
+                files_from_txt = dict(sorted(files_from_txt.items()))
+                logger.info(f'write {args.hash_txt}')
+                fs_hash.write_hash_txt(txt_path=args.hash_txt, files=files_from_txt)
+            if args.incremental:
+                stats_from_txt = fs_hash.read_stat_cache(txt_path=f'{args.hash_txt}.stat')
+                stats_from_txt.update(stats_calced)
+                logger.info(f'write {args.hash_txt}.stat')
+                fs_hash.write_stat_cache(txt_path=f'{args.hash_txt}.stat', stats=dict(sorted(stats_from_txt.items())))
             fcntl.flock(f_lock, fcntl.LOCK_UN)
+        if paths_rotten:
+            raise MyException(f'{len(paths_rotten)} files changed without a stat change (bit rot?); kept their previous hashes in {args.hash_txt}')
 
     @dataclasses.dataclass(frozen=True, kw_only=True)
     class File:
@@ -148,6 +222,11 @@ class fs_hash(CLI.Cmd):
 
     @staticmethod
     def read_hash_txt(*, txt_path: str) -> dict[str, 'fs_hash.File']:
+        if fs_hash.Db.is_db(txt_path):
+            if not os.path.exists(txt_path):
+                return {}
+            with fs_hash.Db(txt_path) as db:
+                return {file.path: file for file in db.iter_files()}
         try:
             return fs_hash.read_hash_txt_str(txt=pathlib.Path(txt_path).read_text())
         except FileNotFoundError as e:
@@ -178,65 +257,729 @@ class fs_hash(CLI.Cmd):
         assert path == '/' or path[-1] != '/'
         return fs_hash.File(hash_val=hash_val, mode=mode, mdate=mdate, size=int(size), path=path)
 
+    class Record:
+        """Compact fs_hash.File for streaming readers (iter_hash_txt)
+
+        __slots__ (no __dict__), hash as bytes (hex-decoded if possible), interned mode.
+        """
+        __slots__ = ('hash_raw', 'hash_hex', 'mode', 'mdate', 'size', 'path')
+
+        def __init__(self, *, hash_val: str, mode: str, mdate: str, size: int, path: str):
+            try:
+                self.hash_raw = bytes.fromhex(hash_val)
+                self.hash_hex = self.hash_raw.hex() == hash_val  # not 'ABCD', 'ab cd'
+            except ValueError as e:
+                self.hash_hex = False
+            if not self.hash_hex:
+                self.hash_raw = hash_val.encode()
+            self.mode = sys.intern(mode)
+            self.mdate = mdate
+            self.size = size
+            self.path = path
+
+        def __repr__(self) -> str:
+            return f'fs_hash.Record(hash_val={self.hash_val!r}, mode={self.mode!r}, mdate={self.mdate!r}, size={self.size!r}, path={self.path!r})'
+
+        @property
+        def hash_val(self) -> str:
+            return self.hash_raw.hex() if self.hash_hex else self.hash_raw.decode()
+
+        def hash_key(self) -> int:
+            """64-bit prefix of the hash; equal hashes -> equal keys"""
+            return int.from_bytes(self.hash_raw[:8].ljust(8, b'\0'))
+
+        def to_file(self) -> 'fs_hash.File':
+            return fs_hash.File(hash_val=self.hash_val, mode=self.mode, mdate=self.mdate, size=self.size, path=self.path)
+
+    @staticmethod
+    def iter_hash_txt(*, txt_path: str) -> Iterator['fs_hash.Record']:
+        """Stream hash_txt (mmap; lines are parsed one by one, nothing is kept)
+
+        >>> with tempfile.NamedTemporaryFile('w+') as f:
+        ...     _ = f.write('0123456789abcdef 040775 2006-01-02.15:04:05.999999+09:00         4096 /home/wsh/d/\\n')
+        ...     _ = f.write('hash_a 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/a b.txt\\n')
+        ...     f.flush()
+        ...     [*fs_hash.iter_hash_txt(txt_path=f.name)]
+        [fs_hash.Record(hash_val='0123456789abcdef', mode='040775', mdate='2006-01-02.15:04:05.999999+09:00', size=4096, path='/home/wsh/d'), fs_hash.Record(hash_val='hash_a', mode='100664', mdate='2006-01-02.15:04:05.999999+09:00', size=42, path='/home/wsh/a b.txt')]
+        """
+        if fs_hash.Db.is_db(txt_path):
+            if not os.path.exists(txt_path):
+                return
+            with fs_hash.Db(txt_path) as db:
+                for file in db.iter_files():
+                    yield fs_hash.Record(hash_val=file.hash_val, mode=file.mode, mdate=file.mdate, size=file.size, path=file.path)
+            return
+        try:
+            f = open(txt_path, 'rb')
+        except FileNotFoundError as e:
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+                while line := mm.readline():
+                    cols = line.decode().rstrip('\n').split(None, 4)
+                    if len(cols) < 5:
+                        logger.warning(f'invalid line: {line!r}')
+                        continue
+                    hash_val, mode, mdate, size, path = cols
+                    if mode[0:3] == '040':
+                        assert path[-1] == '/'
+                        if path != '/':
+                            path = path[:-1]
+                    yield fs_hash.Record(hash_val=hash_val, mode=mode, mdate=mdate, size=int(size), path=path)
+
     @staticmethod
     def write_hash_txt(*, txt_path: str, files: dict[str, 'fs_hash.File']) -> None:
         with open(txt_path, 'w') as f:
             for path, file in files.items():
                 assert path == file.path
-                assert os.path.abspath(path) == path
-                if file.mode[0:3] == '040':
-                    if path != '/':
-                        assert path[-1] != '/'
-                        path += '/'
-                f.write(f'{file.hash_val} {file.mode} {file.mdate} {file.size:12} {path}\n')
+                f.write(fs_hash.format_hash_txt_line(file=file))
+
+    @staticmethod
+    def format_hash_txt_line(*, file: 'fs_hash.File') -> str:
+        path = file.path
+        assert os.path.abspath(path) == path
+        if file.mode[0:3] == '040':
+            if path != '/':
+                assert path[-1] != '/'
+                path += '/'
+        return f'{file.hash_val} {file.mode} {file.mdate} {file.size:12} {path}\n'
+
+    class Db:
+        """--hash_txt=*.sqlite: indexed hash store
+
+        files(path PRIMARY KEY, hash_val INDEX, ...); sqlite's BINARY collation orders path like sorted(str),
+        so iter_files() is in the same order as write_hash_txt().
+        Directory mv/rm are range scans on the primary key: prefix <= path < prefix_range_end(prefix).
+        """
+
+        def __init__(self, path: str):
+            self.conn = sqlite3.connect(path, isolation_level=None)  # autocommit; see transaction()
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, hash_val TEXT NOT NULL, mode TEXT NOT NULL, mdate TEXT NOT NULL, size INTEGER NOT NULL) WITHOUT ROWID')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS files_hash_val ON files (hash_val)')
+
+        def __enter__(self) -> 'fs_hash.Db':
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+            self.conn.close()
+
+        @staticmethod
+        def is_db(path: str) -> bool:
+            return path.endswith('.sqlite')
+
+        @contextlib.contextmanager
+        def transaction(self) -> Iterator[None]:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException as e:
+                self.conn.execute('ROLLBACK')
+                raise e
+            self.conn.execute('COMMIT')
+
+        @staticmethod
+        def prefix_range_end(prefix: str) -> str:
+            """smallest string greater than every string starting with prefix
+
+            >>> fs_hash.Db.prefix_range_end('/home/a/')
+            '/home/a0'
+            """
+            return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+        @staticmethod
+        def row_to_file(row: tuple[str, str, str, str, int]) -> 'fs_hash.File':
+            path, hash_val, mode, mdate, size = row
+            return fs_hash.File(hash_val=hash_val, mode=mode, mdate=mdate, size=size, path=path)
+
+        def get(self, path: str) -> 'fs_hash.File | None':
+            row = self.conn.execute('SELECT path, hash_val, mode, mdate, size FROM files WHERE path = ?', (path,)).fetchone()
+            return None if row is None else self.row_to_file(row)
+
+        def get_by_hash(self, hash_val: str) -> list['fs_hash.File']:
+            return [self.row_to_file(row) for row in self.conn.execute('SELECT path, hash_val, mode, mdate, size FROM files WHERE hash_val = ? ORDER BY path', (hash_val,))]
+
+        def iter_files(self, prefix: str = '') -> Iterator['fs_hash.File']:
+            if prefix == '':
+                cursor = self.conn.execute('SELECT path, hash_val, mode, mdate, size FROM files ORDER BY path')
+            else:
+                cursor = self.conn.execute('SELECT path, hash_val, mode, mdate, size FROM files WHERE path >= ? AND path < ? ORDER BY path', (prefix, self.prefix_range_end(prefix)))
+            for row in cursor:
+                yield self.row_to_file(row)
+
+        def upsert(self, files: Iterable['fs_hash.File']) -> None:
+            self.conn.executemany('INSERT OR REPLACE INTO files (path, hash_val, mode, mdate, size) VALUES (?, ?, ?, ?, ?)', ((file.path, file.hash_val, file.mode, file.mdate, file.size) for file in files))
+
+        def mv(self, path_a: str, path_b: str) -> int:
+            """path_a/ path_b/: move the directory's entries; else: move the file; return the number of moved entries"""
+            if path_a.endswith('/'):
+                cursor = self.conn.execute('UPDATE OR REPLACE files SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?', (path_b, len(path_a) + 1, path_a, self.prefix_range_end(path_a)))
+            else:
+                cursor = self.conn.execute('UPDATE OR REPLACE files SET path = ? WHERE path = ?', (path_b, path_a))
+            return cursor.rowcount
+
+        def rm(self, path_: str) -> int:
+            """path_/: remove the directory's entries; else: remove the file; return the number of removed entries"""
+            if path_.endswith('/'):
+                cursor = self.conn.execute('DELETE FROM files WHERE path >= ? AND path < ?', (path_, self.prefix_range_end(path_)))
+            else:
+                cursor = self.conn.execute('DELETE FROM files WHERE path = ?', (path_,))
+            return cursor.rowcount
+
+    ALGS = ['sha1', 'xxh32', 'xxh64', 'xxh3', 'xxh128']
+
+    @staticmethod
+    def hash_fn_of(*, alg: str) -> Callable[[], Any]:
+        hash_fn = hashlib.sha1
+        if alg in ['xxh32', 'xxh64', 'xxh3', 'xxh128']:
+            import xxhash
+            hash_fn = {
+                'sha1': hashlib.sha1,
+                'xxh32': xxhash.xxh32,
+                'xxh64': xxhash.xxh64,
+                'xxh3': xxhash.xxh3_64,
+                'xxh128': xxhash.xxh3_128,
+            }[alg]
+        return hash_fn
+
+    @staticmethod
+    def read_files_txt(*, txt_path: str) -> Iterator[tuple[str, int]]:
+        """rsync --list-only output -> (absolute path, size) of non-directories"""
+        for line in pathlib.Path(txt_path).read_text().splitlines():
+            m = re.match(r'^(?P<mode>[\w-]+)\s+(?P<size>[\d,]+)\s+(?P<mdate>\d{4}/\d\d/\d\d \d\d:\d\d:\d\d)\s+(?P<path>.+)$', line)
+            if m is None:
+                logger.warning(f'{txt_path}: discard invalid line: {line}')
+                continue
+            m.groupdict()
+            if m['mode'][0] == 'd':
+                logger.debug(f'skip directory: {m['path']=}')
+                del line, m
+                continue
+
+            path_ = f'/{m['path']}'
+            logger.debug(f'{m.groupdict()=} {path_=}')
+            yield path_, int(m['size'].replace(',', ''))
+            del line, m, path_
+
+    @staticmethod
+    def walk(*, roots: list[str], excludes: list[str], jobs: int, maxsize: int = 10000) -> Iterator[tuple[str, os.stat_result]]:
+        """Walk roots with os.scandir() on jobs threads; yield (path, lstat) of non-directories while walking
+
+        The DirEntry lstat is reused by calc_hash().
+        The output queue is bounded (maxsize), so the walkers wait for slow hashing.
+        """
+        exclude_res = [fs_hash.exclude_re(pattern=pattern) for pattern in excludes]
+        dir_queue: queue.Queue[str | None] = queue.Queue()
+        out_queue: queue.Queue[tuple[str, os.stat_result] | None] = queue.Queue(maxsize=maxsize)
+
+        def excluded(path_: str, is_dir: bool) -> bool:
+            return any((is_dir or not dir_only) and re_.search(path_) for re_, dir_only in exclude_res)
+
+        def walker() -> None:
+            while (dir_path := dir_queue.get()) is not None:
+                try:
+                    with os.scandir(dir_path) as it:
+                        for entry in it:
+                            try:
+                                is_dir = entry.is_dir(follow_symlinks=False)
+                                if excluded(entry.path, is_dir):
+                                    logger.debug(f'exclude: {entry.path=}')
+                                    continue
+                                if is_dir:
+                                    dir_queue.put(entry.path)
+                                    continue
+                                st = entry.stat(follow_symlinks=False)
+                            except OSError as e:  # e.g. removed meanwhile, EIO; the rest of the directory is still walked
+                                logger.warning(f'stat: {e}')
+                                continue
+                            out_queue.put((entry.path, st))
+                except OSError as e:  # ENOENT, EACCES, ENOTDIR, EIO, ELOOP, ...; a dead walker would hang closer()
+                    logger.warning(f'scandir: {e}')
+                finally:
+                    dir_queue.task_done()
+
+        def closer() -> None:
+            dir_queue.join()
+            for _ in range(jobs):
+                dir_queue.put(None)
+            out_queue.put(None)
+
+        for root in roots:
+            root = root.rstrip('/') or '/'
+            try:
+                st = os.stat(root, follow_symlinks=False)
+            except FileNotFoundError as e:
+                logger.warning(f'root not found: {root=}')
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                dir_queue.put(root)
+            else:
+                out_queue.put((root, st))
+        for i in range(jobs):
+            threading.Thread(target=walker, name=f'fs_hash_walk_{i}', daemon=True).start()
+        threading.Thread(target=closer, name='fs_hash_walk_closer', daemon=True).start()
+
+        while (item := out_queue.get()) is not None:
+            yield item
+
+    @staticmethod
+    def exclude_re(*, pattern: str) -> tuple[re.Pattern[str], bool]:
+        """rsync-like exclude pattern (as in backup_hdd.py) -> (regex searched in the absolute path, dir_only)
+
+        >>> re_, dir_only = fs_hash.exclude_re(pattern='/home/*/.cache/')
+        >>> bool(re_.search('/home/wsh/.cache')), bool(re_.search('/home/wsh/x/.cache')), dir_only
+        (True, False, True)
+        >>> re_, dir_only = fs_hash.exclude_re(pattern='node_modules/')
+        >>> bool(re_.search('/a/node_modules')), bool(re_.search('/a/node_modules_x')), dir_only
+        (True, False, True)
+        >>> re_, dir_only = fs_hash.exclude_re(pattern='cmake-build-*/')
+        >>> bool(re_.search('/a/cmake-build-debug')), bool(re_.search('/cmake-build-/x'))
+        (True, False)
+        >>> re_, dir_only = fs_hash.exclude_re(pattern='/home/wsh/.git/***')
+        >>> bool(re_.search('/home/wsh/.git')), bool(re_.search('/home/wsh/.git/config')), dir_only
+        (True, True, False)
+        >>> re_, dir_only = fs_hash.exclude_re(pattern='/a/**.o')
+        >>> bool(re_.search('/a/b/c.o')), bool(re_.search('/b/c.o'))
+        (True, False)
+        """
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        anchored = pattern.startswith('/')
+        suffix = ''
+        if pattern.endswith('/***'):
+            pattern = pattern[:-len('/***')]
+            suffix = '(/.*)?'
+        regex = ''
+        for token in re.split(r'(\*\*|\*|\?)', pattern):
+            regex += {'**': '.*', '*': '[^/]*', '?': '[^/]'}.get(token, re.escape(token))
+        return re.compile(('^' if anchored else '(^|/)') + regex + suffix + '$'), dir_only
+
+    @dataclasses.dataclass(frozen=True, kw_only=True)
+    class StatKey:
+        """--incremental: a file is rehashed iff this changes"""
+        ino: int
+        size: int
+        mtime_ns: int
+        ctime_ns: int
+
+        @staticmethod
+        def from_stat(stat: os.stat_result) -> 'fs_hash.StatKey':
+            return fs_hash.StatKey(ino=stat.st_ino, size=stat.st_size, mtime_ns=stat.st_mtime_ns, ctime_ns=stat.st_ctime_ns)
 
     @staticmethod
-    def calc_hash(*, path_: str, hash_fn: Callable[[], Any]) -> 'fs_hash.File | None':
+    def read_stat_cache(*, txt_path: str) -> dict[str, 'fs_hash.StatKey']:
+        stats: dict[str, fs_hash.StatKey] = {}
         try:
-            stat = os.stat(path_, follow_symlinks=False)
+            txt = pathlib.Path(txt_path).read_text()
         except FileNotFoundError as e:
-            logger.warning(f'file not found: {path_=}')
-            return None
-        if os.path.islink(path_):
+            return stats
+        for line in txt.splitlines():
+            cols = line.split(' ', 4)
+            if len(cols) < 5:
+                logger.warning(f'{txt_path}: invalid line: {line}')
+                continue
+            ino, size, mtime_ns, ctime_ns, path = cols
+            stats[path] = fs_hash.StatKey(ino=int(ino), size=int(size), mtime_ns=int(mtime_ns), ctime_ns=int(ctime_ns))
+        return stats
+
+    @staticmethod
+    def write_stat_cache(*, txt_path: str, stats: dict[str, 'fs_hash.StatKey']) -> None:
+        with open(txt_path, 'w') as f:
+            for path, stat_key in stats.items():
+                f.write(f'{stat_key.ino} {stat_key.size} {stat_key.mtime_ns} {stat_key.ctime_ns} {path}\n')
+
+    @staticmethod
+    def calc_hashes(*, entries: Iterable[tuple[str, os.stat_result | None]], hash_fn: Callable[[], Any], jobs: int, strategy: str = 'readinto') -> Iterator[tuple[str, 'fs_hash.File | None']]:
+        """Hash (path, lstat or None) entries; yield (path, file) in the order of entries
+
+        With jobs > 1, each device gets its own thread pool: jobs threads for SSDs, 1 thread for rotational disks.
+        """
+        if jobs == 1:
+            for path_, st in entries:
+                yield path_, fs_hash.calc_hash(path_=path_, hash_fn=hash_fn, st=st, strategy=strategy)
+            return
+
+        executors: dict[int, concurrent.futures.ThreadPoolExecutor] = {}
+        max_pending = 4 * jobs
+        try:
+            futures: collections.deque[tuple[str, concurrent.futures.Future[fs_hash.File | None]]] = collections.deque()
+            for path_, st in entries:
+                if st is None:
+                    try:
+                        st = os.stat(path_, follow_symlinks=False)
+                    except OSError:
+                        pass  # calc_hash() warns
+                st_dev = st.st_dev if st is not None else -1
+                if st_dev not in executors:
+                    rotational = st_dev != -1 and fs_hash.is_rotational(st_dev=st_dev)
+                    max_workers = 1 if rotational else jobs
+                    logger.info(f'{st_dev=} {rotational=} {max_workers=}')
+                    executors[st_dev] = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'fs_hash_{st_dev}')
+                futures.append((path_, executors[st_dev].submit(fs_hash.calc_hash, path_=path_, hash_fn=hash_fn, st=st, strategy=strategy)))
+                # yield finished heads early; order is kept; at most max_pending outstanding so entries is not read ahead unboundedly
+                while futures and (futures[0][1].done() or len(futures) >= max_pending):
+                    path_, future = futures.popleft()
+                    yield path_, future.result()
+            while futures:
+                path_, future = futures.popleft()
+                yield path_, future.result()
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def is_rotational(*, st_dev: int) -> bool:
+        """/sys/dev/block/MAJ:MIN/queue/rotational (partitions: the parent disk's queue/)"""
+        try:
+            sys_dev = pathlib.Path(f'/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}').resolve(strict=True)
+        except FileNotFoundError as e:
+            return False  # btrfs, tmpfs, nfs, ...: anonymous device
+        for queue_dir in [sys_dev / 'queue', sys_dev.parent / 'queue']:
+            try:
+                return (queue_dir / 'rotational').read_text().strip() == '1'
+            except FileNotFoundError as e:
+                continue
+        return False
+
+    @staticmethod
+    def calc_hash(*, path_: str, hash_fn: Callable[[], Any], st: os.stat_result | None = None, strategy: str = 'readinto') -> 'fs_hash.File | None':
+        """st: lstat of path_ if already known (e.g. DirEntry.stat())"""
+        if st is None:
+            try:
+                st = os.stat(path_, follow_symlinks=False)
+            except FileNotFoundError as e:
+                logger.warning(f'file not found: {path_=}')
+                return None
+        metrics = fs_hash.metrics
+        if metrics is not None:
+            metrics.file_started(path_=path_, size=st.st_size)
+        try:
+            return fs_hash.calc_hash_st(path_=path_, hash_fn=hash_fn, st=st, strategy=strategy)
+        finally:
+            if metrics is not None:
+                metrics.file_finished(path_=path_)
+
+    @staticmethod
+    def calc_hash_st(*, path_: str, hash_fn: Callable[[], Any], st: os.stat_result, strategy: str) -> 'fs_hash.File | None':
+        if stat.S_ISLNK(st.st_mode):
             # realpath = os.path.realpath(path_)
-            target_path = os.readlink(path_)
+            try:
+                target_path = os.readlink(path_)
+            except FileNotFoundError as e:
+                logger.warning(f'file not found: {path_=}')
+                return None
             h = hash_fn()
             h.update(target_path.encode())
-            dt = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc).astimezone()
+            dt = datetime.datetime.fromtimestamp(st.st_mtime, tz=datetime.timezone.utc).astimezone()
             mdate = dt.strftime('%Y-%m-%d.%H:%M:%S.%f') + dt.strftime('%z')[:3] + ':' + dt.strftime('%z')[3:]
-            return fs_hash.File(hash_val=h.hexdigest(), mode=f'{stat.st_mode:06o}', mdate=mdate, size=stat.st_size, path=path_)
-        elif os.path.isfile(path_):
-            with open(path_, 'rb') as f:
-                h = fs_hash.hash_file_with_progress(f=f, hash_fn=hash_fn, path_=path_)
-            dt = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc).astimezone()
+            return fs_hash.File(hash_val=h.hexdigest(), mode=f'{st.st_mode:06o}', mdate=mdate, size=st.st_size, path=path_)
+        elif stat.S_ISREG(st.st_mode):
+            try:
+                f = open(path_, 'rb')
+            except FileNotFoundError as e:
+                logger.warning(f'file not found: {path_=}')
+                return None
+            with f:
+                h = fs_hash.hash_file_with_progress(f=f, hash_fn=hash_fn, path_=path_, strategy=strategy)
+            dt = datetime.datetime.fromtimestamp(st.st_mtime, tz=datetime.timezone.utc).astimezone()
             mdate = dt.strftime('%Y-%m-%d.%H:%M:%S.%f') + dt.strftime('%z')[:3] + ':' + dt.strftime('%z')[3:]
-            return fs_hash.File(hash_val=h.hexdigest(), mode=f'{stat.st_mode:06o}', mdate=mdate, size=stat.st_size, path=path_)
+            return fs_hash.File(hash_val=h.hexdigest(), mode=f'{st.st_mode:06o}', mdate=mdate, size=st.st_size, path=path_)
         logger.warning(f'unsupported file type: {path_=}')
         return None
 
+    class Metrics:
+        """Throughput/ETA counters of an fs_hash run (thread-safe); see --progress and --metrics_jsonl
+
+        read_s/hash_s: summed over hashing threads; read_s >> hash_s: disk-bound, hash_s >> read_s: CPU-bound
+        """
+        LATENCY_BUCKETS = [0.001, 0.01, 0.1, 1.0, 10.0, 100.0]  # seconds; + '>=100s'
+
+        def __init__(self, *, files_total: int | None, bytes_total: int | None):
+            self.lock = threading.Lock()
+            self.t0 = time.monotonic()
+            self.files_total = files_total
+            self.bytes_total = bytes_total
+            self.files_done = 0
+            self.bytes_done = 0  # including the done part of the files in flight
+            self.files_reused = 0
+            self.bytes_reused = 0
+            self.read_s = 0.0
+            self.hash_s = 0.0
+            self.latency_hist = [0] * (len(self.LATENCY_BUCKETS) + 1)
+            self.in_flight: dict[str, list[int | float]] = {}  # path -> [size, bytes done, t_start]
+
+        def file_started(self, *, path_: str, size: int) -> None:
+            with self.lock:
+                self.in_flight[path_] = [size, 0, time.monotonic()]
+
+        def block_done(self, *, path_: str, n: int, read_s: float, hash_s: float) -> None:
+            with self.lock:
+                self.bytes_done += n
+                self.read_s += read_s
+                self.hash_s += hash_s
+                if path_ in self.in_flight:
+                    self.in_flight[path_][1] += n
+
+        def file_finished(self, *, path_: str) -> None:
+            with self.lock:
+                size, done, t_start = self.in_flight.pop(path_)
+                self.files_done += 1
+                self.bytes_done += int(size) - int(done)  # symlinks, files changed while hashing
+                self.latency_hist[bisect.bisect_right(self.LATENCY_BUCKETS, time.monotonic() - t_start)] += 1
+
+        def file_reused(self, *, size: int) -> None:
+            with self.lock:
+                self.files_reused += 1
+                self.bytes_reused += size
+
+        def snapshot(self) -> dict[str, Any]:
+            with self.lock:
+                elapsed = time.monotonic() - self.t0
+                bytes_per_s = self.bytes_done / elapsed if elapsed > 0 else 0.0
+                eta_s = None
+                if self.bytes_total is not None and bytes_per_s > 0:
+                    eta_s = max(self.bytes_total - self.bytes_reused - self.bytes_done, 0) / bytes_per_s
+                return {
+                    'elapsed_s': round(elapsed, 3),
+                    'files_done': self.files_done,
+                    'files_reused': self.files_reused,
+                    'files_total': self.files_total,
+                    'bytes_done': self.bytes_done,
+                    'bytes_reused': self.bytes_reused,
+                    'bytes_total': self.bytes_total,
+                    'bytes_per_s': round(bytes_per_s),
+                    'files_per_s': round(self.files_done / elapsed if elapsed > 0 else 0.0, 3),
+                    'eta_s': None if eta_s is None else round(eta_s, 1),
+                    'read_s': round(self.read_s, 3),
+                    'hash_s': round(self.hash_s, 3),
+                    'latency_hist': dict(zip(self.latency_labels(), self.latency_hist)),
+                    'in_flight_largest': [{'path': path_, 'size': size, 'done': done} for path_, (size, done, t_start) in sorted(self.in_flight.items(), key=lambda kv: -kv[1][0])[:5]],
+                }
+
+        @classmethod
+        def latency_labels(cls) -> list[str]:
+            """
+            >>> fs_hash.Metrics.latency_labels()
+            ['<0.001s', '<0.01s', '<0.1s', '<1s', '<10s', '<100s', '>=100s']
+            """
+            return [f'<{bucket:g}s' for bucket in cls.LATENCY_BUCKETS] + [f'>={cls.LATENCY_BUCKETS[-1]:g}s']
+
+        @staticmethod
+        def status_line(snapshot: dict[str, Any]) -> str:
+            """
+            >>> fs_hash.Metrics.status_line({'files_done': 3, 'files_reused': 1, 'files_total': 10, 'bytes_done': 2 << 30, 'bytes_reused': 0, 'bytes_total': 8 << 30, 'bytes_per_s': 500 << 20, 'files_per_s': 1.5, 'eta_s': 3725.0, 'read_s': 3.0, 'hash_s': 1.0})
+            'files 4/10 | 2.0/8.0 GiB 25.0% | 500.0 MiB/s 1.5 files/s | ETA 1:02:05 | read 75% hash 25%'
+            """
+            files = f'{snapshot["files_done"] + snapshot["files_reused"]}' + ('' if snapshot['files_total'] is None else f'/{snapshot["files_total"]}')
+            gib = f'{(snapshot["bytes_done"] + snapshot["bytes_reused"]) / (1 << 30):.1f}'
+            if snapshot['bytes_total'] is not None:
+                gib += f'/{snapshot["bytes_total"] / (1 << 30):.1f} GiB {(snapshot["bytes_done"] + snapshot["bytes_reused"]) / max(snapshot["bytes_total"], 1) * 100:.1f}%'
+            else:
+                gib += ' GiB'
+            eta = '-' if snapshot['eta_s'] is None else str(datetime.timedelta(seconds=round(snapshot['eta_s'])))
+            read_hash_s = max(snapshot['read_s'] + snapshot['hash_s'], 1e-9)
+            return f'files {files} | {gib} | {snapshot["bytes_per_s"] / (1 << 20):.1f} MiB/s {snapshot["files_per_s"]:.1f} files/s | ETA {eta} | read {snapshot["read_s"] / read_hash_s * 100:.0f}% hash {snapshot["hash_s"] / read_hash_s * 100:.0f}%'
+
+        @contextlib.contextmanager
+        def reporting(self, *, progress: bool, metrics_jsonl: str | None, interval: float) -> Iterator[None]:
+            """status line every second (tty) / interval (not tty) and metrics_jsonl every interval, on a thread"""
+            if not progress and metrics_jsonl is None:
+                yield
+                return
+            stop = threading.Event()
+            f_jsonl = open(metrics_jsonl, 'a') if metrics_jsonl is not None else None
+            tty = sys.stderr.isatty()
+
+            def report() -> None:
+                t_next_jsonl = t_next_status = time.monotonic()
+                while True:
+                    stopped = stop.wait(1.0)
+                    t = time.monotonic()
+                    snapshot = self.snapshot()
+                    if f_jsonl is not None and (stopped or t >= t_next_jsonl):
+                        f_jsonl.write(json.dumps({'time': datetime.datetime.now().astimezone().isoformat(), **snapshot}) + '\n')
+                        f_jsonl.flush()
+                        t_next_jsonl = t + interval
+                    if progress and tty:
+                        print(f'\r\033[K{self.status_line(snapshot)}', end='\n' if stopped else '', file=sys.stderr, flush=True)
+                    elif progress and (stopped or t >= t_next_status):
+                        logger.info(self.status_line(snapshot))
+                        t_next_status = t + interval
+                    if stopped:
+                        return
+
+            thread = threading.Thread(target=report, name='fs_hash_metrics', daemon=True)
+            thread.start()
+            try:
+                yield
+            finally:
+                stop.set()
+                thread.join()
+                if f_jsonl is not None:
+                    f_jsonl.close()
+
+        def log_summary(self) -> None:
+            snapshot = self.snapshot()
+            read_hash_s = max(snapshot['read_s'] + snapshot['hash_s'], 1e-9)
+            rows = [
+                ('elapsed', f'{snapshot["elapsed_s"]:.1f} s'),
+                ('files hashed', f'{snapshot["files_done"]}'),
+                ('files reused', f'{snapshot["files_reused"]}'),
+                ('bytes hashed', f'{snapshot["bytes_done"]} ({snapshot["bytes_done"] / (1 << 30):.2f} GiB)'),
+                ('throughput', f'{snapshot["bytes_per_s"] / (1 << 20):.1f} MiB/s, {snapshot["files_per_s"]:.1f} files/s'),
+                ('read time', f'{snapshot["read_s"]:.1f} s ({snapshot["read_s"] / read_hash_s * 100:.0f}%)'),
+                ('hash time', f'{snapshot["hash_s"]:.1f} s ({snapshot["hash_s"] / read_hash_s * 100:.0f}%)'),
+                ('bound', 'disk' if snapshot['read_s'] > snapshot['hash_s'] else 'cpu'),
+                *((f'latency {label}', f'{count}') for label, count in snapshot['latency_hist'].items() if count),
+            ]
+            width = max(len(name) for name, value in rows)
+            for name, value in rows:
+                logger.info(f'{name:{width}}  {value}')
+
+    STRATEGIES = ['read', 'readinto', 'mmap', 'direct']
+    BLOCK_SIZES = [(1 << 20, 1 << 16), (64 << 20, 1 << 20)]  # (file size <, block size); larger files: BLOCK_SIZE_MAX
+    BLOCK_SIZE_MAX = 4 << 20
+
     @staticmethod
-    def hash_file_with_progress(*, f, hash_fn: Callable[[], Any], path_: str) -> Any:
-        """Hash file and display progress every 10 seconds"""
+    def block_size_of(*, size: int) -> int:
+        """
+        >>> fs_hash.block_size_of(size=1000), fs_hash.block_size_of(size=10 << 20), fs_hash.block_size_of(size=10 << 30)
+        (65536, 1048576, 4194304)
+        """
+        for size_lt, block_size in fs_hash.BLOCK_SIZES:
+            if size < size_lt:
+                return block_size
+        return fs_hash.BLOCK_SIZE_MAX
+
+    @staticmethod
+    def hash_file_with_progress(*, f, hash_fn: Callable[[], Any], path_: str, strategy: str = 'readinto', block_size: int | None = None) -> Any:
+        """Hash file and display progress every 10 seconds
+
+        strategy:
+          read:     f.read() per block (a new bytes per block)
+          readinto: one preallocated buffer, hashed through a memoryview
+          mmap:     memoryview slices of an mmap (no copy to user space)
+          direct:   O_DIRECT into a page-aligned buffer (bypasses the page cache); readinto if unsupported (e.g. tmpfs)
+        block_size: default: block_size_of(file size)
+        """
         h = hash_fn()
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        if block_size is None:
+            block_size = fs_hash.block_size_of(size=size)
+        with contextlib.suppress(OSError):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_NOREUSE)
+        metrics = fs_hash.metrics
         t0 = time.monotonic()
         t_last_progress = t0
-        os.stat(path_)
         n = 0
-        while chunk := f.read(65536):  # https://stackoverflow.com/questions/22058048/hashing-a-file-in-python
+        it = fs_hash.iter_blocks(f=f, path_=path_, size=size, block_size=block_size, strategy=strategy)
+        while True:
+            t_read = time.perf_counter()
+            chunk = next(it, None)
+            if chunk is None:
+                break
+            t_hash = time.perf_counter()
             h.update(chunk)
             n += len(chunk)
+            if metrics is not None:
+                metrics.block_done(path_=path_, n=len(chunk), read_s=t_hash - t_read, hash_s=time.perf_counter() - t_hash)
             t = time.monotonic()
             if t - t_last_progress >= 10:
                 elapsed = t - t0
-                logger.debug(f'{path_=} {elapsed=:.1f} {n=}/{os.stat(path_).st_size=} ({n / os.stat(path_).st_size * 100:.2f}%)')
+                logger.debug(f'{path_=} {elapsed=:.1f} {n=}/{size=} ({n / size * 100:.2f}%)')
                 t_last_progress = t
         return h
 
+    @staticmethod
+    def iter_blocks(*, f, path_: str, size: int, block_size: int, strategy: str) -> Iterator[bytes | memoryview]:
+        """Yield the content of f in blocks; a yielded memoryview is valid until the next one is requested"""
+        if strategy == 'direct':
+            try:
+                fd_direct = os.open(path_, os.O_RDONLY | os.O_DIRECT)
+            except OSError as e:
+                logger.debug(f'O_DIRECT: {e}; fallback to readinto: {path_=}')
+                strategy = 'readinto'
+            else:
+                try:
+                    buf = mmap.mmap(-1, block_size)  # page-aligned, as O_DIRECT requires
+                    mv = memoryview(buf)
+                    try:
+                        n = os.readv(fd_direct, [buf])
+                    except OSError as e:
+                        if e.errno != errno.EINVAL:
+                            raise
+                        # block_size not a multiple of the logical block size, or a filesystem that accepts the open but not the reads
+                        logger.debug(f'O_DIRECT readv: {e}; fallback to readinto: {path_=}')
+                        strategy = 'readinto'
+                    else:
+                        while n:
+                            yield mv[:n]
+                            n = os.readv(fd_direct, [buf])
+                finally:
+                    os.close(fd_direct)
+                if strategy == 'direct':
+                    return
+        if strategy == 'read':
+            while chunk := f.read(block_size):  # https://stackoverflow.com/questions/22058048/hashing-a-file-in-python
+                yield chunk
+        elif strategy == 'readinto':
+            buf = bytearray(block_size)
+            mv = memoryview(buf)
+            while n := f.readinto(buf):
+                yield mv[:n]
+        elif strategy == 'mmap':
+            if size == 0:
+                return
+            mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+            mv = memoryview(mm)
+            for offset in range(0, size, block_size):
+                yield mv[offset:offset + block_size]
+        else:
+            lib.unreachable()
+
     @staticmethod
     def test_this() -> None:
         """
         >>> fs_hash.test_this()
         """
+        # walk(): an OSError of scandir or of one entry skips only that directory or entry
+        with tempfile.TemporaryDirectory() as d:
+            for path_ in ['a/1', 'a/2', 'a/3', 'bad/4', 'c/5']:
+                os.makedirs(os.path.dirname(f'{d}/{path_}'), exist_ok=True)
+                pathlib.Path(f'{d}/{path_}').write_text(path_)
+            scandir = os.scandir
+
+            class Entry:
+                def __init__(self, entry: os.DirEntry):
+                    self.path, self.is_dir, self._stat = entry.path, entry.is_dir, entry.stat
+
+                def stat(self, *, follow_symlinks: bool) -> os.stat_result:
+                    if self.path.endswith('/a/2'):
+                        raise OSError(errno.EIO, os.strerror(errno.EIO), self.path)
+                    return self._stat(follow_symlinks=follow_symlinks)
+
+            @contextlib.contextmanager
+            def scandir_eio(path_: str) -> Iterator[Iterator[Entry]]:
+                if path_.endswith('/bad'):
+                    raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path_)
+                with scandir(path_) as it:
+                    yield (Entry(entry) for entry in it)
+
+            with unittest.mock.patch('os.scandir', scandir_eio):
+                assert sorted(os.path.relpath(path_, d) for path_, st in fs_hash.walk(roots=[d], excludes=[], jobs=1)) == ['a/1', 'a/3', 'c/5']
+
+            # iter_blocks(strategy='direct'): readv EINVAL (unaligned block_size, or O_DIRECT reads rejected) falls back to readinto
+            content = os.urandom(10000)
+            pathlib.Path(f'{d}/direct').write_bytes(content)
+            with open(f'{d}/direct', 'rb') as f, unittest.mock.patch('os.readv', side_effect=OSError(errno.EINVAL, os.strerror(errno.EINVAL))):
+                assert b''.join(bytes(block) for block in fs_hash.iter_blocks(f=f, path_=f'{d}/direct', size=len(content), block_size=1000, strategy='direct')) == content
+
         with tempfile.NamedTemporaryFile('w+') as f_hash, tempfile.NamedTemporaryFile('w+') as f_files:
             proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash --alg=sha1 --hash_txt={f_hash.name} --files_txt={f_files.name}', shell=True, capture_output=True, text=True, check=True)
             assert proc.stdout == ''
@@ -248,6 +991,78 @@ class fs_hash(CLI.Cmd):
             # print(txt, file=open('/dev/pts/0', 'w'))
             assert txt == ''
 
+        with tempfile.TemporaryDirectory() as d:
+            for i in range(20):
+                pathlib.Path(f'{d}/f{i:02}').write_bytes(os.urandom(i * 10000))
+            os.symlink('f00', f'{d}/link')
+            os.mkdir(f'{d}/dir')
+            pathlib.Path(f'{d}/files.txt').write_text(
+                f'drwxrwxr-x          4,096 2006/01/02 15:04:05 {d[1:]}/dir\n' +
+                ''.join(f'-rw-rw-r--              0 2006/01/02 15:04:05 {d[1:]}/f{i:02}\n' for i in reversed(range(20))) +
+                f'lrwxrwxrwx              3 2006/01/02 15:04:05 {d[1:]}/link\n' +
+                f'-rw-rw-r--              0 2006/01/02 15:04:05 {d[1:]}/not_found\n'
+            )
+            txts = []
+            for jobs in [1, 4]:
+                proc = subprocess.run(f'DEBUG=0 c.py -qqq fs_hash --alg=sha1 --hash_txt={d}/hash{jobs}.txt --files_txt={d}/files.txt --jobs={jobs}', shell=True, capture_output=True, text=True, check=True)
+                assert proc.stdout == ''
+                assert proc.stderr == ''
+                txts.append(pathlib.Path(f'{d}/hash{jobs}.txt').read_text())
+            assert txts[0] == txts[1]
+            lines = txts[0].splitlines()
+            assert len(lines) == 21
+            assert lines[0].startswith(f'{hashlib.sha1(b'').hexdigest()} 100')
+            assert lines[0].endswith(f' {d}/f00')
+            assert lines[-1].startswith(f'{hashlib.sha1(b'f00').hexdigest()} 120777 ')
+            assert lines[-1].endswith(f' {d}/link')
+
+            # --progress --metrics_jsonl
+            proc = subprocess.run(f'DEBUG=0 c.py -q fs_hash --alg=sha1 --hash_txt={d}/hash_m.txt --files_txt={d}/files.txt --jobs=2 --progress --metrics_jsonl={d}/metrics.jsonl', shell=True, capture_output=True, text=True, check=True)
+            metrics = [json.loads(line) for line in pathlib.Path(f'{d}/metrics.jsonl').read_text().splitlines()]
+            assert metrics[-1]['files_total'] == 22 and metrics[-1]['files_done'] == 21  # - not_found
+            assert metrics[-1]['bytes_done'] == sum(i * 10000 for i in range(20)) + len('f00')
+            assert sum(metrics[-1]['latency_hist'].values()) == 21
+            assert metrics[-1]['in_flight_largest'] == []
+            assert re.search(r'files 21/22 \| .+ \| ETA ', proc.stderr) is not None
+            assert re.search(r'files hashed +21\n', proc.stderr) is not None
+
+            # --incremental
+            cmd = f'DEBUG=0 c.py -q fs_hash --alg=sha1 --hash_txt={d}/hash1.txt --files_txt={d}/files.txt --incremental'
+            proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
+            assert 'incremental: hash 22 + verify 0, reuse 0 (of 22)' in proc.stderr  # no {hash_txt}.stat yet
+            assert pathlib.Path(f'{d}/hash1.txt').read_text() == txts[0]
+            pathlib.Path(f'{d}/f03').write_bytes(b'modified')
+            proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
+            assert 'incremental: hash 2 + verify 0, reuse 20 (of 22)' in proc.stderr  # f03, not_found
+            txt = pathlib.Path(f'{d}/hash1.txt').read_text()
+            assert f'{hashlib.sha1(b'modified').hexdigest()} 100' in txt
+            # bit rot: same stat, different content
+            txt_rot = txt.replace(hashlib.sha1(b'modified').hexdigest(), '0' * 40)
+            pathlib.Path(f'{d}/hash1.txt').write_text(txt_rot)
+            proc = subprocess.run(f'{cmd} --verify_fraction=1', shell=True, capture_output=True, text=True)
+            assert proc.returncode == 1
+            assert 'incremental: hash 1 + verify 21, reuse 0 (of 22)' in proc.stderr
+            assert re.search(rf"hash changed but stat unchanged \(bit rot\?\): path_='{d}/f03' ", proc.stderr) is not None
+            assert '1 files changed without a stat change (bit rot?)' in proc.stderr
+            assert pathlib.Path(f'{d}/hash1.txt').read_text() == txt_rot  # the stored hash is not overwritten
+            proc = subprocess.run(f'{cmd} --verify_fraction=1', shell=True, capture_output=True, text=True)
+            assert proc.returncode == 1  # still reported on the next run
+
+        # --root
+        with tempfile.TemporaryDirectory() as d, tempfile.TemporaryDirectory() as d_out:
+            for path_ in ['a/1', 'a/b/2', 'a/b/3.o', 'node_modules/x/4', '5']:
+                os.makedirs(os.path.dirname(f'{d}/{path_}'), exist_ok=True)
+                pathlib.Path(f'{d}/{path_}').write_text(path_)
+            os.symlink('a', f'{d}/link')
+            pathlib.Path(f'{d_out}/files.txt').write_text(''.join(f'-rw-rw-r--              0 2006/01/02 15:04:05 {d[1:]}/{path_}\n' for path_ in ['a/1', 'a/b/2', '5', 'link']))
+            proc = subprocess.run(f'DEBUG=0 c.py -qqq fs_hash --alg=sha1 --hash_txt={d_out}/hash_files.txt --files_txt={d_out}/files.txt', shell=True, capture_output=True, text=True, check=True)
+            assert proc.stderr == ''
+            proc = subprocess.run(f"DEBUG=0 c.py -qqq fs_hash --alg=sha1 --hash_txt={d_out}/hash_root.txt --root={d} --exclude=node_modules/ --exclude='*.o' --walk_jobs=3 --jobs=2", shell=True, capture_output=True, text=True, check=True)
+            assert proc.stderr == ''
+            txt = pathlib.Path(f'{d_out}/hash_root.txt').read_text()
+            assert txt == pathlib.Path(f'{d_out}/hash_files.txt').read_text()
+            assert len(txt.splitlines()) == 4
+
 
 # -----------------------------------------------------------------------------
 # command: fs_hash_dups
@@ -260,6 +1075,13 @@ Show duplicate entries in hash_txt(s), sorted by size descending.
 Show at most 100 duplicate groups by default.
 Each line shows: hash mode mdate size source_hash_txt_path path
 Each duplicate group is separated by a blank line.
+
+fs_hash_dups --scan ~/Videos [--scan ...] [hash_txt ...]
+
+Find duplicate regular files in live trees without a full fs_hash pass (source_hash_txt_path: the scan root):
+1. group by size
+2. same size: hash the first and last 64 KiB (files <= 128 KiB: the whole file; final)
+3. same partial hash: hash the whole file
 '''
 
 
@@ -269,6 +1091,10 @@ class fs_hash_dups(CLI.Cmd):
     class Args:
         hash_txts: list[str]
         limit: int
+        scan: list[str]
+        exclude: list[str]
+        alg: str
+        jobs: int
 
     @dataclasses.dataclass(frozen=True, kw_only=True)
     class SourceFile:
@@ -278,8 +1104,12 @@ class fs_hash_dups(CLI.Cmd):
     @classmethod
     def add_parser(cls):
         subparser = CLI.subparsers.add_parser('fs_hash_dups', help='Show duplicate files from hash_txt(s) sorted by size descending', epilog=epilog, formatter_class=CLI.ArgumentDefaultsRawTextHelpFormatter)
-        subparser.add_argument('hash_txts', nargs='+')
+        subparser.add_argument('hash_txts', nargs='*')
         subparser.add_argument('--limit', type=int, default=100, help='max duplicate groups to show')
+        subparser.add_argument('--scan', action='append', default=[], metavar='ROOT', help='find duplicates in this directory (repeatable)')
+        subparser.add_argument('--exclude', action='append', default=[], help='with --scan: rsync-like exclude pattern (see fs_hash --exclude)')
+        subparser.add_argument('--alg', choices=fs_hash.ALGS, default='xxh3', help='with --scan')
+        subparser.add_argument('--jobs', '-j', type=CLI.validator(int, lambda x: x >= 1, 'must be >= 1'), default=1, help='with --scan: number of hashing threads for full hashes')
         subparser.set_defaults(func=lambda args: cls(**args))
 
     def __init__(self, **kwargs):
@@ -291,15 +1121,45 @@ class fs_hash_dups(CLI.Cmd):
         logger.debug(f'{args=}')
         if args.limit < 0:
             raise MyException(f'limit must be >= 0: {args.limit=}')
-
-        groups_by_hash: dict[str, list[fs_hash_dups.SourceFile]] = collections.defaultdict(list)
-        for hash_txt in args.hash_txts:
-            hash_txt = os.path.expanduser(hash_txt)
-            files = fs_hash.read_hash_txt(txt_path=hash_txt)
-            for file in files.values():
-                groups_by_hash[file.hash_val].append(fs_hash_dups.SourceFile(hash_txt_path=hash_txt, file=file))
-
-        dup_groups = [sorted(group, key=lambda source_file: (source_file.file.path, source_file.hash_txt_path)) for group in groups_by_hash.values() if len(group) >= 2]
+        if not args.hash_txts and not args.scan:
+            raise MyException('give hash_txt(s) and/or --scan')
+
+        # pass 1: 64-bit hash keys in 256 arrays (8 bytes/entry) of the hash_txt entries and the scanned files; keys seen twice or more
+        hash_txts = [os.path.expanduser(hash_txt) for hash_txt in args.hash_txts]
+        buckets = [array.array('Q') for _ in range(256)]
+        hash_txt_sizes: set[int] = set()  # a scanned file of one of these sizes may duplicate a hash_txt entry
+        for hash_txt in hash_txts:
+            for record in fs_hash.iter_hash_txt(txt_path=hash_txt):
+                key = record.hash_key()
+                buckets[key >> 56].append(key)
+                hash_txt_sizes.add(record.size)
+        scanned: list[fs_hash_dups.SourceFile] = []
+        if args.scan:
+            roots = [os.path.abspath(os.path.expanduser(root)) for root in args.scan]
+            for root, file in fs_hash_dups.scan(roots=roots, excludes=args.exclude, hash_fn=fs_hash.hash_fn_of(alg=args.alg), jobs=args.jobs, sizes=hash_txt_sizes):
+                scanned.append(fs_hash_dups.SourceFile(hash_txt_path=root, file=file))
+                key = fs_hash.Record(hash_val=file.hash_val, mode=file.mode, mdate=file.mdate, size=file.size, path=file.path).hash_key()
+                buckets[key >> 56].append(key)
+        del hash_txt_sizes
+        dup_keys: set[int] = set()
+        for i, bucket in enumerate(buckets):
+            for key_a, key_b in itertools.pairwise(sorted(bucket)):
+                if key_a == key_b:
+                    dup_keys.add(key_a)
+            buckets[i] = array.array('Q')
+        del buckets
+
+        # pass 2: keep only the entries with duplicate keys; a path listed twice in a hash_txt counts once
+        groups_by_hash: dict[str, dict[tuple[str, str], fs_hash_dups.SourceFile]] = collections.defaultdict(dict)
+        for hash_txt in hash_txts:
+            for record in fs_hash.iter_hash_txt(txt_path=hash_txt):
+                if record.hash_key() in dup_keys:
+                    groups_by_hash[record.hash_val][hash_txt, record.path] = fs_hash_dups.SourceFile(hash_txt_path=hash_txt, file=record.to_file())
+        for source_file in scanned:
+            groups_by_hash[source_file.file.hash_val][source_file.hash_txt_path, source_file.file.path] = source_file
+        del scanned
+
+        dup_groups = [sorted(group.values(), key=lambda source_file: (source_file.file.path, source_file.hash_txt_path)) for group in groups_by_hash.values() if len(group) >= 2]
         dup_groups.sort(key=lambda group: (-group[0].file.size, group[0].file.hash_val, group[0].file.path))
         dup_groups = dup_groups[:args.limit]
 
@@ -310,6 +1170,79 @@ class fs_hash_dups(CLI.Cmd):
                 file = source_file.file
                 print(f'{file.hash_val} {file.mode} {file.mdate} {file.size:12} {source_file.hash_txt_path} {file.path}')
 
+    PARTIAL_SIZE = 65536
+
+    @staticmethod
+    def scan(*, roots: list[str], excludes: list[str], hash_fn: Callable[[], Any], jobs: int, sizes: Container[int] = ()) -> list[tuple[str, 'fs_hash.File']]:
+        """Return (root, file) of the regular files under roots that may have duplicates (size -> partial hash -> full hash), fully hashed
+
+        Files of all roots are compared with each other; a file of one of sizes (e.g. of hash_txt entries) is hashed even if no other file under roots has its size.
+        A root inside another root is skipped.
+        """
+        kept_roots: list[str] = []
+        for root in sorted(roots):
+            if any(os.path.commonpath([root, kept_root]) == kept_root for kept_root in kept_roots):
+                logger.warning(f'skip --scan root inside another root: {root}')
+                continue
+            kept_roots.append(root)
+        by_size: dict[int, list[tuple[str, os.stat_result, str]]] = collections.defaultdict(list)
+        n_files = n_bytes = 0
+        for root in kept_roots:
+            for path_, st in fs_hash.walk(roots=[root], excludes=excludes, jobs=4):
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                by_size[st.st_size].append((path_, st, root))
+                n_files += 1
+                n_bytes += st.st_size
+        n_read = 0
+
+        # same size -> partial hash (head + tail); small files are read whole, so their hash is final
+        files: list[tuple[str, fs_hash.File]] = []
+        by_partial: dict[tuple[int, str], list[tuple[str, os.stat_result, str]]] = collections.defaultdict(list)
+        for size, entries in by_size.items():
+            if len(entries) < 2 and size not in sizes:
+                continue
+            for path_, st, root in entries:
+                if size <= 2 * fs_hash_dups.PARTIAL_SIZE:
+                    file = fs_hash.calc_hash(path_=path_, hash_fn=hash_fn, st=st)
+                    n_read += size
+                    if file is not None:
+                        files.append((root, file))
+                    continue
+                if size in sizes:
+                    by_partial[size, ''].append((path_, st, root))  # no partial hash in hash_txt: hash fully
+                    continue
+                partial = fs_hash_dups.partial_hash(path_=path_, hash_fn=hash_fn, size=size)
+                n_read += 2 * fs_hash_dups.PARTIAL_SIZE
+                if partial is not None:
+                    by_partial[size, partial].append((path_, st, root))
+        del by_size
+
+        # same partial hash (or a hash_txt size) -> full hash
+        entries_full = [entry for (size, partial), entries in by_partial.items() if len(entries) >= 2 or size in sizes for entry in entries]
+        del by_partial
+        roots_by_path = {path_: root for path_, st, root in entries_full}
+        for path_, file in fs_hash.calc_hashes(entries=[(path_, st) for path_, st, root in entries_full], hash_fn=hash_fn, jobs=jobs):
+            if file is not None:
+                files.append((roots_by_path[path_], file))
+                n_read += file.size
+        logger.info(f'{" ".join(kept_roots)}: {n_files} files, read {n_read} of {n_bytes} bytes ({n_read / max(n_bytes, 1) * 100:.2f}%), {len(entries_full)} fully hashed')
+        return files
+
+    @staticmethod
+    def partial_hash(*, path_: str, hash_fn: Callable[[], Any], size: int) -> str | None:
+        """hash of the first and last PARTIAL_SIZE bytes"""
+        try:
+            with open(path_, 'rb') as f:
+                h = hash_fn()
+                h.update(f.read(fs_hash_dups.PARTIAL_SIZE))
+                f.seek(size - fs_hash_dups.PARTIAL_SIZE)
+                h.update(f.read(fs_hash_dups.PARTIAL_SIZE))
+        except FileNotFoundError as e:
+            logger.warning(f'file not found: {path_=}')
+            return None
+        return h.hexdigest()
+
     @staticmethod
     def test_this() -> None:
         """
@@ -351,6 +1284,57 @@ class fs_hash_dups(CLI.Cmd):
             assert proc.stdout == ''
             assert proc.stderr == ''
 
+        # --scan
+        with tempfile.TemporaryDirectory() as d:
+            big = os.urandom(300000)
+            pathlib.Path(f'{d}/big1').write_bytes(big)
+            pathlib.Path(f'{d}/big2').write_bytes(big)
+            pathlib.Path(f'{d}/big3').write_bytes(big[:100000] + os.urandom(100000) + big[200000:])  # same head and tail
+            pathlib.Path(f'{d}/big4').write_bytes(os.urandom(300000))
+            os.mkdir(f'{d}/sub')
+            pathlib.Path(f'{d}/sub/small1').write_bytes(b'small')
+            pathlib.Path(f'{d}/sub/small2').write_bytes(b'small')
+            pathlib.Path(f'{d}/sub/small3').write_bytes(b'SMALL')
+            pathlib.Path(f'{d}/sub/unique').write_bytes(b'unique')
+            os.symlink('big1', f'{d}/link')
+            proc = subprocess.run(f'DEBUG=0 c.py -q fs_hash_dups --alg=sha1 --scan={d}', shell=True, capture_output=True, text=True, check=True)
+            groups = [[line.split(' ')[-2:] for line in group.splitlines()] for group in proc.stdout.split('\n\n')]
+            assert groups == [[[d, f'{d}/big1'], [d, f'{d}/big2']], [[d, f'{d}/sub/small1'], [d, f'{d}/sub/small2']]], groups
+            assert proc.stdout.startswith(f'{hashlib.sha1(big).hexdigest()} 100')
+            assert f'read {4 * 2 * 65536 + 3 * 300000 + 3 * 5} of {4 * 300000 + 3 * 5 + 6} bytes' in proc.stderr, proc.stderr
+            assert ', 3 fully hashed' in proc.stderr  # big1 big2 big3
+
+            # a hash_txt entry whose only duplicates are scanned; a path listed twice is not its own duplicate
+            pathlib.Path(f'{d}/hash.txt').write_text(
+                f'{hashlib.sha1(b"small").hexdigest()} 100644 2006-01-02.15:04:05.999999+09:00            5 /x/small\n' +
+                f'{hashlib.sha1(b"again").hexdigest()} 100644 2006-01-02.15:04:05.999999+09:00            5 /x/again\n' * 2
+            )
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_dups --alg=sha1 --scan={d}/sub {d}/hash.txt', shell=True, capture_output=True, text=True, check=True)
+            groups = [[line.split(' ')[-2:] for line in group.splitlines()] for group in proc.stdout.split('\n\n')]
+            assert groups == [[[f'{d}/sub', f'{d}/sub/small1'], [f'{d}/sub', f'{d}/sub/small2'], [f'{d}/hash.txt', '/x/small']]], groups
+            assert proc.stderr == ''
+
+        # files duplicated across --scan roots; a lone scanned file duplicating a hash_txt entry
+        with tempfile.TemporaryDirectory() as d:
+            os.mkdir(f'{d}/a')
+            os.mkdir(f'{d}/b')
+            big = os.urandom(300000)
+            pathlib.Path(f'{d}/a/big').write_bytes(big)
+            pathlib.Path(f'{d}/b/big').write_bytes(big)
+            pathlib.Path(f'{d}/a/small').write_bytes(b'small')
+            pathlib.Path(f'{d}/b/small').write_bytes(b'small')
+            pathlib.Path(f'{d}/b/lone').write_bytes(big[:200000])
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_dups --alg=sha1 --scan={d}/a --scan={d}/b', shell=True, capture_output=True, text=True, check=True)
+            groups = [[line.split(' ')[-2:] for line in group.splitlines()] for group in proc.stdout.split('\n\n')]
+            assert groups == [[[f'{d}/a', f'{d}/a/big'], [f'{d}/b', f'{d}/b/big']], [[f'{d}/a', f'{d}/a/small'], [f'{d}/b', f'{d}/b/small']]], groups
+            assert proc.stderr == ''
+
+            pathlib.Path(f'{d}/hash.txt').write_text(f'{hashlib.sha1(big[:200000]).hexdigest()} 100644 2006-01-02.15:04:05.999999+09:00       200000 /x/lone\n')
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_dups --alg=sha1 --scan={d}/b {d}/hash.txt', shell=True, capture_output=True, text=True, check=True)
+            groups = [[line.split(' ')[-2:] for line in group.splitlines()] for group in proc.stdout.split('\n\n')]
+            assert groups == [[[f'{d}/b', f'{d}/b/lone'], [f'{d}/hash.txt', '/x/lone']]], groups
+            assert proc.stderr == ''
+
 
 # -----------------------------------------------------------------------------
 # command: fs_hash_analyze_diff
@@ -401,9 +1385,9 @@ class fs_hash_analyze_diff(CLI.Cmd):
     def main(args: 'fs_hash_analyze_diff.Args') -> None:
         logger.debug(f'{args=}')
 
-        removed_by_hash: dict[str, str] = {}  # hash_val -> path
+        removed_by_hash: dict[str, list[str]] = collections.defaultdict(list)  # hash_val -> paths
         removed_by_path: dict[str, str] = {}  # path -> hash_val
-        added_by_hash: dict[str, str] = {}  # hash_val -> path
+        added_by_hash: dict[str, list[str]] = collections.defaultdict(list)  # hash_val -> paths
         added_by_path: dict[str, str] = {}  # path -> hash_val
 
         for line in args.git_diff_file:
@@ -412,13 +1396,13 @@ class fs_hash_analyze_diff(CLI.Cmd):
                 # Parse removed line
                 file = fs_hash.read_hash_txt_str_line(line=line[1:])
                 if file is not None:
-                    removed_by_hash[file.hash_val] = file.path
+                    removed_by_hash[file.hash_val].append(file.path)
                     removed_by_path[file.path] = file.hash_val
             elif line.startswith('+') and not line.startswith('+++'):
                 # Parse added line
                 file = fs_hash.read_hash_txt_str_line(line=line[1:])
                 if file is not None:
-                    added_by_hash[file.hash_val] = file.path
+                    added_by_hash[file.hash_val].append(file.path)
                     added_by_path[file.path] = file.hash_val
 
         # Detect: mod (same path, different hash)
@@ -430,32 +1414,30 @@ class fs_hash_analyze_diff(CLI.Cmd):
             if removed_hash == added_hash:
                 logger.warning(f'(not tested) same path, but same hash: {path=}, {removed_hash=} (mode or mtime changed?)')
             print(f'mod {shlex.quote(path)}')
-            del removed_by_hash[removed_hash]
+            removed_by_hash[removed_hash].remove(path)
             del removed_by_path[path]
-            del added_by_hash[added_hash]
+            added_by_hash[added_hash].remove(path)
             del added_by_path[path]
 
+        fs_hash_analyze_diff.print_mv_add_rm(removed_by_hash=removed_by_hash, added_by_hash=added_by_hash)
+
+    @staticmethod
+    def print_mv_add_rm(*, removed_by_hash: dict[str, list[str]], added_by_hash: dict[str, list[str]]) -> None:
+        """Pair removed and added paths of the same hash as mv (in order); print the rest as add/rm"""
         # Detect: mv (same hash, different path)
-        for hash_val in list(removed_by_hash.keys()):
-            if hash_val not in added_by_hash:
-                continue
-            removed_path = removed_by_hash[hash_val]
-            added_path = added_by_hash[hash_val]
-            if removed_path == added_path:
-                logger.warning(f'(not tested) same hash, but same path (mode or mtime changed?): {removed_path=}, {hash_val=}')
-            print(f'c.py fs_hash_mv {shlex.quote(removed_path)} {shlex.quote(added_path)}')
-            del removed_by_hash[hash_val]
-            del removed_by_path[removed_path]
-            del added_by_hash[hash_val]
-            del added_by_path[added_path]
+        for hash_val, removed_paths in removed_by_hash.items():
+            for removed_path, added_path in zip(removed_paths, added_by_hash.get(hash_val, [])):
+                print(f'c.py fs_hash_mv {shlex.quote(removed_path)} {shlex.quote(added_path)}')
 
         # Detect: add (added but not removed)
-        for hash_val, added_path in added_by_hash.items():
-            print(f'add {shlex.quote(added_path)}')
+        for hash_val, added_paths in added_by_hash.items():
+            for added_path in added_paths[len(removed_by_hash.get(hash_val, [])):]:
+                print(f'add {shlex.quote(added_path)}')
 
         # Detect: rm (removed but not added)
-        for hash_val, removed_path in removed_by_hash.items():
-            print(f'c.py fs_hash_rm {shlex.quote(removed_path)}')
+        for hash_val, removed_paths in removed_by_hash.items():
+            for removed_path in removed_paths[len(added_by_hash.get(hash_val, [])):]:
+                print(f'c.py fs_hash_rm {shlex.quote(removed_path)}')
 
     @staticmethod
     def test_this() -> None:
@@ -484,14 +1466,134 @@ class fs_hash_analyze_diff(CLI.Cmd):
         lines = sorted(proc.stdout.strip().split('\n'))
         expected = sorted([
             'mod /home/wsh/mod.txt',
-            'mv /home/wsh/mv1.txt /home/wsh/mv2.txt',
+            'c.py fs_hash_mv /home/wsh/mv1.txt /home/wsh/mv2.txt',
             'add /home/wsh/add.txt',
-            'rm /home/wsh/rm.txt',
+            'c.py fs_hash_rm /home/wsh/rm.txt',
         ])
         assert lines == expected, f'{lines=} != {expected=}'
         assert proc.stderr == ''
 
 
+# -----------------------------------------------------------------------------
+# command: fs_hash_diff
+
+epilog = r'''
+fs_hash_diff old/xxh3.txt xxh3.txt
+(same output as: git diff -- xxh3.txt | c.py fs_hash_analyze_diff)
+
+mod /home/wsh/mod.txt
+c.py fs_hash_mv /home/wsh/mv1.txt /home/wsh/mv2.txt
+add /home/wsh/add.txt
+c.py fs_hash_rm /home/wsh/rm.txt
+
+Both snapshots must be sorted by path (as written by fs_hash); they are merge-joined in one pass.
+Memory: only the removed/added entries are kept.
+'''
+
+
+# noinspection PyPep8Naming
+class fs_hash_diff(CLI.Cmd):
+    @dataclasses.dataclass(frozen=True, kw_only=True)
+    class Args:
+        old_hash_txt: str
+        new_hash_txt: str
+
+    @classmethod
+    def add_parser(cls):
+        subparser = CLI.subparsers.add_parser('fs_hash_diff', help='Compare two hash_txt snapshots and categorize file changes (mod/mv/add/rm)', epilog=epilog, formatter_class=CLI.ArgumentDefaultsRawTextHelpFormatter)
+        subparser.add_argument('old_hash_txt', help='hash_txt or *.sqlite')
+        subparser.add_argument('new_hash_txt', help='hash_txt or *.sqlite')
+        subparser.set_defaults(func=lambda args: cls(**args))
+
+    def __init__(self, **kwargs):
+        self.args = self.Args(**kwargs)
+        self.__class__.main(self.args)
+
+    @staticmethod
+    def main(args: 'fs_hash_diff.Args') -> None:
+        logger.debug(f'{args=}')
+
+        removed_by_hash: dict[str, list[str]] = collections.defaultdict(list)  # hash_val -> paths
+        added_by_hash: dict[str, list[str]] = collections.defaultdict(list)  # hash_val -> paths
+
+        old_it = fs_hash_diff.iter_sorted(txt_path=os.path.expanduser(args.old_hash_txt))
+        new_it = fs_hash_diff.iter_sorted(txt_path=os.path.expanduser(args.new_hash_txt))
+        old = next(old_it, None)
+        new = next(new_it, None)
+        while old is not None or new is not None:
+            if new is None or (old is not None and old.path < new.path):
+                removed_by_hash[old.hash_val].append(old.path)
+                old = next(old_it, None)
+            elif old is None or new.path < old.path:
+                added_by_hash[new.hash_val].append(new.path)
+                new = next(new_it, None)
+            else:
+                if (old.hash_raw, old.mode, old.mdate, old.size) != (new.hash_raw, new.mode, new.mdate, new.size):
+                    if old.hash_raw == new.hash_raw:
+                        logger.warning(f'(not tested) same path, but same hash: {old.path=}, {old.hash_val=} (mode or mtime changed?)')
+                    print(f'mod {shlex.quote(old.path)}')
+                old = next(old_it, None)
+                new = next(new_it, None)
+
+        fs_hash_analyze_diff.print_mv_add_rm(removed_by_hash=removed_by_hash, added_by_hash=added_by_hash)
+
+    @staticmethod
+    def iter_sorted(*, txt_path: str) -> Iterator['fs_hash.Record']:
+        if not os.path.exists(txt_path):
+            raise MyException(f'not found: {txt_path=}')
+        prev_path = None
+        for record in fs_hash.iter_hash_txt(txt_path=txt_path):
+            if prev_path is not None and not prev_path < record.path:
+                raise MyException(f'{txt_path}: not sorted by path (rewrite it with fs_hash_export): {prev_path=} {record.path=}')
+            prev_path = record.path
+            yield record
+
+    @staticmethod
+    def test_this() -> None:
+        """
+        >>> fs_hash_diff.test_this()
+        """
+        txt_old = textwrap.dedent('''\
+            1111111111111111 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/mod.txt
+            cccccccccccccccc 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/mv1.txt
+            eeeeeeeeeeeeeeee 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/same.txt
+            dddddddddddddddd 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/x/dup1.txt
+            dddddddddddddddd 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/x/dup2.txt
+            dddddddddddddddd 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/x/dup3.txt
+        ''')
+        txt_new = textwrap.dedent('''\
+            aaaaaaaaaaaaaaaa 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/add.txt
+            2222222222222222 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/mod.txt
+            cccccccccccccccc 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/mv2.txt
+            eeeeeeeeeeeeeeee 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/same.txt
+            dddddddddddddddd 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/y/dup1.txt
+            dddddddddddddddd 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/y/dup2.txt
+        ''')
+        with tempfile.NamedTemporaryFile('w+') as f_old, tempfile.NamedTemporaryFile('w+') as f_new:
+            f_old.write(txt_old)
+            f_old.flush()
+            f_new.write(txt_new)
+            f_new.flush()
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_diff {f_old.name} {f_new.name}', shell=True, capture_output=True, text=True, check=True)
+            assert proc.stdout == textwrap.dedent('''\
+                mod /home/wsh/mod.txt
+                c.py fs_hash_mv /home/wsh/mv1.txt /home/wsh/mv2.txt
+                c.py fs_hash_mv /home/wsh/x/dup1.txt /home/wsh/y/dup1.txt
+                c.py fs_hash_mv /home/wsh/x/dup2.txt /home/wsh/y/dup2.txt
+                add /home/wsh/add.txt
+                c.py fs_hash_rm /home/wsh/x/dup3.txt
+            '''), proc.stdout
+            assert proc.stderr == ''
+
+            f_new.seek(0)
+            f_new.truncate()
+            f_new.write(''.join(reversed(txt_new.splitlines(keepends=True))))
+            f_new.flush()
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_diff {f_old.name} {f_new.name}', shell=True, capture_output=True, text=True)
+            assert proc.returncode == 1
+            assert 'not sorted by path' in proc.stderr
+
+
 # -----------------------------------------------------------------------------
 # command: fs_hash_mv
 
@@ -529,10 +1631,17 @@ class fs_hash_mv(CLI.Cmd):
                 (not args.path_a.endswith('/') and args.path_b.endswith('/')):
             raise MyException(f'both path_a and path_b must end with / or not end with /: {args.path_a=}, {args.path_b=}')
 
+        if fs_hash.Db.is_db(args.hash_txt):
+            with fs_hash.Db(args.hash_txt) as db, db.transaction():
+                n = db.mv(args.path_a, args.path_b)
+                logger.info(f'{args.hash_txt}: mv {n} entries')
+            return
+
         with open(f'{args.hash_txt}.lock', 'w') as f_lock:
             logger.info(f'flock {f_lock.name}')
             fcntl.flock(f_lock, fcntl.LOCK_EX)
             logger.info(f'got flock {f_lock.name}')
+            fs_hash_apply.recover(txt_path=args.hash_txt)
             files_from_txt = fs_hash.read_hash_txt(txt_path=args.hash_txt)
             for file in list(files_from_txt.values()):
                 if args.path_a.endswith('/'):
@@ -596,10 +1705,17 @@ class fs_hash_rm(CLI.Cmd):
     def main(args: 'fs_hash_rm.Args') -> None:
         logger.debug(f'{args=}')
 
+        if fs_hash.Db.is_db(args.hash_txt):
+            with fs_hash.Db(args.hash_txt) as db, db.transaction():
+                n = db.rm(args.path_)
+                logger.info(f'{args.hash_txt}: rm {n} entries')
+            return
+
         with open(f'{args.hash_txt}.lock', 'w') as f_lock:
             logger.info(f'flock {f_lock.name}')
             fcntl.flock(f_lock, fcntl.LOCK_EX)
             logger.info(f'got flock {f_lock.name}')
+            fs_hash_apply.recover(txt_path=args.hash_txt)
             files_from_txt = fs_hash.read_hash_txt(txt_path=args.hash_txt)
             for file in list(files_from_txt.values()):
                 if args.path_.endswith('/'):
@@ -627,5 +1743,529 @@ class fs_hash_rm(CLI.Cmd):
         """
         pass
 
+
+# -----------------------------------------------------------------------------
+# command: fs_hash_apply
+
+epilog = r'''
+fs_hash_diff old/xxh3.txt xxh3.txt | c.py fs_hash_apply --hash_txt=xxh3.txt
+git diff -- xxh3.txt | c.py fs_hash_analyze_diff | c.py fs_hash_apply --hash_txt=xxh3.txt
+
+Apply a batch of operations (one per line, shell-quoted; the output of fs_hash_analyze_diff / fs_hash_diff) in one locked pass:
+c.py fs_hash_mv path_a path_b   (also: fs_hash_mv, mv; dir_a/ dir_b/ for directories)
+c.py fs_hash_rm path            (also: fs_hash_rm, rm; dir/ for directories)
+add path                        (hash the file and add/replace its entry)
+mod path                        (same as add)
+
+hash_txt is rewritten once, atomically (temp file + rename).
+{hash_txt}.journal holds the resolved batch while it is being applied; an interrupted batch is replayed by the next fs_hash_apply
+(or fs_hash / fs_hash_mv / fs_hash_rm); a journal cut short before its trailer was never committed and is discarded.
+'''
+
+
+# noinspection PyPep8Naming
+class fs_hash_apply(CLI.Cmd):
+    @dataclasses.dataclass(frozen=True, kw_only=True)
+    class Args:
+        hash_txt: str
+        alg: str
+        ops_file: typing.TextIO
+
+    @dataclasses.dataclass(frozen=True, kw_only=True)
+    class Op:
+        """resolved operation: mv (path_a, path_b), rm (path_), put (file)"""
+        op: Literal['mv', 'rm', 'put']
+        paths: tuple[str, ...] = ()
+        file: 'fs_hash.File | None' = None
+
+        def to_line(self) -> str:
+            if self.op == 'put':
+                assert self.file is not None
+                return shlex.join(['put', fs_hash.format_hash_txt_line(file=self.file).rstrip('\n')]) + '\n'
+            return shlex.join([self.op, *self.paths]) + '\n'
+
+        @staticmethod
+        def from_line(line: str) -> 'fs_hash_apply.Op':
+            op, *args = shlex.split(line)
+            if op == 'put':
+                file = fs_hash.read_hash_txt_str_line(line=args[0])
+                assert file is not None
+                return fs_hash_apply.Op(op='put', file=file)
+            assert op in ['mv', 'rm'], line
+            return fs_hash_apply.Op(op=op, paths=tuple(args))
+
+    @classmethod
+    def add_parser(cls):
+        subparser = CLI.subparsers.add_parser('fs_hash_apply', help='Apply a batch of mv/rm/add operations to the hash database in one locked pass', epilog=epilog, formatter_class=CLI.ArgumentDefaultsRawTextHelpFormatter)
+        subparser.add_argument('--hash_txt', required=True)
+        subparser.add_argument('--alg', choices=fs_hash.ALGS, default='xxh3', help='for add/mod')
+        subparser.add_argument('ops_file', type=argparse.FileType('r'), nargs='?', default='-', help='operations (if not given, read from stdin)')
+        subparser.set_defaults(func=lambda args: cls(**args))
+
+    def __init__(self, **kwargs):
+        self.args = self.Args(**kwargs)
+        self.__class__.main(self.args)
+
+    @staticmethod
+    def main(args: 'fs_hash_apply.Args') -> None:
+        logger.debug(f'{args=}')
+
+        # hash add/mod outside of the lock (as fs_hash does)
+        ops = fs_hash_apply.parse_ops(lines=args.ops_file, hash_fn=fs_hash.hash_fn_of(alg=args.alg))
+        logger.info(f'{len(ops)} operations')
+
+        if fs_hash.Db.is_db(args.hash_txt):
+            with fs_hash.Db(args.hash_txt) as db, db.transaction():
+                for op in ops:
+                    if op.op == 'mv':
+                        db.mv(*op.paths)
+                    elif op.op == 'rm':
+                        db.rm(*op.paths)
+                    else:
+                        assert op.file is not None
+                        db.upsert([op.file])
+            return
+
+        with open(f'{args.hash_txt}.lock', 'w') as f_lock:
+            logger.info(f'flock {f_lock.name}')
+            fcntl.flock(f_lock, fcntl.LOCK_EX)
+            logger.info(f'got flock {f_lock.name}')
+            fs_hash_apply.recover(txt_path=args.hash_txt)
+            if ops:
+                files = fs_hash_apply.apply_ops(files=fs_hash.read_hash_txt(txt_path=args.hash_txt), ops=ops)
+                fs_hash_apply.write_journaled(txt_path=args.hash_txt, files=files, ops=ops)
+            fcntl.flock(f_lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def parse_ops(*, lines: Iterable[str], hash_fn: Callable[[], Any]) -> list['fs_hash_apply.Op']:
+        ops: list[fs_hash_apply.Op] = []
+        for line in lines:
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            if argv[0] == 'c.py':
+                argv = argv[1:]
+            op, *paths = argv
+            op = op.removeprefix('fs_hash_')
+            if op == 'mv' and len(paths) == 2:
+                if paths[0].endswith('/') != paths[1].endswith('/'):
+                    raise MyException(f'both path_a and path_b must end with / or not end with /: {line=}')
+                ops.append(fs_hash_apply.Op(op='mv', paths=(paths[0], paths[1])))
+            elif op == 'rm' and len(paths) == 1:
+                ops.append(fs_hash_apply.Op(op='rm', paths=(paths[0],)))
+            elif op in ['add', 'mod'] and len(paths) == 1:
+                file = fs_hash.calc_hash(path_=paths[0], hash_fn=hash_fn)
+                if file is not None:
+                    ops.append(fs_hash_apply.Op(op='put', file=file))
+            else:
+                raise MyException(f'invalid operation: {line=}')
+        return ops
+
+    @staticmethod
+    def apply_ops(*, files: dict[str, 'fs_hash.File'], ops: list['fs_hash_apply.Op']) -> dict[str, 'fs_hash.File']:
+        """Apply ops in order; directory mv/rm are bisect ranges of the sorted paths
+
+        >>> File = functools.partial(fs_hash.File, hash_val='h', mode='100664', mdate='d', size=1)
+        >>> files = {path: File(path=path) for path in ['/a/1', '/a/2', '/a0', '/b', '/c/1']}
+        >>> ops = [fs_hash_apply.Op(op='mv', paths=('/a/', '/z/')), fs_hash_apply.Op(op='mv', paths=('/b', '/y')), fs_hash_apply.Op(op='rm', paths=('/c/',)), fs_hash_apply.Op(op='put', file=File(path='/x'))]
+        >>> [*fs_hash_apply.apply_ops(files=files, ops=ops)]
+        ['/a0', '/x', '/y', '/z/1', '/z/2']
+        """
+        paths = sorted(files)
+
+        def take(path_: str) -> list[str]:
+            """remove path_ (or path_/*) from paths and return them"""
+            if path_.endswith('/'):
+                lo = bisect.bisect_left(paths, path_)
+                hi = bisect.bisect_left(paths, fs_hash.Db.prefix_range_end(path_), lo)
+            else:
+                lo = bisect.bisect_left(paths, path_)
+                hi = lo + 1 if lo < len(paths) and paths[lo] == path_ else lo
+            taken = paths[lo:hi]
+            del paths[lo:hi]
+            return taken
+
+        def put(file: fs_hash.File) -> None:
+            if file.path not in files:
+                bisect.insort(paths, file.path)
+            files[file.path] = file
+
+        for op in ops:
+            if op.op == 'mv':
+                path_a, path_b = op.paths
+                for path_ in take(path_a):
+                    file = files.pop(path_)
+                    file2 = dataclasses.replace(file, path=path_b + path_[len(path_a):])
+                    logger.debug(f'{file.path=} -> {file2.path=}')
+                    put(file2)
+            elif op.op == 'rm':
+                for path_ in take(op.paths[0]):
+                    logger.debug(f'rm {path_=}')
+                    del files[path_]
+            else:
+                assert op.file is not None
+                put(op.file)
+        return {path_: files[path_] for path_ in paths}
+
+    @staticmethod
+    def write_journaled(*, txt_path: str, files: dict[str, 'fs_hash.File'], ops: list['fs_hash_apply.Op']) -> None:
+        """{txt_path}.tmp -> {txt_path}.journal (ops + sha1 of the new content + trailer) -> rename -> rm journal"""
+        h = hashlib.sha1()
+        with open(f'{txt_path}.tmp', 'w') as f:
+            for file in files.values():
+                line = fs_hash.format_hash_txt_line(file=file)
+                h.update(line.encode())
+                f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(f'{txt_path}.journal', 'w') as f:
+            f.write(fs_hash_apply.format_journal(sha1=h.hexdigest(), ops=ops))
+            f.flush()
+            os.fsync(f.fileno())
+        logger.info(f'write {txt_path}')
+        os.replace(f'{txt_path}.tmp', txt_path)
+        fs_hash_apply.fsync_dir(path_=txt_path)
+        os.unlink(f'{txt_path}.journal')
+        fs_hash_apply.fsync_dir(path_=txt_path)
+
+    @staticmethod
+    def format_journal(*, sha1: str, ops: list['fs_hash_apply.Op']) -> str:
+        """header (sha1 of the new txt_path), op lines, trailer (op count + sha1 of the op lines)
+
+        >>> print(fs_hash_apply.format_journal(sha1='0' * 40, ops=[fs_hash_apply.Op(op='rm', paths=('/a b',))]), end='')
+        fs_hash_apply.journal.v1 0000000000000000000000000000000000000000
+        rm '/a b'
+        fs_hash_apply.journal.end 1 4ddf83c069025a9ad006288bef8c22fdb7f66e2a
+        """
+        lines = [op.to_line() for op in ops]
+        return f'fs_hash_apply.journal.v1 {sha1}\n' + ''.join(lines) + f'fs_hash_apply.journal.end {len(lines)} {hashlib.sha1(''.join(lines).encode()).hexdigest()}\n'
+
+    @staticmethod
+    def parse_journal(*, journal: str) -> 'tuple[str, list[fs_hash_apply.Op]] | None':
+        """(sha1, ops) of a complete journal; None if it was cut short (no valid trailer)"""
+        lines = journal.splitlines(keepends=True)
+        if len(lines) < 2:
+            return None
+        header, *lines, trailer = lines
+        m_header = re.fullmatch(r'fs_hash_apply\.journal\.v1 (?P<sha1>[0-9a-f]{40})\n', header)
+        m_trailer = re.fullmatch(r'fs_hash_apply\.journal\.end (?P<n>\d+) (?P<sha1>[0-9a-f]{40})\n', trailer)
+        if m_header is None or m_trailer is None or int(m_trailer['n']) != len(lines) or hashlib.sha1(''.join(lines).encode()).hexdigest() != m_trailer['sha1']:
+            return None
+        return m_header['sha1'], [fs_hash_apply.Op.from_line(line) for line in lines]
+
+    @staticmethod
+    def recover(*, txt_path: str) -> None:
+        """A leftover {txt_path}.journal: drop it if incomplete (the batch never committed) or if its batch reached txt_path, else replay it
+
+        Call this under {txt_path}.lock before every rewrite of txt_path.
+        """
+        try:
+            journal = pathlib.Path(f'{txt_path}.journal').read_text()
+        except FileNotFoundError as e:
+            return
+        parsed = fs_hash_apply.parse_journal(journal=journal)
+        if parsed is None:
+            logger.warning(f'{txt_path}.journal: incomplete (interrupted before the batch was committed); discard it')
+            os.unlink(f'{txt_path}.journal')
+            return
+        sha1_journal, ops = parsed
+        try:
+            sha1 = hashlib.sha1(pathlib.Path(txt_path).read_bytes()).hexdigest()
+        except FileNotFoundError as e:
+            sha1 = hashlib.sha1(b'').hexdigest()
+        if sha1 == sha1_journal:
+            logger.warning(f'{txt_path}.journal: already applied; remove it')
+            os.unlink(f'{txt_path}.journal')
+            return
+        logger.warning(f'{txt_path}.journal: interrupted batch; replay {len(ops)} operations')
+        files = fs_hash_apply.apply_ops(files=fs_hash.read_hash_txt(txt_path=txt_path), ops=ops)
+        fs_hash_apply.write_journaled(txt_path=txt_path, files=files, ops=ops)
+
+    @staticmethod
+    def fsync_dir(*, path_: str) -> None:
+        fd = os.open(os.path.dirname(os.path.abspath(path_)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def test_this() -> None:
+        """
+        >>> fs_hash_apply.test_this()
+        """
+        txt = textwrap.dedent('''\
+            aaaaaaaaaaaaaaaa 040775 2006-01-02.15:04:05.999999+09:00         4096 /home/wsh/d/
+            bbbbbbbbbbbbbbbb 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/d-x.txt
+            cccccccccccccccc 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/d/a b.txt
+            cccccccccccccccc 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/d/sub/b.txt
+            dddddddddddddddd 120777 2006-01-02.15:04:05.999999+09:00            5 /home/wsh/d0
+        ''')
+        with tempfile.TemporaryDirectory() as d:
+            pathlib.Path(f'{d}/added.txt').write_bytes(b'added')
+            ops = textwrap.dedent(f'''\
+                c.py fs_hash_mv /home/wsh/d/ /home/wsh/e/
+                c.py fs_hash_mv /home/wsh/d0 /home/wsh/d1
+                # comment
+                c.py fs_hash_rm /home/wsh/e/sub/
+                rm /home/wsh/d-x.txt
+                c.py fs_hash_mv '/home/wsh/e/a b.txt' '/home/wsh/e/a c.txt'
+                add {d}/added.txt
+            ''')
+            for hash_txt in [f'{d}/a.txt', f'{d}/a.sqlite']:
+                pathlib.Path(f'{d}/a.txt').write_text(txt)
+                if hash_txt.endswith('.sqlite'):
+                    subprocess.run(f'DEBUG=0 c.py -qq fs_hash_export {d}/a.txt {hash_txt}', shell=True, check=True)
+                proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_apply --alg=sha1 --hash_txt={hash_txt}', shell=True, input=ops, capture_output=True, text=True, check=True)
+                assert proc.stdout == ''
+                assert proc.stderr == ''
+                if hash_txt.endswith('.sqlite'):
+                    subprocess.run(f'DEBUG=0 c.py -qq fs_hash_export {hash_txt} {d}/a.txt', shell=True, check=True)
+                lines = pathlib.Path(f'{d}/a.txt').read_text().splitlines()
+                assert [line.split(maxsplit=4)[4] for line in lines] == ['/home/wsh/d/', '/home/wsh/d1', '/home/wsh/e/a c.txt', f'{d}/added.txt'], lines
+                assert lines[3].startswith(f'{hashlib.sha1(b'added').hexdigest()} 100')
+                assert not os.path.exists(f'{d}/a.txt.journal')
+
+            # interrupted after the journal was written: replayed
+            pathlib.Path(f'{d}/a.txt').write_text(txt)
+            journal = fs_hash_apply.format_journal(sha1='0' * 40, ops=[fs_hash_apply.Op(op='rm', paths=('/home/wsh/d/',)), fs_hash_apply.Op(op='mv', paths=('/home/wsh/d0', '/home/wsh/d1'))])
+            pathlib.Path(f'{d}/a.txt.journal').write_text(journal)
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_apply --hash_txt={d}/a.txt', shell=True, input='', capture_output=True, text=True, check=True)
+            assert 'interrupted batch; replay 2 operations' in proc.stderr
+            assert [line.split(maxsplit=4)[4] for line in pathlib.Path(f'{d}/a.txt').read_text().splitlines()] == ['/home/wsh/d/', '/home/wsh/d-x.txt', '/home/wsh/d1']
+            assert not os.path.exists(f'{d}/a.txt.journal')
+
+            # interrupted after the rename: journal dropped
+            pathlib.Path(f'{d}/a.txt.journal').write_text(fs_hash_apply.format_journal(sha1=hashlib.sha1(pathlib.Path(f'{d}/a.txt').read_bytes()).hexdigest(), ops=[fs_hash_apply.Op(op='rm', paths=('/home/wsh/d1',))]))
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_apply --hash_txt={d}/a.txt', shell=True, input='', capture_output=True, text=True, check=True)
+            assert 'already applied; remove it' in proc.stderr
+            assert pathlib.Path(f'{d}/a.txt').read_text().endswith(' /home/wsh/d1\n')
+            assert not os.path.exists(f'{d}/a.txt.journal')
+
+            # interrupted while the journal was written (no trailer; a cut line would be another op): discarded
+            txt_before = pathlib.Path(f'{d}/a.txt').read_text()
+            for cut in [journal[:journal.index('/home/wsh/d/') + len('/home/wsh/d')], journal[:journal.index('fs_hash_apply.journal.end')], journal[:-2]]:
+                pathlib.Path(f'{d}/a.txt.journal').write_text(cut)
+                proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_apply --hash_txt={d}/a.txt', shell=True, input='', capture_output=True, text=True, check=True)
+                assert 'incomplete (interrupted before the batch was committed); discard it' in proc.stderr
+                assert pathlib.Path(f'{d}/a.txt').read_text() == txt_before
+                assert not os.path.exists(f'{d}/a.txt.journal')
+
+            # fs_hash_rm / fs_hash_mv / fs_hash replay a leftover journal before rewriting hash_txt
+            for cmd in ['fs_hash_rm /nonexistent', 'fs_hash_mv /nonexistent /nonexistent2', f'fs_hash --alg=sha1 --root={d}/empty']:
+                os.makedirs(f'{d}/empty', exist_ok=True)
+                pathlib.Path(f'{d}/a.txt').write_text(txt)
+                pathlib.Path(f'{d}/a.txt.journal').write_text(journal)
+                proc = subprocess.run(f'DEBUG=0 c.py -qq {cmd} --hash_txt={d}/a.txt', shell=True, capture_output=True, text=True, check=True)
+                assert 'interrupted batch; replay 2 operations' in proc.stderr
+                assert [line.split(maxsplit=4)[4] for line in pathlib.Path(f'{d}/a.txt').read_text().splitlines()] == ['/home/wsh/d/', '/home/wsh/d-x.txt', '/home/wsh/d1']
+                assert not os.path.exists(f'{d}/a.txt.journal')
+
+
+# -----------------------------------------------------------------------------
+# command: fs_hash_export
+
+epilog = r'''
+fs_hash_export xxh3.sqlite xxh3.txt  # export (same bytes as write_hash_txt(); for git diff / fs_hash_analyze_diff)
+fs_hash_export xxh3.txt xxh3.sqlite  # import
+'''
+
+
+# noinspection PyPep8Naming
+class fs_hash_export(CLI.Cmd):
+    @dataclasses.dataclass(frozen=True, kw_only=True)
+    class Args:
+        src: str
+        dst: str
+
+    @classmethod
+    def add_parser(cls):
+        subparser = CLI.subparsers.add_parser('fs_hash_export', help='Convert the hash database between hash_txt and *.sqlite', epilog=epilog, formatter_class=CLI.ArgumentDefaultsRawTextHelpFormatter)
+        subparser.add_argument('src', help='hash_txt or *.sqlite')
+        subparser.add_argument('dst', help='hash_txt or *.sqlite (overwritten)')
+        subparser.set_defaults(func=lambda args: cls(**args))
+
+    def __init__(self, **kwargs):
+        self.args = self.Args(**kwargs)
+        self.__class__.main(self.args)
+
+    @staticmethod
+    def main(args: 'fs_hash_export.Args') -> None:
+        logger.debug(f'{args=}')
+
+        with contextlib.ExitStack() as stack:
+            if fs_hash.Db.is_db(args.src):
+                if not os.path.exists(args.src):
+                    raise MyException(f'not found: {args.src=}')
+                files: Iterable[fs_hash.File] = stack.enter_context(fs_hash.Db(args.src)).iter_files()
+            else:
+                with open(f'{args.src}.lock', 'w') as f_lock:
+                    fcntl.flock(f_lock, fcntl.LOCK_SH)
+                    files = fs_hash.read_hash_txt(txt_path=args.src).values()
+
+            logger.info(f'write {args.dst}')
+            if fs_hash.Db.is_db(args.dst):
+                with fs_hash.Db(args.dst) as db, db.transaction():
+                    db.conn.execute('DELETE FROM files')
+                    db.upsert(files)
+            else:
+                with open(args.dst, 'w') as f:
+                    for file in files:
+                        f.write(fs_hash.format_hash_txt_line(file=file))
+
+    @staticmethod
+    def test_this() -> None:
+        """
+        >>> fs_hash_export.test_this()
+        """
+        txt = textwrap.dedent('''\
+            aaaaaaaaaaaaaaaa 040775 2006-01-02.15:04:05.999999+09:00         4096 /home/wsh/d/
+            bbbbbbbbbbbbbbbb 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/d-x.txt
+            cccccccccccccccc 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/d/a.txt
+            cccccccccccccccc 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/d/sub/b.txt
+            dddddddddddddddd 120777 2006-01-02.15:04:05.999999+09:00            5 /home/wsh/d0
+            eeeeeeeeeeeeeeee 100664 2006-01-02.15:04:05.999999+09:00   1234567890 /home/wsh/\u3042.txt
+        ''')
+        with tempfile.TemporaryDirectory() as d:
+            pathlib.Path(f'{d}/a.txt').write_text(txt)
+            pathlib.Path(f'{d}/b.txt').write_text(txt)
+            subprocess.run(f'DEBUG=0 c.py -qq fs_hash_export {d}/a.txt {d}/a.sqlite', shell=True, check=True)
+            subprocess.run(f'DEBUG=0 c.py -qq fs_hash_export {d}/a.sqlite {d}/a2.txt', shell=True, check=True)
+            assert pathlib.Path(f'{d}/a2.txt').read_bytes() == txt.encode()
+
+            with fs_hash.Db(f'{d}/a.sqlite') as db:
+                assert db.get('/home/wsh/d/a.txt') == fs_hash.read_hash_txt_str_line(line=txt.splitlines()[2])
+                assert db.get('/home/wsh/none') is None
+                assert [file.path for file in db.get_by_hash('cccccccccccccccc')] == ['/home/wsh/d/a.txt', '/home/wsh/d/sub/b.txt']
+                assert [file.path for file in db.iter_files('/home/wsh/d/')] == ['/home/wsh/d/a.txt', '/home/wsh/d/sub/b.txt']
+
+            for hash_txt in [f'{d}/a.sqlite', f'{d}/b.txt']:
+                subprocess.run(f'DEBUG=0 c.py -qq fs_hash_mv --hash_txt={hash_txt} /home/wsh/d/ /home/wsh/e/', shell=True, check=True)
+                subprocess.run(f'DEBUG=0 c.py -qq fs_hash_mv --hash_txt={hash_txt} /home/wsh/d0 /home/wsh/d1', shell=True, check=True)
+                subprocess.run(f'DEBUG=0 c.py -qq fs_hash_rm --hash_txt={hash_txt} /home/wsh/e/sub/', shell=True, check=True)
+                subprocess.run(f'DEBUG=0 c.py -qq fs_hash_rm --hash_txt={hash_txt} /home/wsh/d-x.txt', shell=True, check=True)
+            subprocess.run(f'DEBUG=0 c.py -qq fs_hash_export {d}/a.sqlite {d}/a3.txt', shell=True, check=True)
+            assert pathlib.Path(f'{d}/a3.txt').read_text() == pathlib.Path(f'{d}/b.txt').read_text() == textwrap.dedent('''\
+                aaaaaaaaaaaaaaaa 040775 2006-01-02.15:04:05.999999+09:00         4096 /home/wsh/d/
+                dddddddddddddddd 120777 2006-01-02.15:04:05.999999+09:00            5 /home/wsh/d1
+                cccccccccccccccc 100664 2006-01-02.15:04:05.999999+09:00           42 /home/wsh/e/a.txt
+                eeeeeeeeeeeeeeee 100664 2006-01-02.15:04:05.999999+09:00   1234567890 /home/wsh/\u3042.txt
+            ''')
+
+
+# -----------------------------------------------------------------------------
+# command: fs_hash_bench
+
+epilog = r'''
+fs_hash_bench                            # 1 GiB temp file in $TMPDIR; page cache dropped before each run
+fs_hash_bench --dir=/mnt/hdd --size_mib=4096
+fs_hash_bench --file=/path/to/large.mkv --cached --block_sizes=65536,1048576,4194304
+
+alg      strategy  block_size     GB/s
+sha1     read         4194304    1.234
+...
+'''
+
+
+# noinspection PyPep8Naming
+class fs_hash_bench(CLI.Cmd):
+    @dataclasses.dataclass(frozen=True, kw_only=True)
+    class Args:
+        file: str | None
+        dir: str | None
+        size_mib: int
+        algs: list[str]
+        strategies: list[str]
+        block_sizes: list[int] | None
+        cached: bool
+        repeat: int
+
+    @classmethod
+    def add_parser(cls):
+        subparser = CLI.subparsers.add_parser('fs_hash_bench', help='Benchmark hash_file_with_progress() per algorithm / read strategy / block size', epilog=epilog, formatter_class=CLI.ArgumentDefaultsRawTextHelpFormatter)
+        subparser.add_argument('--file', help='file to hash (default: a random temp file in --dir)')
+        subparser.add_argument('--dir', help='directory for the temp file (default: $TMPDIR)')
+        subparser.add_argument('--size_mib', type=CLI.validator(int, lambda x: x >= 1, 'must be >= 1'), default=1024, help='temp file size')
+        subparser.add_argument('--algs', type=lambda x: x.split(','), default=['sha1', 'xxh3', 'xxh128'], help=f'comma separated: {",".join(fs_hash.ALGS)}')
+        subparser.add_argument('--strategies', type=lambda x: x.split(','), default=fs_hash.STRATEGIES, help='comma separated')
+        subparser.add_argument('--block_sizes', type=CLI.validator(lambda x: [int(block_size) for block_size in x.split(',')], lambda x: all(block_size > 0 and block_size % 4096 == 0 for block_size in x), 'must be multiples of 4096 (O_DIRECT)'), help='comma separated (default: block_size_of(file size))')
+        subparser.add_argument('--cached', action='store_true', help='measure page-cache hits (default: drop the file from the page cache before each run)')
+        subparser.add_argument('--repeat', type=CLI.validator(int, lambda x: x >= 1, 'must be >= 1'), default=3, help='report the best of N runs')
+        subparser.set_defaults(func=lambda args: cls(**args))
+
+    def __init__(self, **kwargs):
+        self.args = self.Args(**kwargs)
+        self.__class__.main(self.args)
+
+    @staticmethod
+    def main(args: 'fs_hash_bench.Args') -> None:
+        logger.debug(f'{args=}')
+        for alg in args.algs:
+            if alg not in fs_hash.ALGS:
+                raise MyException(f'unknown alg: {alg=}; choose from {fs_hash.ALGS}')
+        for strategy in args.strategies:
+            if strategy not in fs_hash.STRATEGIES:
+                raise MyException(f'unknown strategy: {strategy=}; choose from {fs_hash.STRATEGIES}')
+
+        with contextlib.ExitStack() as stack:
+            path_ = args.file
+            if path_ is None:
+                f_tmp = stack.enter_context(tempfile.NamedTemporaryFile('wb', dir=args.dir, prefix='fs_hash_bench.'))
+                logger.info(f'write {args.size_mib} MiB: {f_tmp.name}')
+                for _ in range(args.size_mib):
+                    f_tmp.write(os.urandom(1 << 20))
+                f_tmp.flush()
+                os.fsync(f_tmp.fileno())  # dirty pages cannot be dropped
+                path_ = f_tmp.name
+            size = os.stat(path_).st_size
+
+            print(f'{"alg":8} {"strategy":9} {"block_size":>10} {"GB/s":>8}')
+            for alg in args.algs:
+                hash_fn = fs_hash.hash_fn_of(alg=alg)
+                for strategy in args.strategies:
+                    for block_size in args.block_sizes or [None]:
+                        elapsed = fs_hash_bench.measure(path_=path_, hash_fn=hash_fn, strategy=strategy, block_size=block_size, cached=args.cached, repeat=args.repeat)
+                        print(f'{alg:8} {strategy:9} {block_size or fs_hash.block_size_of(size=size):10} {size / elapsed / 1e9:8.3f}', flush=True)
+
+    @staticmethod
+    def measure(*, path_: str, hash_fn: Callable[[], Any], strategy: str, block_size: int | None, cached: bool, repeat: int) -> float:
+        """best elapsed seconds of repeat runs"""
+        elapsed_min = float('inf')
+        for _ in range(repeat + (1 if cached else 0)):  # cached: warm up first
+            with open(path_, 'rb') as f:
+                if not cached:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                t0 = time.perf_counter()
+                fs_hash.hash_file_with_progress(f=f, hash_fn=hash_fn, path_=path_, strategy=strategy, block_size=block_size)
+                elapsed_min = min(elapsed_min, time.perf_counter() - t0)
+        return elapsed_min
+
+    @staticmethod
+    def test_this() -> None:
+        """
+        >>> fs_hash_bench.test_this()
+        """
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            data = os.urandom(3 * (1 << 20) + 12345)
+            f.write(data)
+            f.flush()
+            for strategy in fs_hash.STRATEGIES:
+                for block_size in [None, 4096, 1 << 20]:
+                    with open(f.name, 'rb') as f2:
+                        h = fs_hash.hash_file_with_progress(f=f2, hash_fn=hashlib.sha1, path_=f.name, strategy=strategy, block_size=block_size)
+                    assert h.hexdigest() == hashlib.sha1(data).hexdigest(), (strategy, block_size)
+            with tempfile.NamedTemporaryFile('w+b') as f_empty, open(f_empty.name, 'rb') as f2:
+                assert fs_hash.hash_file_with_progress(f=f2, hash_fn=hashlib.sha1, path_=f_empty.name, strategy='mmap').hexdigest() == hashlib.sha1(b'').hexdigest()
+
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_bench --file={f.name} --algs=sha1 --strategies=read,mmap --block_sizes=65536,1048576 --repeat=1', shell=True, capture_output=True, text=True, check=True)
+            lines = proc.stdout.splitlines()
+            assert lines[0].split() == ['alg', 'strategy', 'block_size', 'GB/s']
+            assert [line.split()[:3] for line in lines[1:]] == [['sha1', 'read', '65536'], ['sha1', 'read', '1048576'], ['sha1', 'mmap', '65536'], ['sha1', 'mmap', '1048576']]
+            assert proc.stderr == ''
+
+            proc = subprocess.run(f'DEBUG=0 c.py -qq fs_hash_bench --file={f.name} --algs=sha1 --strategies=direct --block_sizes=65536,1000 --repeat=1', shell=True, capture_output=True, text=True)
+            assert proc.returncode == 2
+            assert 'must be multiples of 4096' in proc.stderr
+
 # -----------------------------------------------------------------------------
 # EOF
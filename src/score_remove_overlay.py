@@ -2,12 +2,15 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import argparse
+import concurrent.futures
 import logging
+import os
 import pathlib
 import statistics
 import sys
 import typing as t
 
+import numpy as np
 from PIL import Image
 
 
@@ -16,6 +19,7 @@ Examples:
   score_remove_overlay.py process just_img just_img_clean
   score_remove_overlay.py process just_img just_img_clean --pattern '*.webp'
   score_remove_overlay.py process just_img just_img_clean --min_chroma 14 --cursor_min_column_pixels 20
+  score_remove_overlay.py process just_img just_img_clean --jobs 0  # one worker process per CPU; up-to-date outputs are skipped
 '''[1:]
 
 
@@ -55,34 +59,39 @@ class ArgumentDefaultsRawTextHelpFormatter(argparse.ArgumentDefaultsHelpFormatte
     pass
 
 
-def luma(rgb: tuple[int, int, int]) -> float:
-    r, g, b = rgb
+def luma(rgb: np.ndarray) -> np.ndarray:
+    """Rec. 601 luma of an (..., 3) RGB array, as float64."""
+    r, g, b = (rgb[..., channel].astype(np.float64) for channel in range(3))
     return 0.299 * r + 0.587 * g + 0.114 * b
 
 
-def chroma(rgb: tuple[int, int, int]) -> int:
-    return max(rgb) - min(rgb)
+def chroma(rgb: np.ndarray) -> np.ndarray:
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    return np.maximum(np.maximum(r, g), b) - np.minimum(np.minimum(r, g), b)
 
 
-def neutralize(rgb: tuple[int, int, int]) -> tuple[int, int, int]:
-    y = int(round(luma(rgb)))
+def neutralize(y_luma: np.ndarray) -> np.ndarray:
+    y = np.rint(y_luma)
     # Score backgrounds are white or pale gray. Push colored overlay backgrounds
     # back toward neutral paper without making antialiased ink disappear.
-    if y >= 215:
-        y = 255
-    return (y, y, y)
+    y[y >= 215] = 255
+    return y.astype(np.uint8)
 
 
-def is_colored_overlay(rgb: tuple[int, int, int], args: argparse.Namespace) -> bool:
-    if luma(rgb) < args.min_overlay_luma:
-        return False
-    return chroma(rgb) >= args.min_chroma
+def colored_overlay_mask(y_luma: np.ndarray, c: np.ndarray, args: argparse.Namespace) -> np.ndarray:
+    return (y_luma >= args.min_overlay_luma) & (c >= args.min_chroma)
 
 
-def is_cursor_pixel(rgb: tuple[int, int, int], args: argparse.Namespace) -> bool:
-    if luma(rgb) < args.min_cursor_luma:
-        return False
-    return chroma(rgb) >= args.cursor_min_chroma
+def cursor_pixel_mask(y_luma: np.ndarray, c: np.ndarray, args: argparse.Namespace) -> np.ndarray:
+    return (y_luma >= args.min_cursor_luma) & (c >= args.cursor_min_chroma)
+
+
+def column_counts_and_spans(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Per column of mask: the number of set pixels and the rows from the first to the last one (garbage if none)."""
+    height = mask.shape[0]
+    first = mask.argmax(axis=0)
+    last = height - 1 - mask[::-1].argmax(axis=0)
+    return mask.sum(axis=0), last - first + 1
 
 
 def expand_columns(columns: set[int], width: int, radius: int) -> set[int]:
@@ -103,98 +112,94 @@ def contiguous_groups(values: set[int]) -> list[list[int]]:
     return groups
 
 
-def detect_cursor_columns(src: Image.Image, args: argparse.Namespace) -> set[int]:
-    width, height = src.size
-    pix = src.load()
-    candidate_columns: set[int] = set()
-    min_pixels = args.cursor_min_column_pixels
-    if min_pixels <= 0:
-        min_pixels = max(8, height // 12)
-    for x in range(width):
-        ys = [y for y in range(height) if is_cursor_pixel(pix[x, y], args)]
-        if len(ys) < min_pixels:
-            continue
-        span = ys[-1] - ys[0] + 1
-        if span >= args.cursor_min_vertical_span:
-            candidate_columns.add(x)
+def narrow_columns(candidate_columns: np.ndarray, width: int, args: argparse.Namespace) -> set[int]:
     columns: set[int] = set()
-    for group in contiguous_groups(candidate_columns):
+    for group in contiguous_groups(set(candidate_columns.tolist())):
         if len(group) <= args.cursor_max_width:
             columns.update(group)
     return expand_columns(columns, width, args.cursor_expand)
 
 
-def detect_vertical_artifact_columns(img: Image.Image, args: argparse.Namespace) -> set[int]:
-    width, height = img.size
-    pix = img.load()
-    candidate_columns: set[int] = set()
-    min_pixels = max(8, int(height * args.artifact_min_column_ratio))
-    for x in range(width):
-        ys: list[int] = []
-        values: list[float] = []
-        for y in range(height):
-            value = luma(pix[x, y])
-            if args.artifact_min_luma <= value <= args.artifact_max_luma:
-                ys.append(y)
-                values.append(value)
-        if len(ys) < min_pixels:
-            continue
-        if ys[-1] - ys[0] + 1 < args.cursor_min_vertical_span:
-            continue
-        if statistics.median(values) <= args.artifact_max_median_luma:
-            candidate_columns.add(x)
-    columns: set[int] = set()
-    for group in contiguous_groups(candidate_columns):
-        if len(group) <= args.cursor_max_width:
-            columns.update(group)
-    return expand_columns(columns, width, args.cursor_expand)
+def detect_cursor_columns(y_luma: np.ndarray, c: np.ndarray, args: argparse.Namespace) -> set[int]:
+    height, width = y_luma.shape
+    min_pixels = args.cursor_min_column_pixels
+    if min_pixels <= 0:
+        min_pixels = max(8, height // 12)
+    counts, spans = column_counts_and_spans(cursor_pixel_mask(y_luma, c, args))
+    candidate_columns = np.flatnonzero((counts >= min_pixels) & (spans >= args.cursor_min_vertical_span))
+    return narrow_columns(candidate_columns, width, args)
 
 
-def column_neighbor_color(img: Image.Image, x: int, y: int, cursor_columns: set[int]) -> tuple[int, int, int]:
-    width, _height = img.size
-    pix = img.load()
-    samples: list[tuple[int, int, int]] = []
-    for direction in (-1, 1):
-        nx = x + direction
-        while 0 <= nx < width and nx in cursor_columns:
-            nx += direction
-        if 0 <= nx < width:
-            samples.append(pix[nx, y])
-    if len(samples) == 2:
-        return tuple(int(round(statistics.mean(values))) for values in zip(*samples))
-    if samples:
-        return samples[0]
-    return (255, 255, 255)
+def detect_vertical_artifact_columns(y_luma: np.ndarray, args: argparse.Namespace) -> set[int]:
+    height, width = y_luma.shape
+    mask = (y_luma >= args.artifact_min_luma) & (y_luma <= args.artifact_max_luma)
+    min_pixels = max(8, int(height * args.artifact_min_column_ratio))
+    counts, spans = column_counts_and_spans(mask)
+    candidate_columns = np.flatnonzero((counts >= min_pixels) & (spans >= args.cursor_min_vertical_span))
+    if len(candidate_columns):
+        # Median of the in-range values per column: sort them ahead of the out-of-range ones (inf) and average the
+        # two middle values (the same one twice for odd counts), as statistics.median does.
+        values = np.where(mask[:, candidate_columns], y_luma[:, candidate_columns], np.inf)
+        values.sort(axis=0)
+        n = counts[candidate_columns]
+        positions = np.arange(len(candidate_columns))
+        medians = (values[(n - 1) // 2, positions] + values[n // 2, positions]) / 2
+        candidate_columns = candidate_columns[medians <= args.artifact_max_median_luma]
+    return narrow_columns(candidate_columns, width, args)
+
+
+def fill_columns_from_neighbors(img: np.ndarray, columns: set[int]) -> None:
+    """Replace every pixel in columns with the rounded mean of the nearest pixels left and right of it in its row
+    outside columns; with only one side inside the image, that side's pixel; with none, white."""
+    width = img.shape[1]
+    in_columns = np.zeros(width, dtype=bool)
+    in_columns[list(columns)] = True
+    xs = np.flatnonzero(in_columns)
+    positions = np.arange(width)
+    left = np.maximum.accumulate(np.where(in_columns, -1, positions))[xs]
+    right = np.minimum.accumulate(np.where(in_columns, width, positions)[::-1])[::-1][xs]
+    left_pixels = img[:, np.clip(left, 0, width - 1)].astype(np.int16)
+    right_pixels = img[:, np.clip(right, 0, width - 1)].astype(np.int16)
+    has_left = (left >= 0)[None, :, None]
+    has_right = (right < width)[None, :, None]
+    img[:, xs] = np.where(
+        has_left & has_right,
+        np.rint((left_pixels + right_pixels) / 2),
+        np.where(has_left, left_pixels, np.where(has_right, right_pixels, 255)),
+    ).astype(np.uint8)
 
 
 def process_image(path: pathlib.Path, out_path: pathlib.Path, args: argparse.Namespace) -> tuple[int, int]:
     src = Image.open(path).convert('RGB')
-    dst = src.copy()
-    src_pix = src.load()
-    dst_pix = dst.load()
-    width, height = src.size
+    rgb = np.asarray(src)
+    height = rgb.shape[0]
+    src_luma = luma(rgb)
+    src_chroma = chroma(rgb)
 
-    cursor_columns = detect_cursor_columns(src, args)
-    overlay_pixels = 0
-    cursor_pixels = 0
+    cursor_columns = detect_cursor_columns(src_luma, src_chroma, args)
 
-    for y in range(height):
-        for x in range(width):
-            rgb = src_pix[x, y]
-            if is_colored_overlay(rgb, args):
-                dst_pix[x, y] = neutralize(rgb)
-                overlay_pixels += 1
+    dst = rgb.copy()
+    overlay = colored_overlay_mask(src_luma, src_chroma, args)
+    dst[overlay] = neutralize(src_luma[overlay])[:, None]
+    overlay_pixels = int(np.count_nonzero(overlay))
 
-    cursor_columns.update(detect_vertical_artifact_columns(dst, args))
+    cursor_columns.update(detect_vertical_artifact_columns(luma(dst), args))
     # Run cursor repair after broad overlay neutralization so a thin playback
     # line or its compression shadow is replaced from already-clean neighbors.
-    for y in range(height):
-        for x in cursor_columns:
-            dst_pix[x, y] = column_neighbor_color(dst, x, y, cursor_columns)
-            cursor_pixels += 1
+    fill_columns_from_neighbors(dst, cursor_columns)
+    cursor_pixels = height * len(cursor_columns)
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    dst.save(out_path)
+    out = src.copy()  # keeps src.info (e.g. an ICC profile) for save()
+    out.paste(Image.fromarray(dst))
+    # Write to a temporary file first: an interrupted save must not leave a partial output that is newer than its
+    # input, which is_up_to_date() would then skip.
+    tmp_path = out_path.with_name(out_path.name + '.tmp')
+    try:
+        out.save(tmp_path, format=Image.registered_extensions().get(out_path.suffix.lower()))
+        os.replace(tmp_path, out_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
     return overlay_pixels, cursor_pixels
 
 
@@ -202,21 +207,58 @@ def iter_images(input_dir: pathlib.Path, pattern: str) -> list[pathlib.Path]:
     return sorted(path for path in input_dir.glob(pattern) if path.is_file())
 
 
+def is_up_to_date(path: pathlib.Path, out_path: pathlib.Path) -> bool:
+    try:
+        return out_path.stat().st_mtime_ns > path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def process_images(
+    pending: list[tuple[pathlib.Path, pathlib.Path]],
+    args: argparse.Namespace,
+    jobs: int,
+) -> t.Iterator[tuple[int, int]]:
+    """process_image results for pending, in order. With jobs > 1 the images go to a pool of worker processes, so
+    decoding, cleaning and encoding of different images overlap."""
+    if jobs <= 1 or len(pending) <= 1:
+        for path, out_path in pending:
+            yield process_image(path, out_path, args)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as executor:
+        futures = [executor.submit(process_image, path, out_path, args) for path, out_path in pending]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
 def process(args: argparse.Namespace) -> int:
     input_dir = args.input_dir
     output_dir = args.output_dir
+    if args.jobs < 0:
+        raise SystemExit('--jobs must be 0 (one per CPU) or positive')
+    jobs = args.jobs or os.cpu_count() or 1
     paths = iter_images(input_dir, args.pattern)
     if not paths:
         raise SystemExit(f'no files matched: {input_dir / args.pattern}')
-    total_overlay = 0
-    total_cursor = 0
+    pending: list[tuple[pathlib.Path, pathlib.Path]] = []
     for path in paths:
         out_path = output_dir / path.name
-        overlay_pixels, cursor_pixels = process_image(path, out_path, args)
+        if not args.force and is_up_to_date(path, out_path):
+            logger.debug('%s -> %s up to date', path, out_path)
+            continue
+        pending.append((path, out_path))
+    total_overlay = 0
+    total_cursor = 0
+    for (overlay_pixels, cursor_pixels), (path, out_path) in zip(process_images(pending, args, jobs), pending):
         total_overlay += overlay_pixels
         total_cursor += cursor_pixels
         logger.info('%s -> %s overlay=%d cursor=%d', path, out_path, overlay_pixels, cursor_pixels)
-    logger.info('processed=%d overlay=%d cursor=%d', len(paths), total_overlay, total_cursor)
+    logger.info('processed=%d skipped=%d overlay=%d cursor=%d', len(pending), len(paths) - len(pending), total_overlay,
+                total_cursor)
     return 0
 
 
@@ -231,6 +273,8 @@ def main() -> int:
     subparser.add_argument('input_dir', type=pathlib.Path)
     subparser.add_argument('output_dir', type=pathlib.Path)
     subparser.add_argument('--pattern', default='*.webp')
+    subparser.add_argument('-j', '--jobs', type=int, default=1, help='worker processes; 0: one per CPU')
+    subparser.add_argument('--force', action='store_true', help='also process images whose output is newer than the input')
     subparser.add_argument('--min_chroma', type=int, default=14)
     subparser.add_argument('--min_overlay_luma', type=float, default=25)
     subparser.add_argument('--cursor_min_chroma', type=int, default=12)
@@ -249,5 +293,180 @@ def main() -> int:
     return t.cast(t.Callable[[argparse.Namespace], int], args.func)(args)
 
 
+# ---------------------------------------------------------------------------
+# tests (pytest)
+# ---------------------------------------------------------------------------
+
+
+def _ns(**kw) -> argparse.Namespace:
+    defaults = dict(
+        min_chroma=14,
+        min_overlay_luma=25,
+        cursor_min_chroma=12,
+        min_cursor_luma=25,
+        cursor_min_column_pixels=0,
+        cursor_min_vertical_span=80,
+        cursor_max_width=12,
+        cursor_expand=1,
+        artifact_min_column_ratio=0.65,
+        artifact_min_luma=70,
+        artifact_max_luma=245,
+        artifact_max_median_luma=235,
+    )
+    return argparse.Namespace(**{**defaults, **kw})
+
+
+def _reference_process_image(src: Image.Image, args: argparse.Namespace) -> tuple[Image.Image, int, int]:
+    """The per-pixel implementation process_image replaced, kept as the oracle for its output."""
+    def px_luma(rgb):
+        r, g, b = rgb
+        return 0.299 * r + 0.587 * g + 0.114 * b
+
+    def px_chroma(rgb):
+        return max(rgb) - min(rgb)
+
+    def narrow(candidate_columns, width):
+        columns = set()
+        for group in contiguous_groups(candidate_columns):
+            if len(group) <= args.cursor_max_width:
+                columns.update(group)
+        return expand_columns(columns, width, args.cursor_expand)
+
+    def cursor_columns_of(img):
+        width, height = img.size
+        pix = img.load()
+        min_pixels = args.cursor_min_column_pixels
+        if min_pixels <= 0:
+            min_pixels = max(8, height // 12)
+        candidate_columns = set()
+        for x in range(width):
+            ys = [y for y in range(height)
+                  if px_luma(pix[x, y]) >= args.min_cursor_luma and px_chroma(pix[x, y]) >= args.cursor_min_chroma]
+            if len(ys) >= min_pixels and ys[-1] - ys[0] + 1 >= args.cursor_min_vertical_span:
+                candidate_columns.add(x)
+        return narrow(candidate_columns, width)
+
+    def artifact_columns_of(img):
+        width, height = img.size
+        pix = img.load()
+        min_pixels = max(8, int(height * args.artifact_min_column_ratio))
+        candidate_columns = set()
+        for x in range(width):
+            ys, values = [], []
+            for y in range(height):
+                value = px_luma(pix[x, y])
+                if args.artifact_min_luma <= value <= args.artifact_max_luma:
+                    ys.append(y)
+                    values.append(value)
+            if len(ys) < min_pixels or ys[-1] - ys[0] + 1 < args.cursor_min_vertical_span:
+                continue
+            if statistics.median(values) <= args.artifact_max_median_luma:
+                candidate_columns.add(x)
+        return narrow(candidate_columns, width)
+
+    def neighbor_color(img, x, y, cursor_columns):
+        width, _height = img.size
+        pix = img.load()
+        samples = []
+        for direction in (-1, 1):
+            nx = x + direction
+            while 0 <= nx < width and nx in cursor_columns:
+                nx += direction
+            if 0 <= nx < width:
+                samples.append(pix[nx, y])
+        if len(samples) == 2:
+            return tuple(int(round(statistics.mean(values))) for values in zip(*samples))
+        if samples:
+            return samples[0]
+        return (255, 255, 255)
+
+    dst = src.copy()
+    src_pix = src.load()
+    dst_pix = dst.load()
+    width, height = src.size
+    cursor_columns = cursor_columns_of(src)
+    overlay_pixels = 0
+    cursor_pixels = 0
+    for y in range(height):
+        for x in range(width):
+            rgb = src_pix[x, y]
+            if px_luma(rgb) >= args.min_overlay_luma and px_chroma(rgb) >= args.min_chroma:
+                y_value = int(round(px_luma(rgb)))
+                if y_value >= 215:
+                    y_value = 255
+                dst_pix[x, y] = (y_value, y_value, y_value)
+                overlay_pixels += 1
+    cursor_columns.update(artifact_columns_of(dst))
+    for y in range(height):
+        for x in cursor_columns:
+            dst_pix[x, y] = neighbor_color(dst, x, y, cursor_columns)
+            cursor_pixels += 1
+    return dst, overlay_pixels, cursor_pixels
+
+
+def _score_strip(width: int, height: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    img[10:height - 10:8] = 0  # staff lines
+    ink = rng.random((height, width)) < 0.05
+    img[ink] = rng.integers(0, 256, size=(int(ink.sum()), 1), dtype=np.uint8)  # antialiased notation
+    img[:, width // 3:width // 2] = np.maximum(img[:, width // 3:width // 2], [0, 0, 0]) // 2 + [127, 120, 40]  # tint
+    img[:, width * 2 // 3:width * 2 // 3 + 2] = [40, 90, 230]  # playback cursor
+    img[:, width * 2 // 3 + 2] = 200  # its compression shadow
+    img[:, 0] = [230, 60, 60]  # cursor at the left edge
+    img[:, width - 2:] = [240, 200, 40]  # and at the right edge
+    noise = rng.random((height, width)) < 0.02
+    img[noise] = rng.integers(0, 256, size=(int(noise.sum()), 3), dtype=np.uint8)
+    return img
+
+
+def _shadow_column(height: int, width: int, low: int, high: int) -> np.ndarray:
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    img[:height // 2, width // 2] = low
+    img[height // 2:, width // 2] = high
+    return img
+
+
+def test_process_image_matches_reference(tmp_path):
+    cases = [
+        (_score_strip(240, 120, 0), _ns()),
+        (_score_strip(240, 120, 1), _ns(cursor_min_vertical_span=10, artifact_max_median_luma=250, cursor_expand=2)),
+        (_score_strip(97, 90, 2), _ns(cursor_max_width=200, artifact_min_column_ratio=0.1)),
+        (np.random.default_rng(3).integers(0, 256, size=(85, 64, 3), dtype=np.uint8), _ns(cursor_min_vertical_span=5)),
+        (np.full((90, 20, 3), [30, 60, 240], dtype=np.uint8), _ns(cursor_max_width=20)),  # every column is cursor
+        # A shadow column of 45 + 45 pixels at luma 230 and 240: only the mean of the middle two (235) decides.
+        (_shadow_column(90, 16, 230, 240), _ns(artifact_max_median_luma=234)),
+        (_shadow_column(90, 16, 230, 240), _ns(artifact_max_median_luma=236)),
+    ]
+    for index, (img, args) in enumerate(cases):
+        path = tmp_path / f'{index}.png'
+        out_path = tmp_path / 'out' / f'{index}.png'
+        Image.fromarray(img).save(path)
+        expected, expected_overlay, expected_cursor = _reference_process_image(Image.open(path).convert('RGB'), args)
+        assert process_image(path, out_path, args) == (expected_overlay, expected_cursor)
+        np.testing.assert_array_equal(np.asarray(Image.open(out_path)), np.asarray(expected))
+
+
+def test_process_jobs_and_skip(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for index in range(3):
+        Image.fromarray(_score_strip(120, 100, index)).save(input_dir / f'{index}.png')
+    args = _ns(input_dir=input_dir, output_dir=tmp_path / 'serial', pattern='*.png', jobs=1, force=False)
+    assert process(args) == 0
+    args.output_dir, args.jobs = tmp_path / 'parallel', 2
+    assert process(args) == 0
+    for index in range(3):
+        serial = (tmp_path / 'serial' / f'{index}.png').read_bytes()
+        assert (tmp_path / 'parallel' / f'{index}.png').read_bytes() == serial
+
+    mtimes = {path.name: path.stat().st_mtime_ns for path in args.output_dir.iterdir()}
+    os.utime(input_dir / '1.png', ns=(mtimes['1.png'] + 1, mtimes['1.png'] + 1))
+    assert process(args) == 0
+    changed = {path.name for path in args.output_dir.iterdir() if path.stat().st_mtime_ns != mtimes[path.name]}
+    assert changed == {'1.png'}
+    assert not list(args.output_dir.glob('*.tmp'))
+
+
 if __name__ == '__main__':
     raise SystemExit(main())
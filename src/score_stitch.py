@@ -2,9 +2,11 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import argparse
+import json
 import logging
 import pathlib
 import sys
+import time
 import typing as t
 
 import numpy as np
@@ -16,6 +18,9 @@ Examples:
   score_stitch.py stitch feel feel.webp
   score_stitch.py stitch feel feel.webp --kmax 600 --threshold 12
   score_stitch.py stitch feel feel.webp -n
+  score_stitch.py stitch feel feel.webp --page-width 2400  # feel.001.webp, feel.002.webp, ...; bounded memory
+  score_stitch.py bench_overlap feel  # JSON lines: pyramid vs brute-force overlap search per pair
+  score_stitch.py bench_overlap --strips 8 --width 3000  # the same on synthetic score strips
 '''[1:]
 
 
@@ -59,6 +64,97 @@ def default_kmax(width: int) -> int:
     return min(width - 1, max(400, int(width * 0.75)))
 
 
+# Row bands per lower-bound level of the pyramid overlap search, coarse to fine. The first level also sums the
+# channels (a grayscale column profile).
+OVERLAP_PYRAMID_BANDS = (1, 8, 64)
+OVERLAP_SEARCHES = ('pyramid', 'brute')
+
+
+def overlap_mae(a32: np.ndarray, b32: np.ndarray, k: int) -> float:
+    return float(np.abs(a32[:, a32.shape[1] - k:] - b32[:, :k]).mean())
+
+
+def select_overlap(
+        scores: list[tuple[float, int]],
+        score_margin: float,
+        larger_min_gap: int,
+        threshold: float,
+) -> tuple[int, float, int, float]:
+    best_score, best_k = min(scores)
+    candidate_limit = min(best_score + score_margin, threshold)
+    larger = [(score, k) for score, k in scores if score <= candidate_limit]
+    if not larger:
+        # best_score > threshold: no overlap; stitch() reports it from best_score.
+        return best_k, best_score, best_k, best_score
+    larger_score, larger_k = max(larger, key=lambda item: item[1])
+    if larger_k - best_k >= larger_min_gap:
+        candidate_score, candidate_k = larger_score, larger_k
+    else:
+        candidate_score, candidate_k = best_score, best_k
+    return candidate_k, candidate_score, best_k, best_score
+
+
+def band_sums(img: np.ndarray, bands: int, gray: bool) -> np.ndarray:
+    """Per-column pixel sums over `bands` horizontal bands of rows (and over the channels when gray), as int64."""
+    edges = np.linspace(0, img.shape[0], min(bands, img.shape[0]) + 1).astype(int)
+    sums = np.add.reduceat(img.astype(np.int64), edges[:-1], axis=0)
+    return sums.sum(axis=2) if gray else sums
+
+
+def pyramid_overlap_scores(
+        a32: np.ndarray,
+        b32: np.ndarray,
+        kmin: int,
+        upper: int,
+        score_margin: float,
+        threshold: float,
+) -> list[tuple[float, int]]:
+    """Exact MAE for enough overlaps k that select_overlap() picks the same as it would from every k.
+
+    |sum(a - b)| <= sum(|a - b|) over the pixels of a band, so band sums give a lower bound on each k's MAE. Coarse
+    levels drop the k whose bound exceeds what the best overlap found so far allows, and finer levels tighten the
+    bounds of the rest while that keeps paying off. The bounds are integer sums divided by the same pixel count as
+    the MAE, so rounding never puts an exact score below its bound. Then only the k whose bound is at most the best
+    score are scored for the best k, and the k within the near-tie limit from the largest down until one is in it.
+    """
+    h, w_a, channels = a32.shape
+    ks = np.arange(kmin, upper + 1)
+    exact: dict[int, float] = {}
+
+    def score(k: int) -> float:
+        if k not in exact:
+            exact[k] = overlap_mae(a32, b32, k)
+        return exact[k]
+
+    best = np.inf
+    bounds = np.zeros(len(ks))
+    for level, bands in enumerate(OVERLAP_PYRAMID_BANDS):
+        if level and bands * 4 > h:
+            break
+        sums_a = band_sums(a32, bands, level == 0)
+        sums_b = band_sums(b32, bands, level == 0)
+        bounds = np.array([
+            int(np.abs(sums_a[:, w_a - k:] - sums_b[:, :k]).sum()) / (h * k * channels) for k in ks.tolist()
+        ])
+        best = min(best, score(int(ks[np.argmin(bounds)])))
+        # best is at least the final best score, so this keeps the best k and every k within its near-tie limit.
+        keep = bounds <= max(best, min(best + score_margin, threshold))
+        ks, bounds = ks[keep], bounds[keep]
+        if np.count_nonzero(keep) * 2 > len(keep):
+            break
+
+    for position in np.argsort(bounds, kind='stable').tolist():
+        if bounds[position] > best:
+            break
+        best = min(best, score(int(ks[position])))
+    candidate_limit = min(best + score_margin, threshold)
+    for position in range(len(ks) - 1, -1, -1):
+        if bounds[position] <= candidate_limit and score(int(ks[position])) <= candidate_limit:
+            break
+    logger.debug('pyramid overlap search: %d of %d overlaps scored exactly', len(exact), upper - kmin + 1)
+    return [(value, k) for k, value in exact.items()]
+
+
 def find_overlap(
         a: np.ndarray,
         b: np.ndarray,
@@ -67,6 +163,7 @@ def find_overlap(
         score_margin: float,
         larger_min_gap: int,
         threshold: float,
+        search: str = 'pyramid',
 ) -> tuple[int, float, int, float]:
     h_a, w_a, _ = a.shape
     h_b, w_b, _ = b.shape
@@ -76,24 +173,14 @@ def find_overlap(
     if kmin > upper:
         raise RuntimeError(f'kmin={kmin} exceeds searchable overlap upper bound={upper}')
 
-    scores: list[tuple[float, int]] = []
-    a32 = a.astype(np.int32)
-    b32 = b.astype(np.int32)
-    for k in range(kmin, upper + 1):
-        score = float(np.abs(a32[:, w_a - k:] - b32[:, :k]).mean())
-        scores.append((score, k))
-
-    best_score, best_k = min(scores)
-    candidate_limit = min(best_score + score_margin, threshold)
-    larger_score, larger_k = max(
-        ((score, k) for score, k in scores if score <= candidate_limit),
-        key=lambda item: item[1],
-    )
-    if larger_k - best_k >= larger_min_gap:
-        candidate_score, candidate_k = larger_score, larger_k
+    # Only the last `upper` columns of a and the first `upper` columns of b can overlap.
+    a32 = a[:, w_a - upper:].astype(np.int32)
+    b32 = b[:, :upper].astype(np.int32)
+    if search == 'brute':
+        scores = [(overlap_mae(a32, b32, k), k) for k in range(kmin, upper + 1)]
     else:
-        candidate_score, candidate_k = best_score, best_k
-    return candidate_k, candidate_score, best_k, best_score
+        scores = pyramid_overlap_scores(a32, b32, kmin, upper, score_margin, threshold)
+    return select_overlap(scores, score_margin, larger_min_gap, threshold)
 
 
 def wrap_image(out: np.ndarray, wrap_width: int) -> np.ndarray:
@@ -114,67 +201,256 @@ def wrap_image(out: np.ndarray, wrap_width: int) -> np.ndarray:
     return wrapped
 
 
+def synthetic_score_strips(
+        count: int,
+        width: int,
+        height: int,
+        seed: int,
+) -> tuple[list[np.ndarray], list[int]]:
+    """count strips cut from one synthetic score (staff, bar lines, notes) with random overlaps, and the overlaps.
+
+    Each strip gets its own mild noise, like separately compressed captures.
+    """
+    rng = np.random.default_rng(seed)
+    overlaps = [int(overlap) for overlap in rng.integers(width // 20, width // 2, size=count - 1)]
+    score_width = width * count - sum(overlaps)
+    score = np.full((height, score_width, 3), 255, dtype=np.uint8)
+    gap = max(4, height // 40)
+    for top in range(height // 8, height - 5 * gap, 10 * gap):
+        for line in range(5):
+            score[top + line * gap] = 60
+        x = int(rng.integers(0, 400))
+        while x < score_width:
+            score[top:top + 4 * gap + 1, x:x + 2] = 0
+            x += int(rng.integers(250, 500))
+        for x in rng.integers(0, score_width - 10, size=score_width // 20).tolist():
+            y = top + int(rng.integers(-2, 11)) * gap // 2
+            score[max(0, y - gap // 2):y + gap // 2, x:x + 10] = 20
+            score[max(0, y - 3 * gap):y, x + 9] = 20
+    strips = []
+    x = 0
+    for index in range(count):
+        strip = score[:, x:x + width].astype(np.int16) + rng.integers(-3, 4, size=(height, width, 3))
+        strips.append(np.clip(strip, 0, 255).astype(np.uint8))
+        if index < count - 1:
+            x += width - overlaps[index]
+    return strips, overlaps
+
+
+def bench_overlap(args: argparse.Namespace) -> int:
+    if args.input_dir is not None:
+        paths = sorted(p for p in args.input_dir.glob(args.pattern) if p.is_file())
+        if len(paths) < 2:
+            raise SystemExit(f'need at least 2 input images, found {len(paths)}: {args.input_dir / args.pattern}')
+        names = [p.name for p in paths]
+        imgs = [np.array(Image.open(p).convert('RGB')) for p in paths]
+    else:
+        imgs, _overlaps = synthetic_score_strips(args.strips, args.width, args.height, args.seed)
+        names = [f'synthetic{index}' for index in range(len(imgs))]
+    kmax = args.kmax if args.kmax is not None else default_kmax(imgs[0].shape[1])
+
+    mismatches = 0
+    totals = dict.fromkeys(OVERLAP_SEARCHES, 0.0)
+    for i in range(len(imgs) - 1):
+        record: dict[str, t.Any] = {'bench': 'overlap', 'pair': [names[i], names[i + 1]], 'kmax': kmax}
+        results = {}
+        for search in OVERLAP_SEARCHES:
+            started_at = time.monotonic()
+            results[search] = find_overlap(
+                imgs[i], imgs[i + 1], args.kmin, kmax, args.score_margin, args.larger_min_gap, args.threshold, search)
+            seconds = time.monotonic() - started_at
+            totals[search] += seconds
+            record[f'{search}_seconds'] = round(seconds, 4)
+        same = len(set(results.values())) == 1
+        mismatches += not same
+        record.update(overlap=results['pyramid'][0], same=same,
+                      speedup=round(record['brute_seconds'] / max(record['pyramid_seconds'], 1e-9), 2))
+        if not same:
+            record['results'] = results
+        print(json.dumps(record), flush=True)
+    print(json.dumps({
+        'bench': 'overlap',
+        'pairs': len(imgs) - 1,
+        'brute_seconds': round(totals['brute'], 4),
+        'pyramid_seconds': round(totals['pyramid'], 4),
+        'speedup': round(totals['brute'] / max(totals['pyramid'], 1e-9), 2),
+        'mismatches': mismatches,
+    }), flush=True)
+    return 1 if mismatches else 0
+
+
+WEBP_MAX_DIMENSION = 16383
+
+
+def output_save_kwargs(path: pathlib.Path, lossless: bool) -> dict[str, t.Any]:
+    if path.suffix.lower() == '.webp':
+        return {'lossless': lossless, 'quality': 100}
+    return {}
+
+
+def exceeds_webp_limit(path: pathlib.Path, width: int, height: int) -> bool:
+    return path.suffix.lower() == '.webp' and (width > WEBP_MAX_DIMENSION or height > WEBP_MAX_DIMENSION)
+
+
+def stitch_parts(paths: list[pathlib.Path], args: argparse.Namespace) -> t.Iterator[tuple[int, np.ndarray]]:
+    """(overlap, part) per input in order, where part is the input without its overlap with the previous input.
+
+    Inputs are read one at a time; only the previous input is kept while the overlap with the next is searched.
+    """
+    prev_path: pathlib.Path | None = None
+    prev: np.ndarray | None = None
+    h = kmax = 0
+    for path in paths:
+        img = np.array(Image.open(path).convert('RGB'))
+        if prev is None:
+            h, w, _ = img.shape
+            kmax = args.kmax if args.kmax is not None else default_kmax(w)
+            logger.info('overlap search range: kmin=%d kmax=%d score_margin=%.3f larger_min_gap=%d',
+                        args.kmin, kmax, args.score_margin, args.larger_min_gap)
+            prev_path, prev = path, img
+            yield 0, img
+            continue
+        if img.shape[0] != h or img.shape[2] != 3:
+            raise RuntimeError(f'unexpected shape for {path}: {img.shape}, expected height={h} channels=3')
+
+        assert prev_path is not None
+        k, score, best_k, best_score = find_overlap(
+            prev, img, args.kmin, kmax, args.score_margin, args.larger_min_gap, args.threshold, args.overlap_search)
+        if best_score >= args.threshold:
+            logger.warning('%s <-> %s: best k=%d MAE=%.3f >= threshold %.3f, treating as no overlap',
+                           prev_path.name, path.name, best_k, best_score, args.threshold)
+            k = 0
+        elif k == best_k:
+            logger.info('%s <-> %s: overlap=%d MAE=%.3f', prev_path.name, path.name, k, score)
+        else:
+            logger.info('%s <-> %s: overlap=%d MAE=%.3f (best k=%d MAE=%.3f)',
+                        prev_path.name, path.name, k, score, best_k, best_score)
+        prev_path, prev = path, img
+        yield k, img[:, k:]
+
+
+class PageWriter:
+    """Write a stream of column blocks as pages of page_width columns: <stem>.001<suffix>, <stem>.002<suffix>, ...
+
+    Only one page is held; the last page is as wide as what is left.
+    """
+
+    def __init__(self, output_file: pathlib.Path, page_width: int, lossless: bool, dry_run: bool) -> None:
+        self.output_file = output_file
+        self.page_width = page_width
+        self.save_kwargs = output_save_kwargs(output_file, lossless)
+        self.dry_run = dry_run
+        self.page: np.ndarray | None = None
+        self.filled = 0
+        self.width = 0
+        self.pages: list[pathlib.Path] = []
+
+    def page_path(self, index: int) -> pathlib.Path:
+        return self.output_file.with_name(f'{self.output_file.stem}.{index:03d}{self.output_file.suffix}')
+
+    def write(self, part: np.ndarray) -> None:
+        x = 0
+        while x < part.shape[1]:
+            if self.page is None:
+                self.page = np.empty((part.shape[0], self.page_width, part.shape[2]), dtype=part.dtype)
+            n = min(self.page_width - self.filled, part.shape[1] - x)
+            self.page[:, self.filled:self.filled + n] = part[:, x:x + n]
+            self.filled += n
+            self.width += n
+            x += n
+            if self.filled == self.page_width:
+                self.flush()
+
+    def flush(self) -> None:
+        assert self.page is not None
+        path = self.page_path(len(self.pages) + 1)
+        if self.dry_run:
+            print(f'save {path} size={self.filled}x{self.page.shape[0]} lossless={self.save_kwargs.get("lossless")}')
+        else:
+            Image.fromarray(self.page[:, :self.filled]).save(path, **self.save_kwargs)
+            logger.info('wrote %s', path)
+        self.pages.append(path)
+        self.filled = 0
+
+    def close(self) -> None:
+        if self.filled:
+            self.flush()
+
+
 def stitch(args: argparse.Namespace) -> int:
     paths = sorted(p for p in args.input_dir.glob(args.pattern) if p.is_file())
     if len(paths) < 2:
         raise SystemExit(f'need at least 2 input images, found {len(paths)}: {args.input_dir / args.pattern}')
+    # Fail before the overlap search on what no page width can fix.
+    h = Image.open(paths[0]).height
+    if exceeds_webp_limit(args.output_file, 1, h):
+        raise SystemExit(f'{paths[0]}: height {h} exceeds the WebP limit of {WEBP_MAX_DIMENSION} px; '
+                         f'use a .png output_file')
+    for option in ('page_width', 'wrap_width'):
+        if getattr(args, option) is not None and getattr(args, option) <= 0:
+            raise SystemExit(f'--{option.replace("_", "-")} must be positive: {getattr(args, option)}')
+    if args.page_width is not None and exceeds_webp_limit(args.output_file, args.page_width, h):
+        raise SystemExit(f'--page-width {args.page_width} exceeds the WebP limit of {WEBP_MAX_DIMENSION} px')
+    if not args.dry_run:
+        args.output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    if args.page_width is not None:
+        writer = PageWriter(args.output_file, args.page_width, args.lossless, args.dry_run)
+        sum_overlap = 0
+        for overlap, part in stitch_parts(paths, args):
+            sum_overlap += overlap
+            writer.write(part)
+        writer.close()
+        logger.info('total inputs=%d sum_overlap=%d output_size=%dx%d pages=%d',
+                    len(paths), sum_overlap, writer.width, h, len(writer.pages))
+        return 0
 
-    imgs = [np.array(Image.open(p).convert('RGB')) for p in paths]
-    h, w, _ = imgs[0].shape
-    for p, im in zip(paths, imgs):
-        if im.shape[0] != h or im.shape[2] != 3:
-            raise RuntimeError(f'unexpected shape for {p}: {im.shape}, expected height={h} channels=3')
+    overlaps: list[int] = []
+    parts: list[np.ndarray] = []
+    for overlap, part in stitch_parts(paths, args):
+        overlaps.append(overlap)
+        parts.append(part)
+    width, height = sum(part.shape[1] for part in parts), h
+    logger.info('total inputs=%d sum_overlap=%d output_size=%dx%d', len(paths), sum(overlaps), width, height)
+    if args.wrap_width is not None and args.wrap_width < width:
+        rows = (width + args.wrap_width - 1) // args.wrap_width
+        logger.info('wrapped output: %dx%d -> %dx%d', width, height, args.wrap_width, rows * height)
+        width, height = args.wrap_width, rows * height
+
+    if exceeds_webp_limit(args.output_file, width, height):
+        # Each wrapped row (or WEBP_MAX_DIMENSION columns) becomes a page of its own.
+        page_width = min(args.wrap_width or WEBP_MAX_DIMENSION, WEBP_MAX_DIMENSION)
+        logger.warning('output %dx%d exceeds the WebP limit of %d px; writing pages of width %d instead',
+                       width, height, WEBP_MAX_DIMENSION, page_width)
+        writer = PageWriter(args.output_file, page_width, args.lossless, args.dry_run)
+        for part in parts:
+            writer.write(part)
+        writer.close()
+        logger.info('pages=%d', len(writer.pages))
+        return 0
 
-    kmax = args.kmax if args.kmax is not None else default_kmax(w)
-    logger.info('overlap search range: kmin=%d kmax=%d score_margin=%.3f larger_min_gap=%d',
-                args.kmin, kmax, args.score_margin, args.larger_min_gap)
+    if args.dry_run:
+        print(f'save {args.output_file} size={width}x{height} lossless={args.lossless}')
+        return 0
 
-    overlaps: list[int] = [0]
-    for i in range(len(imgs) - 1):
-        k, score, best_k, best_score = find_overlap(
-            imgs[i], imgs[i + 1], args.kmin, kmax, args.score_margin, args.larger_min_gap, args.threshold)
-        if best_score >= args.threshold:
-            logger.warning('%s <-> %s: best k=%d MAE=%.3f >= threshold %.3f, treating as no overlap',
-                           paths[i].name, paths[i + 1].name, best_k, best_score, args.threshold)
-            overlaps.append(0)
-        else:
-            if k == best_k:
-                logger.info('%s <-> %s: overlap=%d MAE=%.3f',
-                            paths[i].name, paths[i + 1].name, k, score)
-            else:
-                logger.info('%s <-> %s: overlap=%d MAE=%.3f (best k=%d MAE=%.3f)',
-                            paths[i].name, paths[i + 1].name, k, score, best_k, best_score)
-            overlaps.append(k)
-
-    parts = [imgs[i][:, overlaps[i]:] for i in range(len(imgs))]
     out = np.concatenate(parts, axis=1)
-    logger.info('total inputs=%d sum_overlap=%d output_size=%dx%d',
-                len(imgs), sum(overlaps), out.shape[1], out.shape[0])
+    del parts
     if args.wrap_width is not None:
-        original_width, original_height = out.shape[1], out.shape[0]
         out = wrap_image(out, args.wrap_width)
-        logger.info('wrapped output: %dx%d -> %dx%d',
-                    original_width, original_height, out.shape[1], out.shape[0])
+    Image.fromarray(out).save(args.output_file, **output_save_kwargs(args.output_file, args.lossless))
+    logger.info('wrote %s', args.output_file)
+    return 0
 
-    if args.dry_run:
-        print(f'save {args.output_file} size={out.shape[1]}x{out.shape[0]} lossless={args.lossless}')
-        return 0
 
-    args.output_file.parent.mkdir(parents=True, exist_ok=True)
-    out_path = args.output_file
-    webp_limit = 16383
-    if out_path.suffix.lower() == '.webp' and (out.shape[1] > webp_limit or out.shape[0] > webp_limit):
-        png_path = out_path.with_suffix('.png')
-        logger.warning('output %dx%d exceeds WebP limit %d; saving as PNG: %s',
-                       out.shape[1], out.shape[0], webp_limit, png_path)
-        out_path = png_path
-
-    save_kwargs: dict[str, t.Any] = {}
-    if out_path.suffix.lower() == '.webp':
-        save_kwargs = {'lossless': args.lossless, 'quality': 100}
-    Image.fromarray(out).save(out_path, **save_kwargs)
-    logger.info('wrote %s', out_path)
-    return 0
+def add_overlap_args(subparser: argparse.ArgumentParser) -> None:
+    subparser.add_argument('--kmin', type=int, default=5)
+    subparser.add_argument('--kmax', type=int, default=None,
+                           help='maximum overlap width to consider; defaults to min(width - 1, max(400, width * 0.75))')
+    subparser.add_argument('--score-margin', type=float, default=2.6,
+                           help='prefer the largest overlap whose MAE is within this margin of the best MAE')
+    subparser.add_argument('--larger-min-gap', type=int, default=100,
+                           help='only prefer a larger near-tie overlap when it is at least this many pixels larger')
+    subparser.add_argument('--threshold', type=float, default=12.0)
 
 
 def main() -> int:
@@ -188,24 +464,111 @@ def main() -> int:
     subparser.add_argument('input_dir', type=pathlib.Path)
     subparser.add_argument('output_file', type=pathlib.Path)
     subparser.add_argument('--pattern', default='*.webp')
-    subparser.add_argument('--kmin', type=int, default=5)
-    subparser.add_argument('--kmax', type=int, default=None,
-                           help='maximum overlap width to consider; defaults to min(width - 1, max(400, width * 0.75))')
-    subparser.add_argument('--score-margin', type=float, default=2.6,
-                           help='prefer the largest overlap whose MAE is within this margin of the best MAE')
-    subparser.add_argument('--larger-min-gap', type=int, default=100,
-                           help='only prefer a larger near-tie overlap when it is at least this many pixels larger')
-    subparser.add_argument('--threshold', type=float, default=12.0)
-    subparser.add_argument('--wrap-width', type=int,
-                           help='wrap the stitched image into rows of this width before saving')
+    add_overlap_args(subparser)
+    subparser.add_argument('--overlap-search', choices=OVERLAP_SEARCHES, default='pyramid',
+                           help='pyramid: prune overlaps by row-band lower bounds first; brute: score every overlap '
+                                '(same result, slower)')
+    group = subparser.add_mutually_exclusive_group()
+    group.add_argument('--wrap-width', type=int,
+                       help='wrap the stitched image into rows of this width before saving')
+    group.add_argument('--page-width', type=int,
+                       help='write pages of this width (output_file stem + .001, .002, ...), streaming the inputs '
+                            'instead of building the stitched image in memory')
     subparser.add_argument('--lossless', type=lambda v: v.lower() in ('1', 'true', 'yes'), default=True)
     subparser.add_argument('-n', '--dry_run', action='store_true')
 
+    subparser = subparsers.add_parser('bench_overlap', formatter_class=ArgumentDefaultsRawTextHelpFormatter)
+    subparser.set_defaults(func=bench_overlap)
+    subparser.add_argument('input_dir', type=pathlib.Path, nargs='?',
+                           help='score strips to pair up as stitch does; omit for synthetic strips')
+    subparser.add_argument('--pattern', default='*.webp')
+    subparser.add_argument('--strips', type=int, default=6, help='synthetic strips')
+    subparser.add_argument('--width', type=int, default=2400, help='synthetic strip width')
+    subparser.add_argument('--height', type=int, default=600, help='synthetic strip height')
+    subparser.add_argument('--seed', type=int, default=0, help='synthetic score seed')
+    add_overlap_args(subparser)
+
     args = parser.parse_args()
     logger.setLevel({0: logging.DEBUG, 1: logging.INFO, 2: logging.WARNING}.get(args.quiet, logging.ERROR))
     logger.debug(f'{args=}')
     return t.cast(t.Callable[[argparse.Namespace], int], args.func)(args)
 
 
+# ---------------------------------------------------------------------------
+# tests (pytest)
+# ---------------------------------------------------------------------------
+
+
+def test_find_overlap_pyramid_matches_brute_force():
+    strips, overlaps = synthetic_score_strips(4, 360, 120, 0)
+    blank = [np.where(np.arange(120)[:, None, None] < 110, 250, strip).astype(np.uint8) for strip in strips]
+    for imgs in (strips, blank):
+        for a, b in zip(imgs, imgs[1:]):
+            # defaults, no margin, everything a near tie, best above threshold, negative margin
+            for margin, gap, threshold in ((2.6, 100, 12.0), (0.0, 0, 12.0), (50.0, 10, 255.0), (2.6, 100, 0.5),
+                                           (-1.0, 5, 30.0)):
+                expected = find_overlap(a, b, 5, default_kmax(360), margin, gap, threshold, 'brute')
+                assert find_overlap(a, b, 5, default_kmax(360), margin, gap, threshold, 'pyramid') == expected
+    found = [find_overlap(a, b, 5, default_kmax(360), 2.6, 100, 12.0)[0] for a, b in zip(strips, strips[1:])]
+    assert found == overlaps
+
+
+def test_stitch_pages_match_wrapped_output(tmp_path):
+    strips, _overlaps = synthetic_score_strips(5, 300, 80, 1)
+    for i, strip in enumerate(strips):
+        Image.fromarray(strip).save(tmp_path / f'{i:02d}.png')
+
+    def stitch_args(output_file, **kwargs):
+        return argparse.Namespace(
+            input_dir=tmp_path, output_file=output_file, pattern='*.png', kmin=5, kmax=None, score_margin=2.6,
+            larger_min_gap=100, threshold=12.0, overlap_search='pyramid', lossless=True, dry_run=False,
+            **{'wrap_width': None, 'page_width': None, **kwargs})
+
+    assert stitch(stitch_args(tmp_path / 'out' / 'full.png')) == 0
+    full = np.array(Image.open(tmp_path / 'out' / 'full.png'))
+    assert stitch(stitch_args(tmp_path / 'out' / 'wrapped.png', wrap_width=256)) == 0
+    assert np.array_equal(np.array(Image.open(tmp_path / 'out' / 'wrapped.png')), wrap_image(full, 256))
+
+    assert stitch(stitch_args(tmp_path / 'out' / 'page.png', page_width=256)) == 0
+    pages = sorted((tmp_path / 'out').glob('page.*.png'))
+    assert [p.name for p in pages] == [f'page.{i:03d}.png' for i in range(1, len(pages) + 1)]
+    assert len(pages) == (full.shape[1] + 255) // 256
+    assert np.array_equal(np.concatenate([np.array(Image.open(p)) for p in pages], axis=1), full)
+
+    try:
+        stitch(stitch_args(tmp_path / 'out' / 'page.webp', page_width=WEBP_MAX_DIMENSION + 1))
+    except SystemExit as e:
+        assert 'WebP limit' in str(e)
+    else:
+        raise AssertionError('expected SystemExit')
+    assert not list((tmp_path / 'out').glob('page.*.webp'))
+
+
+def test_stitch_oversize_webp_writes_pages(tmp_path, monkeypatch):
+    strips, _overlaps = synthetic_score_strips(4, 300, 80, 2)
+    for i, strip in enumerate(strips):
+        Image.fromarray(strip).save(tmp_path / f'{i:02d}.png')
+    args = argparse.Namespace(
+        input_dir=tmp_path, output_file=tmp_path / 'out' / 'full.png', pattern='*.png', kmin=5, kmax=None, score_margin=2.6,
+        larger_min_gap=100, threshold=12.0, overlap_search='pyramid', lossless=True, dry_run=False, wrap_width=None,
+        page_width=None)
+    assert stitch(args) == 0
+    full = np.array(Image.open(tmp_path / 'out' / 'full.png'))
+
+    monkeypatch.setattr(sys.modules[__name__], 'WEBP_MAX_DIMENSION', 500)
+    args.output_file = tmp_path / 'out' / 'page.webp'
+    assert stitch(args) == 0
+    assert not args.output_file.exists()
+    pages = sorted((tmp_path / 'out').glob('page.*.webp'))
+    assert [np.array(Image.open(p)).shape[1] for p in pages[:-1]] == [500] * (len(pages) - 1)
+    assert np.array_equal(np.concatenate([np.array(Image.open(p)) for p in pages], axis=1), full)
+
+    args.output_file, args.wrap_width = tmp_path / 'out' / 'wrapped.webp', 100
+    assert stitch(args) == 0
+    pages = sorted((tmp_path / 'out').glob('wrapped.*.webp'))
+    assert np.array_equal(np.concatenate([np.array(Image.open(p)) for p in pages], axis=1), full)
+    assert {np.array(Image.open(p)).shape[1] for p in pages[:-1]} == {100}
+
+
 if __name__ == '__main__':
     raise SystemExit(main())
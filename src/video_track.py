@@ -2,19 +2,26 @@
 from __future__ import annotations
 
 import argparse
+import array
 import json
 import logging
+import math
 import os
+import queue
 import re
 import shlex
 import subprocess
 import sys
+import threading
 import time
 import typing as t
 from pathlib import Path
 
 from lib_ import video_time
 
+if t.TYPE_CHECKING:
+    from video_track_live_bin import LiveBinWriter
+
 # これが無いと /home/wsh/d/s/video_track_draw_box.py : import video_track で再びここに到達してしまう
 # see in debugger:
 # [sys.modules.get('__main__'), sys.modules.get('video_track'), sys.modules.get('video_track_draw_box')]
@@ -33,8 +40,18 @@ video_track.py detect short.mp4 short.detect.jsonl --init-bbox 120:260:360:70 --
 video_track.py detect short.mp4 short.detect.jsonl --start f:10 --end 0:01.700 --init-bbox 120:260:360:70 --preview_gui
 video_track.py detect short.mp4 short.detect.jsonl --start f:20 --duration f:-10 --init-bbox 120:260:360:70 --preview_gui
 video_track.py finalize short.mp4 short.detect.jsonl short.detect.json
+video_track.py detect short.mp4 short.detect.bin --init-bbox 120:260:360:70  # binary live detections
+video_track.py detect long.mp4 long.detect.jsonl --init-bbox 120:260:360:70 --shards 8  # 8 worker processes
+video_track.py detect long.mp4 long.detect.jsonl --init-bbox 120:260:360:70 --stride 8 --adaptive --proxy-scale 0.5  # densify only where the target jumps or is lost
+video_track.py finalize short.mp4 short.detect.bin short.detect.json
+video_track.py convert_live short.detect.bin short.detect.jsonl  # and back: convert_live short.detect.jsonl short.detect.bin
 video_track.py draw_box short.mp4 short.detect.json --preview_gui
+video_track.py detect long.mp4 long.detect.jsonl --init-bbox 120:260:360:70 --frame-cache  # then draw_box/stabilize --frame-cache read cached frames
+video_track.py bench_segment long.mp4 --start 1:00 --duration 10  # JSON lines: segment extraction, per-frame seek vs sequential
+video_track.py bench_suite --video-dir ~/.cache/video_track/bench > before.jsonl  # JSON lines: every stage on synthetic videos
+video_track.py bench_compare before.jsonl after.jsonl  # exit 1 if a stage got more than 10% slower
 video_track.py stabilize short.mp4 short.detect.json --preview_gui
+video_track.py stabilize long.mp4 long.detect.json --mp4v-from-h264  # encode once while rendering, mp4v transcoded afterwards
 ff.py -h  # for other --start/--end/--duration formats
 """[1:]
 
@@ -173,6 +190,19 @@ def ffprobe_frame_count(src: Path) -> int | None:
     return None
 
 
+def open_video_capture(src: Path, frame_cache: FrameCacheOptions | None = None) -> object:
+    """cv2.VideoCapture for src, or a CachedVideoCapture reading through the frame cache when one is given."""
+    if frame_cache is None:
+        return cv2.VideoCapture(str(src))
+    from video_track_frame_cache import open_cached_capture
+
+    return open_cached_capture(src, frame_cache)
+
+
+def proxy_frame_size(width: int, height: int, scale: float) -> tuple[int, int]:
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
 def load_video_info(src: Path) -> VideoInfo:
     cap = cv2.VideoCapture(str(src))
     if not cap.isOpened():
@@ -575,7 +605,7 @@ def draw_preview_text(
 
 def draw_preview_frame(
     frame: np.ndarray,
-    detections: list[tuple[int, np.ndarray]],
+    detections: FrameDetections,
     init_bbox: tuple[float, float, float, float],
     frame_index: int,
     status_text: str | None = None,
@@ -584,7 +614,7 @@ def draw_preview_frame(
 ) -> np.ndarray:
     preview = frame.copy()
     style = preview_style(preview)
-    for track_id, bbox in detections:
+    for track_id, bbox in zip(detections.track_ids.tolist(), detections.xyxy.tolist()):
         x0, y0, x1, y1 = bbox
         is_target = target_track_id is not None and track_id == target_track_id
         color = (0, 0, 255) if is_target else (0, 255, 0)
@@ -621,37 +651,58 @@ def draw_preview_frame(
     return preview
 
 
-def bbox_iou(a: np.ndarray, b: np.ndarray) -> float:
-    ix0 = max(a[0], b[0])
-    iy0 = max(a[1], b[1])
-    ix1 = min(a[2], b[2])
-    iy1 = min(a[3], b[3])
-    iw = max(0.0, ix1 - ix0)
-    ih = max(0.0, iy1 - iy0)
+def bbox_iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of every xyxy box in a (N x 4, or one box) against every xyxy box in b (M x 4) as an N x M matrix."""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(1, -1, 4)
+    iw = np.maximum(0.0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]))
+    ih = np.maximum(0.0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]))
     inter = iw * ih
-    area_a = max(0.0, a[2] - a[0]) * max(0.0, a[3] - a[1])
-    area_b = max(0.0, b[2] - b[0]) * max(0.0, b[3] - b[1])
+    area_a = np.maximum(0.0, a[..., 2] - a[..., 0]) * np.maximum(0.0, a[..., 3] - a[..., 1])
+    area_b = np.maximum(0.0, b[..., 2] - b[..., 0]) * np.maximum(0.0, b[..., 3] - b[..., 1])
     denom = area_a + area_b - inter
-    return 0.0 if denom <= 0 else inter / denom
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denom > 0, inter / denom, 0.0)
+
+
+def bbox_iou(a: np.ndarray, b: np.ndarray) -> float:
+    return float(bbox_iou_matrix(a, b)[0, 0])
+
+
+def draw_detect_gui_preview(
+    frame: np.ndarray,
+    scale: float,
+    detections: FrameDetections,
+    init_bbox: tuple[float, float, float, float],
+    frame_index: int,
+    status_text: str,
+    target_track_id: int | None,
+) -> np.ndarray:
+    """PreviewRenderer draw callback for detect: draw_preview_frame on the downscaled preview frame."""
+    return draw_preview_frame(
+        frame,
+        scale_frame_detections(detections, scale, scale),
+        init_bbox,
+        frame_index,
+        status_text,
+        target_track_id=target_track_id,
+    )
 
 
 def select_preview_target_track(
-    detections: list[tuple[int, np.ndarray]],
+    detections: FrameDetections,
     init_xyxy: np.ndarray,
 ) -> int | None:
-    best_track_id: int | None = None
-    best_iou = 0.0
-    for track_id, bbox in detections:
-        iou = bbox_iou(init_xyxy, bbox)
-        if iou > best_iou:
-            best_iou = iou
-            best_track_id = track_id
-    return best_track_id
+    if len(detections.track_ids) == 0:
+        return None
+    ious = bbox_iou_matrix(init_xyxy, detections.xyxy)[0]
+    best = int(np.argmax(ious))
+    return int(detections.track_ids[best]) if ious[best] > 0 else None
 
 
 def keep_preview_target_track(
     current_track_id: int | None,
-    detections: list[tuple[int, np.ndarray]],
+    detections: FrameDetections,
     init_xyxy: np.ndarray,
 ) -> int | None:
     if current_track_id is not None:
@@ -711,22 +762,181 @@ def xyxy_to_xywh(bbox: np.ndarray) -> list[float]:
     ]
 
 
+class FrameDetections(t.NamedTuple):
+    track_ids: np.ndarray
+    xyxy: np.ndarray
+    conf: np.ndarray
+
+
+def make_frame_detections(
+    track_ids: t.Sequence[int] | np.ndarray,
+    xyxy: t.Sequence[t.Sequence[float]] | np.ndarray,
+    conf: t.Sequence[float] | np.ndarray | None = None,
+) -> FrameDetections:
+    track_ids_array = np.asarray(track_ids, dtype=np.int64).reshape(-1)
+    xyxy_array = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+    if conf is None:
+        conf_array = np.full(len(track_ids_array), np.nan, dtype=np.float32)
+    else:
+        conf_array = np.asarray(conf, dtype=np.float32).reshape(-1)
+    return FrameDetections(track_ids_array, xyxy_array, conf_array)
+
+
+def scale_frame_detections(frame_detections: FrameDetections, scale_x: float, scale_y: float) -> FrameDetections:
+    xyxy = frame_detections.xyxy * np.array([scale_x, scale_y, scale_x, scale_y])
+    return frame_detections._replace(xyxy=xyxy)
+
+
+def gather_rows(starts: np.ndarray, lengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Concatenate row ranges starts[i]:starts[i] + lengths[i]; returns (offsets, row indices)."""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    rows = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+    return offsets, rows
+
+
+class DetectionStore:
+    """Detections of many frames as contiguous columns.
+
+    frames holds the source frame numbers in ascending order; frame position i owns rows offsets[i]:offsets[i + 1]
+    of track_ids (int64), xyxy (float64, N x 4) and conf (float32, NaN if unknown).
+    """
+
+    def __init__(
+        self,
+        frames: np.ndarray,
+        offsets: np.ndarray,
+        track_ids: np.ndarray,
+        xyxy: np.ndarray,
+        conf: np.ndarray,
+    ) -> None:
+        self.frames = frames
+        self.offsets = offsets
+        self.track_ids = track_ids
+        self.xyxy = xyxy
+        self.conf = conf
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.track_ids)
+
+    def frame(self, position: int) -> FrameDetections:
+        start = self.offsets[position]
+        end = self.offsets[position + 1]
+        return FrameDetections(self.track_ids[start:end], self.xyxy[start:end], self.conf[start:end])
+
+    def row_positions(self, rows: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.offsets, rows, side="right") - 1
+
+    def track_bboxes(self, track_id: int) -> np.ndarray:
+        """Boxes of track_id per frame position, NaN where absent; the first box wins if a frame has several."""
+        out = np.full((len(self.frames), 4), np.nan, dtype=np.float64)
+        rows = np.flatnonzero(self.track_ids == track_id)
+        positions, first = np.unique(self.row_positions(rows), return_index=True)
+        out[positions] = self.xyxy[rows[first]]
+        return out
+
+    def reindex(self, frame_numbers: np.ndarray) -> DetectionStore:
+        """Return a store with exactly frame_numbers (ascending); frames not in this store are empty."""
+        frame_numbers = np.asarray(frame_numbers, dtype=np.int64)
+        starts = np.zeros(len(frame_numbers), dtype=np.int64)
+        lengths = np.zeros(len(frame_numbers), dtype=np.int64)
+        if len(self.frames):
+            positions = np.minimum(np.searchsorted(self.frames, frame_numbers), len(self.frames) - 1)
+            found = self.frames[positions] == frame_numbers
+            starts[found] = self.offsets[positions[found]]
+            lengths[found] = self.offsets[positions[found] + 1] - starts[found]
+        offsets, rows = gather_rows(starts, lengths)
+        return DetectionStore(frame_numbers, offsets, self.track_ids[rows], self.xyxy[rows], self.conf[rows])
+
+
+class DetectionStoreBuilder:
+    """Accumulate per-frame detections in flat buffers; a later append() of the same frame number replaces earlier ones."""
+
+    def __init__(self) -> None:
+        self.record_frames = array.array("q")
+        self.record_starts = array.array("q")
+        self.track_ids = array.array("q")
+        self.coords = array.array("d")
+        self.conf = array.array("f")
+
+    def append(self, frame_number: int, detections: FrameDetections) -> None:
+        self.record_frames.append(frame_number)
+        self.record_starts.append(len(self.track_ids))
+        self.track_ids.frombytes(np.ascontiguousarray(detections.track_ids, dtype=np.int64).tobytes())
+        self.coords.frombytes(np.ascontiguousarray(detections.xyxy, dtype=np.float64).tobytes())
+        self.conf.frombytes(np.ascontiguousarray(detections.conf, dtype=np.float32).tobytes())
+
+    def extend(self, store: DetectionStore) -> None:
+        for position, frame_number in enumerate(store.frames.tolist()):
+            self.append(frame_number, store.frame(position))
+
+    def build(self) -> DetectionStore:
+        record_starts = np.array(self.record_starts, dtype=np.int64)
+        record_ends = np.append(record_starts[1:], len(self.track_ids)).astype(np.int64)
+        return detection_store_from_records(
+            np.array(self.record_frames, dtype=np.int64),
+            record_starts,
+            record_ends - record_starts,
+            np.frombuffer(self.track_ids, dtype=np.int64),
+            np.frombuffer(self.coords, dtype=np.float64).reshape(-1, 4),
+            np.frombuffer(self.conf, dtype=np.float32),
+        )
+
+
+def detection_store_from_records(
+    record_frames: np.ndarray,
+    record_starts: np.ndarray,
+    record_counts: np.ndarray,
+    track_ids: np.ndarray,
+    xyxy: np.ndarray,
+    conf: np.ndarray,
+) -> DetectionStore:
+    """Build a store from per-frame records that own rows record_starts[i]:record_starts[i] + record_counts[i] of
+    the row columns; the last record of a frame number wins. Only the selected rows are copied."""
+    record_frames = np.asarray(record_frames, dtype=np.int64)
+    order = np.lexsort((np.arange(len(record_frames)), record_frames))
+    sorted_frames = record_frames[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = sorted_frames[1:] != sorted_frames[:-1]
+    winners = order[last]
+    offsets, rows = gather_rows(
+        np.asarray(record_starts, dtype=np.int64)[winners],
+        np.asarray(record_counts, dtype=np.int64)[winners],
+    )
+    return DetectionStore(
+        record_frames[winners],
+        offsets,
+        track_ids[rows].astype(np.int64),
+        xyxy[rows].astype(np.float64),
+        conf[rows].astype(np.float32),
+    )
+
+
 def live_detection_record(
     index: int,
-    frame_detections: list[tuple[int, np.ndarray]],
+    frame_detections: FrameDetections,
     segment_id: str,
     revision: int,
     segment_n: int,
 ) -> dict[str, object]:
     detections = []
-    for track_id, bbox in frame_detections:
-        detections.append(
-            {
-                "track_id": int(track_id),
-                "xyxy": [float(value) for value in bbox],
-                "bbox": xyxy_to_xywh(bbox),
-            }
-        )
+    for track_id, bbox, conf in zip(
+        frame_detections.track_ids.tolist(),
+        frame_detections.xyxy.tolist(),
+        frame_detections.conf.tolist(),
+    ):
+        detection: dict[str, object] = {
+            "track_id": track_id,
+            "xyxy": bbox,
+            "bbox": xyxy_to_xywh(bbox),
+        }
+        if not math.isnan(conf):
+            detection["conf"] = round(conf, 4)
+        detections.append(detection)
     return {
         "schema": "video_track.live.v1",
         "type": "frame",
@@ -758,77 +968,359 @@ def xywh_list_to_xyxy_array(frames: list[dict[str, object]]) -> np.ndarray:
 
 
 def select_target_track(
-    detections_by_frame: list[list[tuple[int, np.ndarray]]],
+    store: DetectionStore,
     init_frame: int,
     init_bbox: tuple[float, float, float, float],
     fps: float,
 ) -> tuple[int, int, float]:
+    """Pick the track overlapping init_bbox best within +-2s of init_frame; each frame of distance costs 0.001 IoU.
+
+    All candidate boxes are scored in one IoU pass. Ties go to the nearest frame, then the earlier frame, then the
+    earlier box, as a frame-by-frame scan outward from init_frame would choose.
+    """
     init_xyxy = xywh_to_xyxy(init_bbox)
     max_offset = max(1, round(fps * 2))
-    best: tuple[float, int, int] | None = None
-
-    for offset in range(max_offset + 1):
-        candidate_frames = [init_frame] if offset == 0 else [init_frame - offset, init_frame + offset]
-        for frame_index in candidate_frames:
-            if frame_index < 0 or frame_index >= len(detections_by_frame):
-                continue
-            for track_id, bbox in detections_by_frame[frame_index]:
-                iou = bbox_iou(init_xyxy, bbox)
-                score = iou - offset * 0.001
-                if best is None or score > best[0]:
-                    best = (score, track_id, frame_index)
+    first = max(0, init_frame - max_offset)
+    last = min(len(store) - 1, init_frame + max_offset)
+    row_start = int(store.offsets[first]) if first <= last else 0
+    row_end = int(store.offsets[last + 1]) if first <= last else 0
+    if row_end <= row_start:
+        raise RuntimeError("No YOLO track overlapped --init-bbox near --init-time")
 
-    if best is None or best[0] <= 0:
+    rows = np.arange(row_start, row_end, dtype=np.int64)
+    positions = store.row_positions(rows)
+    offsets = np.abs(positions - init_frame)
+    scores = bbox_iou_matrix(init_xyxy, store.xyxy[row_start:row_end])[0] - offsets * 0.001
+    order = np.lexsort((rows, positions > init_frame, offsets))
+    best = int(order[np.argmax(scores[order])])
+    score = float(scores[best])
+    if score <= 0:
         raise RuntimeError("No YOLO track overlapped --init-bbox near --init-time")
-    score, track_id, frame_index = best
-    return track_id, frame_index, max(0.0, score)
+    return int(store.track_ids[row_start + best]), int(positions[best]), max(0.0, score)
 
 
 def select_target_bboxes_by_iou(
-    detections_by_frame: list[list[tuple[int, np.ndarray]]],
+    store: DetectionStore,
     init_frame: int,
     init_bbox: tuple[float, float, float, float],
     fps: float,
 ) -> tuple[np.ndarray, int, int, float]:
+    """Follow the selected track over all frames; where its ID is missing, continue with the box that overlaps the
+    previously followed box by at least min_switch_iou.
+
+    Frames that contain the target ID are filled in one vectorized pass; only the frames without it are walked,
+    outward from the selected frame, with one IoU row per frame.
+    """
     min_switch_iou = 0.20
-    target_id, selected_frame, selected_iou = select_target_track(detections_by_frame, init_frame, init_bbox, fps)
-    selected_bbox: np.ndarray | None = None
-    for track_id, bbox in detections_by_frame[selected_frame]:
-        if track_id == target_id:
-            selected_bbox = bbox
-            break
-    if selected_bbox is None:
+    target_id, selected_frame, selected_iou = select_target_track(store, init_frame, init_bbox, fps)
+    raw_bboxes = store.track_bboxes(target_id)
+    present = ~np.isnan(raw_bboxes[:, 0])
+    if not present[selected_frame]:
         raise RuntimeError("Selected YOLO track disappeared on selected frame")
+    gaps = np.flatnonzero(~present)
+
+    def fill(gap_frames: np.ndarray, step: int) -> None:
+        previous_bbox = raw_bboxes[selected_frame]
+        for frame_index in gap_frames.tolist():
+            if present[frame_index - step]:
+                previous_bbox = raw_bboxes[frame_index - step]
+            xyxy = store.frame(frame_index).xyxy
+            if len(xyxy) == 0:
+                continue
+            ious = bbox_iou_matrix(previous_bbox, xyxy)[0]
+            best = int(np.argmax(ious))
+            if ious[best] >= min_switch_iou:
+                raw_bboxes[frame_index] = xyxy[best]
+                previous_bbox = raw_bboxes[frame_index]
+
+    fill(gaps[gaps < selected_frame][::-1], -1)
+    fill(gaps[gaps > selected_frame], 1)
+    return raw_bboxes, target_id, selected_frame, selected_iou
 
-    raw_bboxes = np.full((len(detections_by_frame), 4), np.nan, dtype=np.float64)
-    raw_bboxes[selected_frame] = selected_bbox
 
-    def fill(step: int) -> None:
-        previous_bbox = selected_bbox
-        frame_index = selected_frame + step
-        while 0 <= frame_index < len(detections_by_frame):
-            same_track_bbox: np.ndarray | None = None
-            best_bbox: np.ndarray | None = None
-            best_iou = 0.0
-            for track_id, bbox in detections_by_frame[frame_index]:
-                if track_id == target_id:
-                    same_track_bbox = bbox
+DETECT_QUEUE_SIZE = 4
+LIVE_FLUSH_INTERVAL = 0.5
+PIPELINE_POLL_INTERVAL = 0.1
+_PIPELINE_END = object()
+
+
+class DetectedFrame(t.NamedTuple):
+    index: int
+    original_index: int
+    frame: np.ndarray
+    detections: FrameDetections
+
+
+class StageTimer:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.busy = 0.0
+        self.wait = 0.0
+        self.count = 0
+
+    def summary(self) -> str:
+        per_frame_ms = self.busy / max(1, self.count) * 1000
+        return f"{self.name} {self.busy:.1f}s ({per_frame_ms:.1f} ms/frame, waited {self.wait:.1f}s)"
+
+
+class LiveJsonlWriter:
+    """Write video_track.live.v1 JSONL records, flushing at most every LIVE_FLUSH_INTERVAL seconds."""
+
+    def __init__(self, path: Path, append: bool) -> None:
+        self.file = path.open("a" if append else "w", encoding="utf-8")
+        self.last_flush = time.monotonic()
+
+    def __enter__(self) -> LiveJsonlWriter:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def write(self, record: dict[str, object], *, flush: bool = False) -> None:
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        now = time.monotonic()
+        if flush or now - self.last_flush >= LIVE_FLUSH_INTERVAL:
+            self.file.flush()
+            self.last_flush = now
+
+    def write_meta(self, meta: dict[str, object]) -> None:
+        self.write(meta, flush=True)
+
+    def write_frame(
+        self,
+        index: int,
+        frame_detections: FrameDetections,
+        segment_id: str,
+        revision: int,
+        segment_n: int,
+    ) -> None:
+        self.write(live_detection_record(index, frame_detections, segment_id, revision, segment_n))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def open_live_writer(path: Path, append: bool) -> LiveJsonlWriter | LiveBinWriter:
+    from video_track_live_bin import LiveBinWriter, is_live_bin_path
+
+    if is_live_bin_path(path):
+        return LiveBinWriter(path, append)
+    return LiveJsonlWriter(path, append)
+
+
+def result_detections(result: object) -> FrameDetections:
+    boxes = result.boxes
+    if boxes is None or boxes.id is None:
+        return make_frame_detections([], [])
+    conf = getattr(boxes, "conf", None)
+    return make_frame_detections(
+        boxes.id.cpu().numpy(),
+        boxes.xyxy.cpu().numpy(),
+        None if conf is None else conf.cpu().numpy(),
+    )
+
+
+def pipeline_put(out: queue.Queue[object], item: object, stop: threading.Event, timer: StageTimer) -> bool:
+    started_at = time.monotonic()
+    try:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=PIPELINE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+    finally:
+        timer.wait += time.monotonic() - started_at
+
+
+def pipeline_get(src: queue.Queue[object], stop: threading.Event, timer: StageTimer) -> object:
+    started_at = time.monotonic()
+    try:
+        while not stop.is_set():
+            try:
+                return src.get(timeout=PIPELINE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _PIPELINE_END
+    finally:
+        timer.wait += time.monotonic() - started_at
+
+
+def decode_detect_frames(
+    src: Path,
+    frame_indices: list[int] | None,
+    out: queue.Queue[object],
+    stop: threading.Event,
+    timer: StageTimer,
+    frame_cache: FrameCacheOptions | None = None,
+    proxy_size: tuple[int, int] | None = None,
+) -> None:
+    cap = open_video_capture(src, frame_cache)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open {src}")
+    try:
+        position = 0
+        index = 0
+        while frame_indices is None or index < len(frame_indices):
+            original_index = index if frame_indices is None else frame_indices[index]
+            started_at = time.monotonic()
+            if original_index != position:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, original_index)
+            ok, frame = cap.read()
+            if ok and proxy_size is not None and frame.shape[1::-1] != proxy_size:
+                frame = cv2.resize(frame, proxy_size, interpolation=cv2.INTER_AREA)
+            timer.busy += time.monotonic() - started_at
+            if not ok:
+                if frame_indices is None:
                     break
-                iou = bbox_iou(previous_bbox, bbox)
-                if best_bbox is None or iou > best_iou:
-                    best_bbox = bbox
-                    best_iou = iou
-            if same_track_bbox is not None:
-                raw_bboxes[frame_index] = same_track_bbox
-                previous_bbox = same_track_bbox
-            elif best_bbox is not None and best_iou >= min_switch_iou:
-                raw_bboxes[frame_index] = best_bbox
-                previous_bbox = best_bbox
-            frame_index += step
+                if index:
+                    logger.warning(
+                        "could not read frame %s from %s; detect range truncated to %s frames ending at source frame %s",
+                        original_index,
+                        src,
+                        index,
+                        frame_indices[index - 1],
+                    )
+                    break
+                raise RuntimeError(f"Could not read frame {original_index} from {src}")
+            position = original_index + 1
+            timer.count += 1
+            if not pipeline_put(out, (index, original_index, frame), stop, timer):
+                return
+            index += 1
+    finally:
+        cap.release()
+        pipeline_put(out, _PIPELINE_END, stop, timer)
 
-    fill(-1)
-    fill(1)
-    return raw_bboxes, target_id, selected_frame, selected_iou
+
+def reset_tracker(detector: YOLO) -> None:
+    """Drop the tracks detector.track(persist=True) carries over, so the next frame starts new track IDs."""
+    predictor = getattr(detector, "predictor", None)
+    for tracker in getattr(predictor, "trackers", None) or ():
+        tracker.reset()
+
+
+def run_detect_pipeline(
+    src: Path,
+    detector: YOLO,
+    class_id: int | None,
+    frame_indices: list[int] | None,
+    consume: t.Callable[[DetectedFrame], None],
+    *,
+    desc: str,
+    total: int,
+    frame_cache: FrameCacheOptions | None = None,
+    proxy_scale: float = 1.0,
+    need_frame: bool = True,
+    tracker_resets: t.Container[int] = (),
+) -> int:
+    """Run decode, YOLO tracking and consume() as three stages connected by bounded queues.
+
+    Decoding runs on its own thread, tracking runs on the calling thread (the tracker state is not thread-safe),
+    and consume() runs on a writer thread in frame order. Returns the number of frames consumed.
+
+    With proxy_scale < 1, tracking runs on frames downscaled by proxy_scale (read from the frame cache when it
+    holds them at that scale); detections are scaled back to source coordinates and consume() gets the frame resized
+    to the source size, or the proxy frame as is when need_frame is False (consume() does not look at the frame).
+
+    The tracker is reset before tracking the frame at each position of frame_indices in tracker_resets, for runs
+    of frames that are not continuous with the frames before them.
+    """
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    decoded: queue.Queue[object] = queue.Queue(maxsize=DETECT_QUEUE_SIZE)
+    detected: queue.Queue[object] = queue.Queue(maxsize=DETECT_QUEUE_SIZE)
+    decode_timer = StageTimer("decode")
+    infer_timer = StageTimer("infer")
+    write_timer = StageTimer("write")
+    source_size = None
+    proxy_size = None
+    if proxy_scale != 1:
+        info = load_video_info(src)
+        source_size = (info.width, info.height)
+        proxy_size = proxy_frame_size(info.width, info.height, proxy_scale)
+
+    def guarded(target: t.Callable[[], None]) -> t.Callable[[], None]:
+        def run() -> None:
+            try:
+                target()
+            except BaseException as exc:
+                errors.append(exc)
+                stop.set()
+
+        return run
+
+    def write() -> None:
+        with tqdm_progress(total=total, desc=desc, unit="frame") as progress:
+            while True:
+                item = pipeline_get(detected, stop, write_timer)
+                if item is _PIPELINE_END:
+                    return
+                assert isinstance(item, DetectedFrame)
+                started_at = time.monotonic()
+                consume(item)
+                write_timer.busy += time.monotonic() - started_at
+                write_timer.count += 1
+                progress.update(1)
+
+    threads = [
+        threading.Thread(
+            target=guarded(lambda: decode_detect_frames(src, frame_indices, decoded, stop, decode_timer, frame_cache, proxy_size)),
+            name="detect-decode",
+            daemon=True,
+        ),
+        threading.Thread(target=guarded(write), name="detect-write", daemon=True),
+    ]
+    started_at = time.monotonic()
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = pipeline_get(decoded, stop, infer_timer)
+            if item is _PIPELINE_END:
+                break
+            index, original_index, frame = item
+            infer_started_at = time.monotonic()
+            if index in tracker_resets:
+                reset_tracker(detector)
+            result = detector.track(
+                source=frame,
+                persist=True,
+                verbose=False,
+                classes=None if class_id is None else [class_id],
+            )[0]
+            frame_detections = result_detections(result)
+            if source_size is not None and frame.shape[1::-1] != source_size:
+                frame_detections = scale_frame_detections(
+                    frame_detections,
+                    source_size[0] / frame.shape[1],
+                    source_size[1] / frame.shape[0],
+                )
+                if need_frame:
+                    frame = cv2.resize(frame, source_size, interpolation=cv2.INTER_LINEAR)
+            infer_timer.busy += time.monotonic() - infer_started_at
+            infer_timer.count += 1
+            if not pipeline_put(detected, DetectedFrame(index, original_index, frame, frame_detections), stop, infer_timer):
+                break
+        pipeline_put(detected, _PIPELINE_END, stop, infer_timer)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    logger.info(
+        "detect stages: %s; %s; %s; %s frames in %.1fs",
+        decode_timer.summary(),
+        infer_timer.summary(),
+        write_timer.summary(),
+        write_timer.count,
+        time.monotonic() - started_at,
+    )
+    return write_timer.count
 
 
 def detect_target_bboxes(
@@ -845,19 +1337,52 @@ def detect_target_bboxes(
     info = load_video_info(src)
     fps = info.fps
     frame_count = info.frame_count
+    preview_renderer: PreviewRenderer | None = None
     if preview:
-        open_preview_window("video_track detect", info.width, info.height)
+        from video_track_preview import PreviewRenderer
+
+        preview_renderer = PreviewRenderer("video_track detect", info.width, info.height, draw_detect_gui_preview)
     init_frame = min(max(0, round(init_time * fps)), max(0, frame_count - 1))
     init_xyxy = xywh_to_xyxy(init_bbox)
 
     logger.info("detect start: %s frames, %.3f fps, init_frame=%s", frame_count, fps, init_frame)
-    detections_by_frame: list[list[tuple[int, np.ndarray]]] = []
-    index = 0
-    live_file = None
+    builder = DetectionStoreBuilder()
+    live_writer: LiveJsonlWriter | LiveBinWriter | None = None
     preview_target_track_id: int | None = None
+
+    def consume(item: DetectedFrame) -> None:
+        nonlocal preview_target_track_id
+        builder.append(item.index, item.detections)
+        if live_writer is not None:
+            live_writer.write_frame(item.index, item.detections, "base", 0, item.index)
+        if preview_renderer is not None:
+            preview_target_track_id = keep_preview_target_track(
+                preview_target_track_id,
+                item.detections,
+                init_xyxy,
+            )
+            if preview_renderer.due():
+                pct = item.index / max(1, frame_count - 1) * 100
+                status_text = detect_preview_status(
+                    item.index,
+                    fps,
+                    pct,
+                    frame_count,
+                    0,
+                    max(0, frame_count - 1),
+                )
+                preview_renderer.submit(
+                    item.frame,
+                    item.detections,
+                    init_bbox,
+                    item.index,
+                    status_text,
+                    preview_target_track_id,
+                )
+
     try:
         if live_json is not None:
-            live_file = live_json.open("w", encoding="utf-8")
+            live_writer = open_live_writer(live_json, append=False)
             live_meta = {
                 "schema": "video_track.live.v1",
                 "type": "meta",
@@ -871,79 +1396,22 @@ def detect_target_bboxes(
                 "init_bbox_order": "x:y:w:h",
                 "note": "Raw YOLO detections are written as they are processed. The final target track is written to track_json after detection completes.",
             }
-            live_file.write(json.dumps(live_meta, separators=(",", ":")) + "\n")
-            live_file.flush()
+            live_writer.write_meta(live_meta)
             logger.info("live detect JSONL start: %s", live_json)
-        stream = detector.track(
-            source=str(src),
-            stream=True,
-            classes=None if class_id is None else [class_id],
-            verbose=False,
-        )
-        with tqdm_progress(total=frame_count, desc="detect", unit="frame") as progress:
-            for result in stream:
-                frame_detections: list[tuple[int, np.ndarray]] = []
-                boxes = result.boxes
-                if boxes is not None and boxes.id is not None:
-                    ids = boxes.id.cpu().numpy().astype(int)
-                    xyxy = boxes.xyxy.cpu().numpy().astype(np.float64)
-                    frame_detections = [(int(track_id), bbox) for track_id, bbox in zip(ids, xyxy)]
-                detections_by_frame.append(frame_detections)
-
-                if live_file is not None:
-                    live_file.write(
-                        json.dumps(live_detection_record(index, frame_detections, "base", 0, index), separators=(",", ":"))
-                        + "\n"
-                    )
-                    live_file.flush()
-
-                if preview:
-                    pct = index / max(1, frame_count - 1) * 100
-                    status_text = detect_preview_status(
-                        index,
-                        fps,
-                        pct,
-                        frame_count,
-                        0,
-                        max(0, frame_count - 1),
-                    )
-                    preview_target_track_id = keep_preview_target_track(
-                        preview_target_track_id,
-                        frame_detections,
-                        init_xyxy,
-                    )
-                    preview_frame = draw_preview_frame(
-                        result.orig_img,
-                        frame_detections,
-                        init_bbox,
-                        index,
-                        status_text,
-                        target_track_id=preview_target_track_id,
-                    )
-                    cv2.imshow("video_track detect", preview_frame)
-                    key = cv2.waitKey(1) & 0xFF
-                    if key in (27, ord("q")):
-                        raise KeyboardInterrupt("preview interrupted")
-
-                index += 1
-                progress.update(1)
+        index = run_detect_pipeline(src, detector, class_id, None, consume, desc="detect", total=frame_count)
     finally:
-        if live_file is not None:
-            live_file.close()
+        if live_writer is not None:
+            live_writer.close()
             logger.info("live detect JSONL written: %s", live_json)
-        if preview:
-            cv2.destroyWindow("video_track detect")
+        if preview_renderer is not None:
+            preview_renderer.close()
 
     if index == 0:
         raise RuntimeError(f"No frames read from {src}")
 
-    target_id, selected_frame, selected_iou = select_target_track(detections_by_frame, init_frame, init_bbox, fps)
-    raw_bboxes = np.full((index, 4), np.nan, dtype=np.float64)
-    for frame_index, detections in enumerate(detections_by_frame):
-        for track_id, bbox in detections:
-            if track_id == target_id:
-                raw_bboxes[frame_index] = bbox
-                break
+    store = builder.build()
+    target_id, selected_frame, selected_iou = select_target_track(store, init_frame, init_bbox, fps)
+    raw_bboxes = store.track_bboxes(target_id)
 
     bboxes, missing_count = interpolate_bboxes(raw_bboxes)
     bboxes = smooth(bboxes, radius=max(5, round(fps * 0.12)))
@@ -968,6 +1436,45 @@ def detect_target_bboxes(
     }
 
 
+def live_segment_meta(
+    src: Path,
+    info: VideoInfo,
+    init_crop: tuple[float, float, float, float],
+    init_time: float,
+    live_meta_extra: dict[str, object] | None,
+    *,
+    segment_id: str,
+    revision: int,
+    frame_indices: list[int] | None,
+    direction: str,
+) -> dict[str, object]:
+    frame_count = info.frame_count if frame_indices is None else len(frame_indices)
+    init_frame = min(max(0, round(init_time * info.fps)), max(0, frame_count - 1))
+    live_meta: dict[str, object] = {
+        "schema": "video_track.live.v1",
+        "type": "meta",
+        "segment_id": segment_id,
+        "revision": revision,
+        "source": str(src),
+        "frame_count": frame_count,
+        "source_frame_count": info.frame_count,
+        "segment_frame_count": frame_count,
+        "fps": info.fps,
+        **(live_meta_extra or {}),
+        "init_time": init_time,
+        "init_frame": frame_indices[init_frame] if frame_indices is not None else init_frame,
+        "segment_init_frame": init_frame,
+        "direction": direction,
+        "init_crop": list(init_crop),
+        "init_crop_order": "w:h:x:y",
+        "init_bbox": list(crop_to_xywh(init_crop)),
+        "init_bbox_order": "x:y:w:h",
+    }
+    if frame_indices is not None:
+        live_meta["frame_range"] = [frame_indices[0], frame_indices[-1]]
+    return live_meta
+
+
 def write_live_detection_data(
     src: Path,
     detector: YOLO,
@@ -984,21 +1491,27 @@ def write_live_detection_data(
     revision: int = 0,
     frame_indices: list[int] | None = None,
     direction: str = "forward",
+    frame_cache: FrameCacheOptions | None = None,
+    proxy_scale: float = 1.0,
 ) -> None:
     started_at = time.monotonic()
     init_bbox = crop_to_xywh(init_crop)
     info = load_video_info(src)
     fps = info.fps
-    source_frame_count = info.frame_count
-    frame_count = source_frame_count if frame_indices is None else len(frame_indices)
+    frame_count = info.frame_count if frame_indices is None else len(frame_indices)
+    preview_renderer: PreviewRenderer | None = None
     if preview:
-        open_preview_window("video_track detect", info.width, info.height)
+        from video_track_preview import PreviewRenderer
+
+        preview_renderer = PreviewRenderer("video_track detect", info.width, info.height, draw_detect_gui_preview)
     preview_mp4v_path = default_detect_preview_mp4v_path(src)
     preview_h264_path = default_detect_preview_h264_path(src)
     preview_video_fps_value = detect_preview_video_fps(fps, frame_indices)
     init_frame = min(max(0, round(init_time * fps)), max(0, frame_count - 1))
     init_frame_original = frame_indices[init_frame] if frame_indices is not None else init_frame
     init_xyxy = xywh_to_xyxy(init_bbox)
+    range_first = 0 if frame_indices is None else frame_indices[0]
+    range_last = max(0, frame_count - 1) if frame_indices is None else frame_indices[-1]
     if frame_indices is None:
         logger.debug(
             "detect start: %s frames, %.3f fps, segment=%s revision=%s init_frame=%s",
@@ -1018,241 +1531,135 @@ def write_live_detection_data(
             init_frame_original,
             direction,
         )
-    index = 0
     preview_target_track_id: int | None = None
     preview_video_writer = None
     preview_h264_process: subprocess.Popen[bytes] | None = None
-    try:
-        with live_json.open("a" if append else "w", encoding="utf-8") as live_file:
-            live_meta = {
-                "schema": "video_track.live.v1",
-                "type": "meta",
-                "segment_id": segment_id,
-                "revision": revision,
-                "source": str(src),
-                "frame_count": frame_count,
-                "source_frame_count": source_frame_count,
-                "segment_frame_count": frame_count,
-                "fps": fps,
-                **(live_meta_extra or {}),
-                "init_time": init_time,
-                "init_frame": init_frame_original,
-                "segment_init_frame": init_frame,
-                "direction": direction,
-                "init_crop": list(init_crop),
-                "init_crop_order": "w:h:x:y",
-                "init_bbox": list(init_bbox),
-                "init_bbox_order": "x:y:w:h",
-            }
-            if frame_indices is not None:
-                live_meta["frame_range"] = [frame_indices[0], frame_indices[-1]]
-            live_file.write(json.dumps(live_meta, separators=(",", ":")) + "\n")
-            live_file.flush()
-            logger.info("live detect JSONL start: %s", live_json)
+    live_writer: LiveJsonlWriter | LiveBinWriter | None = None
+
+    def consume(item: DetectedFrame) -> None:
+        nonlocal preview_target_track_id, preview_video_writer, preview_h264_process
+        assert live_writer is not None
+        live_writer.write_frame(item.original_index, item.detections, segment_id, revision, item.index)
 
-            if frame_indices is None:
-                stream = detector.track(
-                    source=str(src),
-                    stream=True,
-                    classes=None if class_id is None else [class_id],
-                    verbose=False,
+        preview_target_track_id = keep_preview_target_track(
+            preview_target_track_id,
+            item.detections,
+            init_xyxy,
+        )
+        saved_status_text = detect_saved_preview_status(
+            item.original_index,
+            fps,
+        )
+        saved_preview_frame = draw_preview_frame(
+            item.frame,
+            item.detections,
+            init_bbox,
+            item.original_index,
+            saved_status_text,
+            target_track_id=preview_target_track_id,
+            control_text=detect_saved_preview_control_text(),
+        )
+        if preview_video_writer is None:
+            preview_video_writer, preview_h264_process, output_preview_frame = open_detect_preview_video_writers(
+                preview_mp4v_path,
+                preview_h264_path,
+                preview_video_fps_value,
+                saved_preview_frame,
+                preview_video_max_height,
+            )
+        else:
+            output_preview_frame = resize_preview_video_frame(saved_preview_frame, preview_video_max_height)
+        preview_video_writer.write(output_preview_frame)
+        if preview_h264_process is not None and preview_h264_process.stdin is not None:
+            preview_h264_process.stdin.write(output_preview_frame.tobytes())
+
+        if preview_renderer is not None and preview_renderer.due():
+            pct = item.index / max(1, frame_count - 1) * 100
+            status_text = detect_preview_status(
+                item.original_index,
+                fps,
+                pct,
+                frame_count,
+                range_first,
+                range_last,
+            )
+            preview_renderer.submit(
+                item.frame,
+                item.detections,
+                init_bbox,
+                item.original_index,
+                status_text,
+                preview_target_track_id,
+            )
+
+    index = 0
+    try:
+        with open_live_writer(live_json, append) as live_writer:
+            live_writer.write_meta(
+                live_segment_meta(
+                    src,
+                    info,
+                    init_crop,
+                    init_time,
+                    live_meta_extra,
+                    segment_id=segment_id,
+                    revision=revision,
+                    frame_indices=frame_indices,
+                    direction=direction,
                 )
-                with tqdm_progress(total=frame_count, desc=f"detect {segment_id}", unit="frame") as progress:
-                    for result in stream:
-                        frame_detections: list[tuple[int, np.ndarray]] = []
-                        boxes = result.boxes
-                        if boxes is not None and boxes.id is not None:
-                            ids = boxes.id.cpu().numpy().astype(int)
-                            xyxy = boxes.xyxy.cpu().numpy().astype(np.float64)
-                            frame_detections = [(int(track_id), bbox) for track_id, bbox in zip(ids, xyxy)]
-
-                        original_index = index
-                        live_file.write(
-                            json.dumps(
-                                live_detection_record(original_index, frame_detections, segment_id, revision, index),
-                                separators=(",", ":"),
-                            )
-                            + "\n"
-                        )
-                        live_file.flush()
-
-                        preview_target_track_id = keep_preview_target_track(
-                            preview_target_track_id,
-                            frame_detections,
-                            init_xyxy,
-                        )
-                        saved_status_text = detect_saved_preview_status(
-                            original_index,
-                            fps,
-                        )
-                        saved_preview_frame = draw_preview_frame(
-                            result.orig_img,
-                            frame_detections,
-                            init_bbox,
-                            original_index,
-                            saved_status_text,
-                            target_track_id=preview_target_track_id,
-                            control_text=detect_saved_preview_control_text(),
-                        )
-                        if preview_video_writer is None:
-                            preview_video_writer, preview_h264_process, output_preview_frame = open_detect_preview_video_writers(
-                                preview_mp4v_path,
-                                preview_h264_path,
-                                preview_video_fps_value,
-                                saved_preview_frame,
-                                preview_video_max_height,
-                            )
-                        else:
-                            output_preview_frame = resize_preview_video_frame(saved_preview_frame, preview_video_max_height)
-                        preview_video_writer.write(output_preview_frame)
-                        if preview_h264_process is not None and preview_h264_process.stdin is not None:
-                            preview_h264_process.stdin.write(output_preview_frame.tobytes())
-
-                        if preview:
-                            pct = index / max(1, frame_count - 1) * 100
-                            status_text = detect_preview_status(
-                                original_index,
-                                fps,
-                                pct,
-                                frame_count,
-                                0,
-                                max(0, frame_count - 1),
-                            )
-                            preview_frame = draw_preview_frame(
-                                result.orig_img,
-                                frame_detections,
-                                init_bbox,
-                                original_index,
-                                status_text,
-                                target_track_id=preview_target_track_id,
-                            )
-                            cv2.imshow("video_track detect", preview_frame)
-                            key = cv2.waitKey(1) & 0xFF
-                            if key in (27, ord("q")):
-                                raise KeyboardInterrupt("preview interrupted")
-
-                        index += 1
-                        progress.update(1)
-            else:
-                cap = cv2.VideoCapture(str(src))
-                if not cap.isOpened():
-                    raise RuntimeError(f"Could not open {src}")
-                try:
-                    with tqdm_progress(total=frame_count, desc=f"detect {segment_id}", unit="frame") as progress:
-                        for original_index in frame_indices:
-                            cap.set(cv2.CAP_PROP_POS_FRAMES, original_index)
-                            ok, frame = cap.read()
-                            if not ok:
-                                if index:
-                                    logger.warning(
-                                        "could not read frame %s from %s; detect range truncated to %s frames ending at source frame %s",
-                                        original_index,
-                                        src,
-                                        index,
-                                        frame_indices[index - 1],
-                                    )
-                                    break
-                                raise RuntimeError(f"Could not read frame {original_index} from {src}")
-
-                            result = detector.track(
-                                source=frame,
-                                persist=True,
-                                verbose=False,
-                                classes=None if class_id is None else [class_id],
-                            )[0]
-                            frame_detections = []
-                            boxes = result.boxes
-                            if boxes is not None and boxes.id is not None:
-                                ids = boxes.id.cpu().numpy().astype(int)
-                                xyxy = boxes.xyxy.cpu().numpy().astype(np.float64)
-                                frame_detections = [(int(track_id), bbox) for track_id, bbox in zip(ids, xyxy)]
-
-                            live_file.write(
-                                json.dumps(
-                                    live_detection_record(original_index, frame_detections, segment_id, revision, index),
-                                    separators=(",", ":"),
-                                )
-                                + "\n"
-                            )
-                            live_file.flush()
-
-                            preview_target_track_id = keep_preview_target_track(
-                                preview_target_track_id,
-                                frame_detections,
-                                init_xyxy,
-                            )
-                            saved_status_text = detect_saved_preview_status(
-                                original_index,
-                                fps,
-                            )
-                            saved_preview_frame = draw_preview_frame(
-                                frame,
-                                frame_detections,
-                                init_bbox,
-                                original_index,
-                                saved_status_text,
-                                target_track_id=preview_target_track_id,
-                                control_text=detect_saved_preview_control_text(),
-                            )
-                            if preview_video_writer is None:
-                                preview_video_writer, preview_h264_process, output_preview_frame = open_detect_preview_video_writers(
-                                    preview_mp4v_path,
-                                    preview_h264_path,
-                                    preview_video_fps_value,
-                                    saved_preview_frame,
-                                    preview_video_max_height,
-                                )
-                            else:
-                                output_preview_frame = resize_preview_video_frame(saved_preview_frame, preview_video_max_height)
-                            preview_video_writer.write(output_preview_frame)
-                            if preview_h264_process is not None and preview_h264_process.stdin is not None:
-                                preview_h264_process.stdin.write(output_preview_frame.tobytes())
-
-                            if preview:
-                                pct = index / max(1, frame_count - 1) * 100
-                                status_text = detect_preview_status(
-                                    original_index,
-                                    fps,
-                                    pct,
-                                    frame_count,
-                                    frame_indices[0],
-                                    frame_indices[-1],
-                                )
-                                preview_frame = draw_preview_frame(
-                                    frame,
-                                    frame_detections,
-                                    init_bbox,
-                                    original_index,
-                                    status_text,
-                                    target_track_id=preview_target_track_id,
-                                )
-                                cv2.imshow("video_track detect", preview_frame)
-                                key = cv2.waitKey(1) & 0xFF
-                                if key in (27, ord("q")):
-                                    raise KeyboardInterrupt("preview interrupted")
-
-                            index += 1
-                            progress.update(1)
-                finally:
-                    cap.release()
+            )
+            logger.info("live detect JSONL start: %s", live_json)
+            index = run_detect_pipeline(
+                src,
+                detector,
+                class_id,
+                frame_indices,
+                consume,
+                desc=f"detect {segment_id}",
+                total=frame_count,
+                frame_cache=frame_cache,
+                proxy_scale=proxy_scale,
+            )
     finally:
         close_detect_preview_video_writers(preview_video_writer, preview_h264_process)
-        if preview:
-            cv2.destroyWindow("video_track detect")
+        if preview_renderer is not None:
+            preview_renderer.close()
 
     if index == 0:
         raise RuntimeError(f"No frames read from {src}")
-    logger.info("live detect JSONL written: %s", live_json)
+    logger.info("live detect JSONL written: %s in %.1fs", live_json, time.monotonic() - started_at)
     logger.info("detect preview mp4v video written: %s", preview_mp4v_path)
     logger.info("detect preview h264 video written: %s", preview_h264_path)
 
 
+SEGMENT_REVERSE_BUFFER_BYTES = 512 * 1024 * 1024
+
+
+def read_frame_run(cap: object, first_frame: int, count: int, out: np.ndarray) -> int:
+    """Seek to first_frame and decode up to count frames sequentially into out[0..]; returns the number read."""
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
+    for offset in range(count):
+        ok, _frame = cap.read(out[offset])
+        if not ok:
+            return offset
+    return count
+
+
 def write_segment_video(
     src: Path,
     dst: Path,
     start_frame: int,
     end_frame: int,
+    *,
+    reverse_buffer_bytes: int = SEGMENT_REVERSE_BUFFER_BYTES,
+    spill_dir: Path | None = None,
 ) -> tuple[list[int], float, tuple[int, int]]:
+    """Write source frames start_frame..end_frame (inclusive; backwards if end_frame < start_frame) to dst.
+
+    A forward range is one seek followed by sequential decoding. A reverse range is decoded forward in windows of
+    at most reverse_buffer_bytes, starting from its last window, and each window is written back to front; with
+    spill_dir the whole range is instead decoded once into a raw memmap there and written backwards from it.
+    """
     started_at = time.monotonic()
     cap = cv2.VideoCapture(str(src))
     if not cap.isOpened():
@@ -1281,44 +1688,85 @@ def write_segment_video(
         raise RuntimeError(f"Could not write {dst}")
 
     written_frame_map: list[int] = []
+    spill_path: Path | None = None
     try:
         with tqdm_progress(total=len(frame_map), desc="segment", unit="frame") as progress:
-            for frame_index in frame_map:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-                ok, frame = cap.read()
-                if not ok:
-                    if written_frame_map:
-                        logger.warning(
-                            "could not read frame %s from %s; segment truncated to %s frames ending at source frame %s",
-                            frame_index,
-                            src,
-                            len(written_frame_map),
-                            written_frame_map[-1],
-                        )
-                        break
-                    raise RuntimeError(f"Could not read frame {frame_index} from {src}")
+
+            def write(frame: np.ndarray, frame_index: int) -> None:
                 writer.write(frame)
                 written_frame_map.append(frame_index)
                 progress.update(1)
+
+            def unreadable(frame_index: int) -> None:
+                if not written_frame_map:
+                    raise RuntimeError(f"Could not read frame {frame_index} from {src}")
+                logger.warning(
+                    "could not read frame %s from %s; segment truncated to %s frames ending at source frame %s",
+                    frame_index,
+                    src,
+                    len(written_frame_map),
+                    written_frame_map[-1],
+                )
+
+            frame_bytes = max(1, src_w * src_h * 3)
+            if step > 0:
+                buffer = np.empty((1, src_h, src_w, 3), dtype=np.uint8)
+                if start_frame:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+                for frame_index in frame_map:
+                    ok, _frame = cap.read(buffer[0])
+                    if not ok:
+                        unreadable(frame_index)
+                        break
+                    write(buffer[0], frame_index)
+            elif spill_dir is not None:
+                spill_path = spill_dir / f"{dst.name}.{os.getpid()}.raw"
+                buffer = np.memmap(spill_path, dtype=np.uint8, mode="w+", shape=(len(frame_map), src_h, src_w, 3))
+                count = read_frame_run(cap, end_frame, len(frame_map), buffer)
+                if count < len(frame_map):
+                    unreadable(start_frame)
+                for offset in range(count - 1, -1, -1):
+                    write(buffer[offset], end_frame + offset)
+                del buffer
+            else:
+                window = max(1, min(len(frame_map), reverse_buffer_bytes // frame_bytes))
+                buffer = np.empty((window, src_h, src_w, 3), dtype=np.uint8)
+                window_last = start_frame
+                while window_last >= end_frame:
+                    window_first = max(end_frame, window_last - window + 1)
+                    count = read_frame_run(cap, window_first, window_last - window_first + 1, buffer)
+                    if count < window_last - window_first + 1:
+                        unreadable(window_last)
+                        break
+                    for offset in range(count - 1, -1, -1):
+                        write(buffer[offset], window_first + offset)
+                    window_last = window_first - 1
     finally:
         writer.release()
         cap.release()
+        if spill_path is not None:
+            spill_path.unlink(missing_ok=True)
 
     if not written_frame_map:
         raise RuntimeError(f"No frames read from {src}")
     logger.info(
-        "segment video written: %s frames %s..%s -> %s",
+        "segment video written: %s frames %s..%s -> %s in %.1fs",
         len(written_frame_map),
         written_frame_map[0],
         written_frame_map[-1],
         dst,
+        time.monotonic() - started_at,
     )
     return written_frame_map, fps, (src_w, src_h)
 
 
 def next_revision(live_json: Path) -> int:
+    from video_track_live_bin import is_live_bin_path, next_live_bin_revision
+
     if not live_json.exists():
         return 1
+    if is_live_bin_path(live_json):
+        return next_live_bin_revision(live_json)
     highest = 0
     with live_json.open("r", encoding="utf-8") as file:
         for line in file:
@@ -1384,20 +1832,26 @@ def build_track_data(
     }
 
 
-def decode_live_frame_record(record: dict[str, object]) -> list[tuple[int, np.ndarray]]:
-    frame_detections: list[tuple[int, np.ndarray]] = []
+def decode_live_frame_record(record: dict[str, object]) -> FrameDetections:
+    track_ids: list[int] = []
+    xyxy: list[list[float]] = []
+    conf: list[float] = []
     for detection in record.get("detections", []):
-        track_id = int(detection["track_id"])
+        track_ids.append(int(detection["track_id"]))
         if "xyxy" in detection:
-            bbox = np.array(detection["xyxy"], dtype=np.float64)
+            xyxy.append(detection["xyxy"])
         else:
             x, y, w, h = detection["bbox"]
-            bbox = np.array([x, y, x + w, y + h], dtype=np.float64)
-        frame_detections.append((track_id, bbox))
-    return frame_detections
+            xyxy.append([x, y, x + w, y + h])
+        conf.append(detection.get("conf", math.nan))
+    return make_frame_detections(track_ids, xyxy, conf)
 
 
 def read_live_detection_segments(src: Path) -> list[dict[str, object]]:
+    from video_track_live_bin import is_live_bin_path, read_live_bin_segments
+
+    if is_live_bin_path(src):
+        return read_live_bin_segments(src)
     segments: dict[str, dict[str, object]] = {}
     order = 0
 
@@ -1418,7 +1872,7 @@ def read_live_detection_segments(src: Path) -> list[dict[str, object]]:
                     "revision": int(record.get("revision", 0)),
                     "order": order,
                     "meta": None,
-                    "frames": {},
+                    "detections": DetectionStoreBuilder(),
                 }
                 order += 1
             if record_type == "meta":
@@ -1428,44 +1882,47 @@ def read_live_detection_segments(src: Path) -> list[dict[str, object]]:
             if record_type != "frame":
                 continue
 
-            frame_index = int(record["n"])
-            frames = segments[segment_id]["frames"]
-            assert isinstance(frames, dict)
-            frames[frame_index] = decode_live_frame_record(record)
+            builder = segments[segment_id]["detections"]
+            assert isinstance(builder, DetectionStoreBuilder)
+            builder.append(int(record["n"]), decode_live_frame_record(record))
 
     if not segments:
         raise ValueError(f"Live JSONL has no meta record: {src}")
     for segment in segments.values():
         if segment["meta"] is None:
             raise ValueError(f"Live JSONL segment has no meta record: {segment['segment_id']}")
-        if not segment["frames"]:
+        builder = segment["detections"]
+        assert isinstance(builder, DetectionStoreBuilder)
+        segment["detections"] = builder.build()
+        if not len(segment["detections"]):
             raise ValueError(f"Live JSONL segment has no frame records: {segment['segment_id']}")
 
     return sorted(segments.values(), key=lambda item: (int(item["revision"]), int(item["order"])))
 
 
-def read_live_detection_data(src: Path) -> tuple[dict[str, object], list[list[tuple[int, np.ndarray]]]]:
+def read_live_detection_data(src: Path) -> tuple[dict[str, object], DetectionStore]:
     segments = read_live_detection_segments(src)
     meta = segments[0]["meta"]
     assert isinstance(meta, dict)
-    frames_by_index: dict[int, list[tuple[int, np.ndarray]]] = {}
+    builder = DetectionStoreBuilder()
     for segment in segments:
-        frames = segment["frames"]
-        assert isinstance(frames, dict)
-        for frame_index, frame_detections in frames.items():
-            frames_by_index[int(frame_index)] = frame_detections
+        segment_store = segment["detections"]
+        assert isinstance(segment_store, DetectionStore)
+        builder.extend(segment_store)
+    store = builder.build()
 
-    if not frames_by_index:
+    if not len(store):
         raise ValueError(f"Live JSONL has no frame records: {src}")
 
-    last_index = max(frames_by_index)
-    detections_by_frame: list[list[tuple[int, np.ndarray]]] = []
-    for index in range(last_index + 1):
-        detections_by_frame.append(frames_by_index.get(index, []))
-    return meta, detections_by_frame
+    return meta, store.reindex(np.arange(int(store.frames[-1]) + 1, dtype=np.int64))
 
 
 def compact_live_detection_data(src: Path) -> None:
+    from video_track_live_bin import compact_live_bin, is_live_bin_path
+
+    if is_live_bin_path(src):
+        compact_live_bin(src)
+        return
     metas_by_segment: dict[str, tuple[int, dict[str, object]]] = {}
     frames_by_index: dict[int, tuple[int, int, dict[str, object]]] = {}
     line_order = 0
@@ -1528,10 +1985,10 @@ def finalize_track_data(
         source_frame_count = int(meta.get("source_frame_count") or 0)
         if source_frame_count > 0:
             total_frame_count = max(total_frame_count, source_frame_count)
-        frames = segment["frames"]
-        assert isinstance(frames, dict)
-        if frames:
-            total_frame_count = max(total_frame_count, max(int(index) for index in frames) + 1)
+        segment_store = segment["detections"]
+        assert isinstance(segment_store, DetectionStore)
+        if len(segment_store):
+            total_frame_count = max(total_frame_count, int(segment_store.frames[-1]) + 1)
     if total_frame_count <= 0:
         raise ValueError("Live JSONL has no usable frame records")
 
@@ -1540,11 +1997,10 @@ def finalize_track_data(
 
     for segment_position, segment in enumerate(segments):
         meta = segment["meta"]
-        frames_by_index = segment["frames"]
+        segment_store = segment["detections"]
         assert isinstance(meta, dict)
-        assert isinstance(frames_by_index, dict)
-        frame_numbers = sorted(int(index) for index in frames_by_index)
-        detections_by_frame = [frames_by_index[index] for index in frame_numbers]
+        assert isinstance(segment_store, DetectionStore)
+        frame_numbers = segment_store.frames.tolist()
         if segment_position == 0 and init_crop is not None:
             segment_init_crop = init_crop
             segment_init_bbox = crop_to_xywh(segment_init_crop)
@@ -1564,13 +2020,10 @@ def finalize_track_data(
         else:
             segment_init_frame = int(meta.get("init_frame", frame_numbers[0]))
             segment_init_time = float(meta.get("init_time", segment_init_frame / fps))
-        local_init_frame = min(
-            range(len(frame_numbers)),
-            key=lambda index: abs(frame_numbers[index] - segment_init_frame),
-        )
+        local_init_frame = int(np.argmin(np.abs(segment_store.frames - segment_init_frame)))
 
         raw_bboxes, target_id, selected_local_frame, selected_iou = select_target_bboxes_by_iou(
-            detections_by_frame,
+            segment_store,
             local_init_frame,
             segment_init_bbox,
             fps,
@@ -1726,7 +2179,22 @@ def mux_audio(
 
 
 def main() -> int:
+    from video_track_adaptive import DEFAULT_ADAPTIVE_MIN_IOU
+    from video_track_bench import (
+        SUITE_STAGES,
+        SYNTHETIC_GENERATORS,
+        bench_compare,
+        bench_segment,
+        bench_suite,
+        parse_positive_ints,
+        parse_suite_stages,
+        parse_video_sizes,
+    )
     from video_track_draw_box import draw_box, parse_color
+    from video_track_frame_cache import DEFAULT_FRAME_CACHE_DIR, DEFAULT_FRAME_CACHE_MAX_GB
+    from video_track_live_bin import convert_live
+    from video_track_output import OUTPUT_ENCODERS, parse_output_encoders
+    from video_track_shards import DEFAULT_SHARD_OVERLAP
     from video_track_stabilize import DEFAULT_SMOOTH_SECONDS, stabilize
 
     parser = argparse.ArgumentParser(formatter_class=ArgumentDefaultsRawTextHelpFormatter, epilog=epilog)
@@ -1756,6 +2224,33 @@ def main() -> int:
             help="Maximum height in pixels for detect preview MKV videos. Use 0 to keep original size",
         )
 
+    def add_frame_cache_options(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument(
+            "--frame-cache",
+            action="store_true",
+            help="Read frames through a decoded-frame cache shared by detect, draw_box and stabilize passes",
+        )
+        subparser.add_argument("--frame-cache-dir", type=Path, default=DEFAULT_FRAME_CACHE_DIR)
+        subparser.add_argument(
+            "--frame-cache-max-gb",
+            type=float,
+            default=DEFAULT_FRAME_CACHE_MAX_GB,
+            help="Size limit of the frame cache directory; least recently used videos are evicted",
+        )
+
+    def add_output_options(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument(
+            "--encoders",
+            type=parse_output_encoders,
+            default=",".join(OUTPUT_ENCODERS),
+            help="Comma-separated outputs to encode while rendering: mp4v (OpenCV, no audio), h264 (ffmpeg libx264, with audio)",
+        )
+        subparser.add_argument(
+            "--mp4v-from-h264",
+            action="store_true",
+            help="Encode only h264 while rendering and transcode the mp4v output from it afterwards",
+        )
+
     subparser = subparsers.add_parser("list_class_names", formatter_class=ArgumentDefaultsRawTextHelpFormatter)
     subparser.set_defaults(func=list_class_names)
     subparser.add_argument("--model", default="yolo26n.pt")
@@ -1796,6 +2291,42 @@ def main() -> int:
         help="Detect every Nth frame and interpolate the rest later",
     )
     subparser.add_argument("--segment-id", help="Override JSONL segment id")
+    subparser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the frames into N chunks detected by N worker processes; track IDs are stitched across chunks",
+    )
+    subparser.add_argument(
+        "--shard-overlap",
+        type=int,
+        default=DEFAULT_SHARD_OVERLAP,
+        help="Frames each shard re-detects from the end of the previous one to warm up its tracker and stitch track IDs",
+    )
+    subparser.add_argument(
+        "--shard-threads",
+        type=int,
+        default=0,
+        help="torch/OpenCV threads per shard process. Use 0 for CPU count / shards",
+    )
+    add_frame_cache_options(subparser)
+    subparser.add_argument(
+        "--proxy-scale",
+        type=float,
+        default=1.0,
+        help="Detect on frames downscaled by this factor (also the scale of --frame-cache frames); detections are scaled back to source coordinates",
+    )
+    subparser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Detect every --stride frames, then every frame where consecutive samples of the target disagree",
+    )
+    subparser.add_argument(
+        "--adaptive-min-iou",
+        type=float,
+        default=DEFAULT_ADAPTIVE_MIN_IOU,
+        help="With --adaptive, consecutive target boxes overlapping less than this (or a lost target) are refined",
+    )
     add_detect_args(subparser)
     add_detect_options(subparser)
 
@@ -1814,6 +2345,8 @@ def main() -> int:
     )
     subparser.add_argument("--preview_gui", action="store_true", help="Show an OpenCV preview window while processing")
     subparser.add_argument("-n", "--dry_run", action="store_true")
+    add_frame_cache_options(subparser)
+    add_output_options(subparser)
 
     subparser = subparsers.add_parser("draw_box", formatter_class=ArgumentDefaultsRawTextHelpFormatter)
     subparser.set_defaults(func=draw_box)
@@ -1854,6 +2387,8 @@ def main() -> int:
     subparser.add_argument("--stabilize-crop-color", type=parse_color, default=(0, 0, 255), metavar="R:G:B")
     subparser.add_argument("--preview_gui", action="store_true", help="Show an OpenCV preview window while processing")
     subparser.add_argument("-n", "--dry_run", action="store_true")
+    add_frame_cache_options(subparser)
+    add_output_options(subparser)
 
     subparser = subparsers.add_parser("finalize", formatter_class=ArgumentDefaultsRawTextHelpFormatter)
     subparser.set_defaults(func=finalize)
@@ -1873,6 +2408,36 @@ def main() -> int:
         help="Do not rewrite live_json with duplicate frame records removed after finalize",
     )
 
+    subparser = subparsers.add_parser("bench_segment", formatter_class=ArgumentDefaultsRawTextHelpFormatter)
+    subparser.set_defaults(func=bench_segment)
+    subparser.add_argument("input")
+    subparser.add_argument("--start", type=video_time.parse_time_or_frame, help="Start frame/time, e.g. frame:10, f:10, 0:01.700")
+    subparser.add_argument("--end", type=video_time.parse_time_or_frame, help="End frame/time, e.g. frame:20, f:20, 0:02.400, last")
+    subparser.add_argument("--duration", type=parse_detect_duration, help="Duration as time or frame:N/f:N")
+
+    subparser = subparsers.add_parser("bench_suite", formatter_class=ArgumentDefaultsRawTextHelpFormatter)
+    subparser.set_defaults(func=bench_suite)
+    subparser.add_argument("--sizes", type=parse_video_sizes, default="640x360,1280x720", help="Synthetic video sizes, WxH,...")
+    subparser.add_argument("--frames", type=parse_positive_ints, default="300", help="Synthetic video lengths in frames, N,...")
+    subparser.add_argument("--gops", type=parse_positive_ints, default="30", help="Synthetic video GOP sizes in frames, N,...")
+    subparser.add_argument("--generator", choices=SYNTHETIC_GENERATORS, default="ffmpeg",
+                           help="Encode synthetic videos with ffmpeg libx264 (honours --gops) or OpenCV mp4v")
+    subparser.add_argument("--video-dir", help="Keep synthetic videos here and reuse them on later runs (default: a temporary directory)")
+    subparser.add_argument("--stages", type=parse_suite_stages, default=",".join(SUITE_STAGES), help="Stages to measure")
+    subparser.add_argument("--repeat", type=int, default=3, help="Runs per stage; seconds is the fastest")
+    subparser.add_argument("--encoders", type=parse_output_encoders, default="mp4v", help="Encoders for draw_box and stabilize")
+
+    subparser = subparsers.add_parser("bench_compare", formatter_class=ArgumentDefaultsRawTextHelpFormatter)
+    subparser.set_defaults(func=bench_compare)
+    subparser.add_argument("baseline", help="JSON lines from bench_suite or bench_segment")
+    subparser.add_argument("current", help="JSON lines from the same benchmark on the tree to compare")
+    subparser.add_argument("--threshold", type=float, default=0.1, help="Slowdown ratio above 1 reported as a regression")
+
+    subparser = subparsers.add_parser("convert_live", formatter_class=ArgumentDefaultsRawTextHelpFormatter)
+    subparser.set_defaults(func=convert_live)
+    subparser.add_argument("input", help="Live detections, JSONL or .bin")
+    subparser.add_argument("output", help="Live detections in the other format")
+
     args = parser.parse_args()
     logger.setLevel({0: logging.DEBUG, 1: logging.INFO, 2: logging.WARNING}.get(args.quiet, logging.ERROR))
     logger.debug(f"{args=}")
@@ -1951,6 +2516,26 @@ def detect(args: argparse.Namespace) -> int:
         raise SystemExit("--segment-id is only valid with --start/--end/--duration")
     if args.stride <= 0:
         raise SystemExit("--stride must be positive")
+    if args.shards <= 0:
+        raise SystemExit("--shards must be positive")
+    if args.shard_overlap < 0:
+        raise SystemExit("--shard-overlap must be non-negative")
+    if args.shards > 1 and args.preview_gui:
+        raise SystemExit("--preview_gui is not supported with --shards")
+    if not 0 < args.proxy_scale <= 1:
+        raise SystemExit("--proxy-scale must be in (0, 1]")
+    if args.adaptive:
+        if args.stride <= 1:
+            raise SystemExit("--adaptive needs --stride > 1, the sparse sampling stride")
+        if args.shards > 1:
+            raise SystemExit("--adaptive is not supported with --shards")
+        if args.preview_gui:
+            raise SystemExit("--preview_gui is not supported with --adaptive")
+        if not 0 < args.adaptive_min_iou <= 1:
+            raise SystemExit("--adaptive-min-iou must be in (0, 1]")
+    from video_track_frame_cache import frame_cache_options
+
+    frame_cache = frame_cache_options(args)
 
     load_video_modules()
     from ultralytics import YOLO
@@ -1969,11 +2554,18 @@ def detect(args: argparse.Namespace) -> int:
             "class_name": args.class_name,
             "class_id": class_id,
             "stride": args.stride,
+            **detect_proxy_meta(args),
         }
         frame_indices = None
-        if args.stride > 1:
+        if args.stride > 1 or args.shards > 1:
             info = load_video_info(src)
             frame_indices = sample_frame_indices(0, max(0, info.frame_count - 1), args.stride)
+        if args.shards > 1:
+            detect_sharded(args, src, live_json, class_id, info, frame_indices, live_meta_extra, frame_cache=frame_cache)
+            return 0
+        if args.adaptive:
+            detect_adaptively(args, src, live_json, detector, class_id, info, frame_indices, live_meta_extra, frame_cache=frame_cache)
+            return 0
         write_live_detection_data(
             src,
             detector,
@@ -1985,6 +2577,8 @@ def detect(args: argparse.Namespace) -> int:
             live_json,
             live_meta_extra,
             frame_indices=frame_indices,
+            frame_cache=frame_cache,
+            proxy_scale=args.proxy_scale,
         )
         return 0
 
@@ -2017,11 +2611,45 @@ def detect(args: argparse.Namespace) -> int:
         "class_name": args.class_name,
         "class_id": class_id,
         "stride": args.stride,
+        **detect_proxy_meta(args),
         "range": {
             "start_frame": start_frame,
             "end_frame": end_frame,
         },
     }
+    if args.shards > 1:
+        detect_sharded(
+            args,
+            src,
+            live_json,
+            class_id,
+            info,
+            frame_indices,
+            live_meta_extra,
+            append=True,
+            segment_id=segment_id,
+            revision=revision,
+            direction=direction,
+            frame_cache=frame_cache,
+        )
+        return 0
+    if args.adaptive:
+        detect_adaptively(
+            args,
+            src,
+            live_json,
+            detector,
+            class_id,
+            info,
+            frame_indices,
+            live_meta_extra,
+            append=True,
+            segment_id=segment_id,
+            revision=revision,
+            direction=direction,
+            frame_cache=frame_cache,
+        )
+        return 0
     write_live_detection_data(
         src,
         detector,
@@ -2037,10 +2665,110 @@ def detect(args: argparse.Namespace) -> int:
         revision=revision,
         frame_indices=frame_indices,
         direction=direction,
+        frame_cache=frame_cache,
+        proxy_scale=args.proxy_scale,
     )
     return 0
 
 
+def detect_proxy_meta(args: argparse.Namespace) -> dict[str, object]:
+    meta: dict[str, object] = {}
+    if args.proxy_scale != 1:
+        meta["proxy_scale"] = args.proxy_scale
+    if args.adaptive:
+        meta["adaptive"] = {"min_iou": args.adaptive_min_iou}
+    return meta
+
+
+def detect_adaptively(
+    args: argparse.Namespace,
+    src: Path,
+    live_json: Path,
+    detector: YOLO,
+    class_id: int | None,
+    info: VideoInfo,
+    frame_indices: list[int],
+    live_meta_extra: dict[str, object],
+    *,
+    append: bool = False,
+    segment_id: str = "base",
+    revision: int = 0,
+    direction: str = "forward",
+    frame_cache: FrameCacheOptions | None = None,
+) -> None:
+    from video_track_adaptive import detect_adaptive
+
+    logger.info("detect --adaptive: preview videos are not written")
+    live_meta = live_segment_meta(
+        src,
+        info,
+        args.init_bbox,
+        args.init_time,
+        live_meta_extra,
+        segment_id=segment_id,
+        revision=revision,
+        frame_indices=frame_indices,
+        direction=direction,
+    )
+    detect_adaptive(
+        src,
+        live_json,
+        detector,
+        class_id,
+        frame_indices,
+        live_meta,
+        args.adaptive_min_iou,
+        append=append,
+        frame_cache=frame_cache,
+        proxy_scale=args.proxy_scale,
+    )
+
+
+def detect_sharded(
+    args: argparse.Namespace,
+    src: Path,
+    live_json: Path,
+    class_id: int | None,
+    info: VideoInfo,
+    frame_indices: list[int],
+    live_meta_extra: dict[str, object],
+    *,
+    append: bool = False,
+    segment_id: str = "base",
+    revision: int = 0,
+    direction: str = "forward",
+    frame_cache: FrameCacheOptions | None = None,
+) -> None:
+    from video_track_shards import detect_shards
+
+    logger.info("detect --shards: preview videos are not written")
+    live_meta = live_segment_meta(
+        src,
+        info,
+        args.init_bbox,
+        args.init_time,
+        live_meta_extra,
+        segment_id=segment_id,
+        revision=revision,
+        frame_indices=frame_indices,
+        direction=direction,
+    )
+    detect_shards(
+        src,
+        live_json,
+        args.model,
+        class_id,
+        frame_indices,
+        args.shards,
+        args.shard_overlap,
+        args.shard_threads,
+        live_meta,
+        append=append,
+        frame_cache=frame_cache,
+        proxy_scale=args.proxy_scale,
+    )
+
+
 def finalize(args: argparse.Namespace) -> int:
     load_video_modules()
 
@@ -2054,5 +2782,139 @@ def finalize(args: argparse.Namespace) -> int:
     return 0
 
 
+# ---------------------------------------------------------------------------
+# tests (pytest)
+# ---------------------------------------------------------------------------
+
+
+def _reference_bbox_iou(a: np.ndarray, b: np.ndarray) -> float:
+    ix0 = max(a[0], b[0])
+    iy0 = max(a[1], b[1])
+    ix1 = min(a[2], b[2])
+    iy1 = min(a[3], b[3])
+    iw = max(0.0, ix1 - ix0)
+    ih = max(0.0, iy1 - iy0)
+    inter = iw * ih
+    area_a = max(0.0, a[2] - a[0]) * max(0.0, a[3] - a[1])
+    area_b = max(0.0, b[2] - b[0]) * max(0.0, b[3] - b[1])
+    denom = area_a + area_b - inter
+    return 0.0 if denom <= 0 else inter / denom
+
+
+def _reference_select_target_bboxes_by_iou(
+    store: DetectionStore,
+    init_frame: int,
+    init_bbox: tuple[float, float, float, float],
+    fps: float,
+) -> tuple[np.ndarray, int, int, float]:
+    """The frame-by-frame scan select_target_track and select_target_bboxes_by_iou replaced, kept as their oracle."""
+    init_xyxy = xywh_to_xyxy(init_bbox)
+    max_offset = max(1, round(fps * 2))
+    best: tuple[float, int, int] | None = None
+    for offset in range(max_offset + 1):
+        candidate_frames = [init_frame] if offset == 0 else [init_frame - offset, init_frame + offset]
+        for frame_index in candidate_frames:
+            if frame_index < 0 or frame_index >= len(store):
+                continue
+            frame_detections = store.frame(frame_index)
+            for track_id, bbox in zip(frame_detections.track_ids.tolist(), frame_detections.xyxy):
+                score = _reference_bbox_iou(init_xyxy, bbox) - offset * 0.001
+                if best is None or score > best[0]:
+                    best = (score, track_id, frame_index)
+    if best is None or best[0] <= 0:
+        raise RuntimeError("No YOLO track overlapped --init-bbox near --init-time")
+    score, target_id, selected_frame = best
+
+    selected_detections = store.frame(selected_frame)
+    selected_bbox = selected_detections.xyxy[np.flatnonzero(selected_detections.track_ids == target_id)[0]]
+    raw_bboxes = np.full((len(store), 4), np.nan, dtype=np.float64)
+    raw_bboxes[selected_frame] = selected_bbox
+    for step in (-1, 1):
+        previous_bbox = selected_bbox
+        frame_index = selected_frame + step
+        while 0 <= frame_index < len(store):
+            same_track_bbox: np.ndarray | None = None
+            best_bbox: np.ndarray | None = None
+            best_iou = 0.0
+            frame_detections = store.frame(frame_index)
+            for track_id, bbox in zip(frame_detections.track_ids.tolist(), frame_detections.xyxy):
+                if track_id == target_id:
+                    same_track_bbox = bbox
+                    break
+                iou = _reference_bbox_iou(previous_bbox, bbox)
+                if best_bbox is None or iou > best_iou:
+                    best_bbox = bbox
+                    best_iou = iou
+            if same_track_bbox is not None:
+                raw_bboxes[frame_index] = same_track_bbox
+                previous_bbox = same_track_bbox
+            elif best_bbox is not None and best_iou >= 0.20:
+                raw_bboxes[frame_index] = best_bbox
+                previous_bbox = best_bbox
+            frame_index += step
+    return raw_bboxes, target_id, selected_frame, max(0.0, score)
+
+
+def _random_store(rng: object, frame_count: int, mirrored: bool = False) -> DetectionStore:
+    """Few small integer boxes and track IDs, so identical boxes (IoU ties), repeated IDs and empty frames are common.
+
+    mirrored repeats the frames in reverse after the last one, so frames at the same distance before and after it tie.
+    """
+    detections = []
+    for _ in range(frame_count):
+        count = int(rng.integers(0, 4))
+        x0y0 = rng.integers(0, 4, size=(count, 2))
+        wh = rng.integers(2, 4, size=(count, 2))
+        detections.append(make_frame_detections(rng.integers(1, 5, size=count), np.hstack([x0y0, x0y0 + wh])))
+    if mirrored:
+        detections += detections[-2::-1]
+    builder = DetectionStoreBuilder()
+    frame_number = 0
+    for frame_detections in detections:
+        frame_number += int(rng.integers(1, 3))  # source frame numbers with gaps
+        builder.append(frame_number, frame_detections)
+    return builder.build()
+
+
+def test_select_target_matches_reference_scan():
+    load_video_modules()
+    rng = np.random.default_rng(0)
+    checked = 0
+    for case in range(400):
+        if case % 4 == 3:
+            store = _random_store(rng, int(rng.integers(2, 8)), mirrored=True)
+            init_frame = len(store) // 2
+        else:
+            store = _random_store(rng, int(rng.integers(1, 16)))
+            init_frame = (0, len(store) - 1, int(rng.integers(0, len(store))))[case % 4]
+        x, y = rng.integers(0, 4, size=2)
+        w, h = rng.integers(2, 4, size=2)
+        init_bbox = (float(x), float(y), float(w), float(h))
+        fps = float(rng.choice([0.5, 1.0, 2.0]))
+        try:
+            expected = _reference_select_target_bboxes_by_iou(store, init_frame, init_bbox, fps)
+        except RuntimeError as e:
+            try:
+                select_target_bboxes_by_iou(store, init_frame, init_bbox, fps)
+            except RuntimeError as e2:
+                assert str(e2) == str(e)
+            else:
+                raise AssertionError(f"case {case}: expected RuntimeError")
+            continue
+        raw_bboxes, target_id, selected_frame, selected_iou = select_target_bboxes_by_iou(store, init_frame, init_bbox, fps)
+        assert (target_id, selected_frame, selected_iou) == expected[1:], case
+        np.testing.assert_array_equal(raw_bboxes, expected[0], err_msg=f"case {case}")
+        checked += 1
+    assert checked > 200
+
+    store = _random_store(rng, 5)
+    for box in store.xyxy:
+        assert bbox_iou(box, box) == 1.0
+    np.testing.assert_array_equal(
+        bbox_iou_matrix(store.xyxy, store.xyxy),
+        [[_reference_bbox_iou(a, b) for b in store.xyxy] for a in store.xyxy],
+    )
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import bisect
+import itertools
+import time
+from pathlib import Path
+
+import numpy as np
+
+import video_track as vt
+from video_track_frame_cache import FrameCacheOptions
+from video_track_shards import remap_track_ids, stitch_track_ids
+
+DEFAULT_ADAPTIVE_MIN_IOU = 0.6
+
+
+def pairwise_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of a[i] and b[i] for xyxy boxes a and b (N x 4 each); NaN boxes give NaN."""
+    iw = np.maximum(0.0, np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]))
+    ih = np.maximum(0.0, np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]))
+    inter = iw * ih
+    area_a = np.maximum(0.0, a[:, 2] - a[:, 0]) * np.maximum(0.0, a[:, 3] - a[:, 1])
+    area_b = np.maximum(0.0, b[:, 2] - b[:, 0]) * np.maximum(0.0, b[:, 3] - b[:, 1])
+    denom = area_a + area_b - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denom > 0, inter / denom, np.where(np.isnan(denom), np.nan, 0.0))
+
+
+def disagreeing_intervals(target_bboxes: np.ndarray, min_iou: float) -> np.ndarray:
+    """Sample positions i where samples i and i + 1 disagree: the target is missing in either, or its boxes overlap
+    by less than min_iou."""
+    ious = pairwise_iou(target_bboxes[:-1], target_bboxes[1:])
+    return np.flatnonzero(~(ious >= min_iou))
+
+
+def refine_runs(sample_frames: list[int], intervals: np.ndarray) -> list[list[int]]:
+    """Every frame of each run of consecutive disagreeing intervals, both end samples included, in sample order."""
+    runs: list[list[int]] = []
+    run_start: int | None = None
+    for position, interval in enumerate(intervals.tolist()):
+        if run_start is None:
+            run_start = interval
+        if position + 1 < len(intervals) and intervals[position + 1] == interval + 1:
+            continue
+        first, last = sample_frames[run_start], sample_frames[interval + 1]
+        step = 1 if last >= first else -1
+        runs.append(list(range(first, last + step, step)))
+        run_start = None
+    return runs
+
+
+def follow_target(
+    store: vt.DetectionStore,
+    init_frame: int,
+    init_bbox: tuple[float, float, float, float],
+    fps: float,
+) -> np.ndarray | None:
+    """The target boxes per sample as finalize would select them, or None when no track overlaps init_bbox."""
+    local_init_frame = int(np.argmin(np.abs(store.frames - init_frame)))
+    try:
+        target_bboxes, _target_id, _selected_frame, _selected_iou = vt.select_target_bboxes_by_iou(
+            store,
+            local_init_frame,
+            init_bbox,
+            fps,
+        )
+    except RuntimeError as exc:
+        vt.logger.warning("detect adaptive: %s; refining every interval", exc)
+        return None
+    return target_bboxes
+
+
+def detect_adaptive(
+    src: Path,
+    live_json: Path,
+    detector: vt.YOLO,
+    class_id: int | None,
+    sample_frames: list[int],
+    live_meta: dict[str, object],
+    min_iou: float,
+    *,
+    append: bool,
+    frame_cache: FrameCacheOptions | None = None,
+    proxy_scale: float = 1.0,
+) -> None:
+    """Detect sample_frames, then densely re-detect the stretches between samples where the target disagrees.
+
+    The sparse pass follows the target the way finalize does. Runs of disagreeing sample intervals are detected again
+    frame by frame (end samples included, so their track IDs can be stitched to the sparse pass), and the new frames
+    are written after the sparse ones under the same segment, for finalize to interpolate between.
+    """
+    started_at = time.monotonic()
+    segment_id = str(live_meta["segment_id"])
+    revision = int(live_meta["revision"])
+    init_bbox = tuple(float(value) for value in live_meta["init_bbox"])
+    fps = float(live_meta["fps"])
+    sparse_builder = vt.DetectionStoreBuilder()
+
+    with vt.open_live_writer(live_json, append) as writer:
+        writer.write_meta(live_meta)
+
+        def consume_sparse(item: vt.DetectedFrame) -> None:
+            sparse_builder.append(item.original_index, item.detections)
+            writer.write_frame(item.original_index, item.detections, segment_id, revision, item.index)
+
+        sparse_calls = vt.run_detect_pipeline(
+            src,
+            detector,
+            class_id,
+            sample_frames,
+            consume_sparse,
+            desc=f"detect {segment_id} sparse",
+            total=len(sample_frames),
+            frame_cache=frame_cache,
+            proxy_scale=proxy_scale,
+            need_frame=False,
+        )
+        sample_frames = sample_frames[:sparse_calls]
+        sparse = sparse_builder.build()
+        target_bboxes = follow_target(sparse, int(live_meta["init_frame"]), init_bbox, fps)
+        if target_bboxes is None:
+            intervals = np.arange(max(0, len(sample_frames) - 1))
+        else:
+            # The store is in frame order; put the target boxes back in sample order.
+            target_bboxes = target_bboxes[np.searchsorted(sparse.frames, sample_frames)]
+            intervals = disagreeing_intervals(target_bboxes, min_iou)
+        runs = refine_runs(sample_frames, intervals)
+        refine_frames = [frame for run in runs for frame in run]
+
+        refine_calls = 0
+        written = 0
+        if refine_frames:
+            # Each run is tracked from a reset tracker and stitched to the sparse pass on its own end samples: the
+            # tracker must not carry a track across the jump between runs (or from the last sparse frame).
+            run_starts = [0, *itertools.accumulate(len(run) for run in runs)][:-1]
+            run_builders = [vt.DetectionStoreBuilder() for _ in runs]
+
+            def consume_refine(item: vt.DetectedFrame) -> None:
+                run_builders[bisect.bisect_right(run_starts, item.index) - 1].append(item.original_index, item.detections)
+
+            refine_calls = vt.run_detect_pipeline(
+                src,
+                detector,
+                class_id,
+                refine_frames,
+                consume_refine,
+                desc=f"detect {segment_id} refine",
+                total=len(refine_frames),
+                frame_cache=frame_cache,
+                proxy_scale=proxy_scale,
+                need_frame=False,
+                tracker_resets=set(run_starts),
+            )
+            sampled = set(sample_frames)
+            next_id = int(sparse.track_ids.max(initial=-1)) + 1
+            for run, run_start, run_builder in zip(runs, run_starts, run_builders):
+                run_frames = run[: max(0, refine_calls - run_start)]
+                if not run_frames:
+                    break
+                refined = run_builder.build()
+                overlap_frames = [frame for frame in refined.frames.tolist() if frame in sampled]
+                mapping = stitch_track_ids(sparse, refined, overlap_frames)
+                refined, next_id = remap_track_ids(refined, mapping, next_id)
+                positions = np.searchsorted(refined.frames, run_frames)
+                for frame_index, position in zip(run_frames, positions.tolist()):
+                    if frame_index in sampled:
+                        continue
+                    writer.write_frame(frame_index, refined.frame(position), segment_id, revision, len(sample_frames) + written)
+                    written += 1
+
+    dense_frames = abs(sample_frames[-1] - sample_frames[0]) + 1 if sample_frames else 0
+    calls = sparse_calls + refine_calls
+    vt.logger.info(
+        "detect adaptive: %s inference calls (%s sparse + %s refine in %s runs, %s/%s intervals disagreed) vs %s for "
+        "every frame: %.1fx fewer; %s frames written in %.1fs",
+        calls,
+        sparse_calls,
+        refine_calls,
+        len(runs),
+        len(intervals),
+        max(0, len(sample_frames) - 1),
+        dense_frames,
+        dense_frames / max(1, calls),
+        sparse_calls + written,
+        time.monotonic() - started_at,
+    )
+
+
+# ---------------------------------------------------------------------------
+# tests (pytest)
+# ---------------------------------------------------------------------------
+
+
+def _scene_boxes(frame: int) -> dict[str, list[float]]:
+    """The target moves right by 1 px per frame, jumps at frames 25 and 75 and is gone in frames 50-54; a still
+    distractor; a newcomer only in frames 42-48 and 72-78 (between samples)."""
+    boxes = {"distractor": [1000.0, 0.0, 1100.0, 100.0]}
+    if not 50 <= frame <= 54:
+        x = frame + 100 * ((frame >= 25) + (frame >= 75))
+        boxes["target"] = [float(x), 0.0, x + 100.0, 100.0]
+    if 42 <= frame <= 48 or 72 <= frame <= 78:
+        boxes["newcomer"] = [0.0, 300.0, 100.0, 400.0]
+    return boxes
+
+
+def _scene_pipeline(calls: list[tuple[list[int], list[int]]]) -> object:
+    """Stand-in for vt.run_detect_pipeline: a tracker whose IDs start over (from 100 * resets) after every reset."""
+    resets = 0
+
+    def run_detect_pipeline(src, detector, class_id, frame_indices, consume, *, tracker_resets=(), **kwargs):
+        nonlocal resets
+        calls.append((list(frame_indices), sorted(tracker_resets)))
+        for index, frame in enumerate(frame_indices):
+            resets += index in tracker_resets
+            boxes = _scene_boxes(frame)
+            track_ids = [100 * resets + ("target", "distractor", "newcomer").index(name) + 1 for name in boxes]
+            consume(vt.DetectedFrame(index, frame, None, vt.make_frame_detections(track_ids, list(boxes.values()))))
+        return len(frame_indices)
+
+    return run_detect_pipeline
+
+
+def test_disagreeing_intervals():
+    vt.load_video_modules()
+    nan = [np.nan] * 4
+    boxes = np.array([[0, 0, 10, 10], [1, 0, 11, 10], [50, 0, 60, 10], nan, [50, 0, 60, 10], [51, 0, 61, 10]], dtype=np.float64)
+    assert disagreeing_intervals(boxes, 0.6).tolist() == [1, 2, 3]
+    assert disagreeing_intervals(boxes, 0.9).tolist() == [0, 1, 2, 3, 4]
+    assert disagreeing_intervals(boxes[:1], 0.6).tolist() == []
+
+
+def test_refine_runs():
+    samples = [0, 10, 20, 30, 40]
+    assert refine_runs(samples, np.array([], dtype=np.int64)) == []
+    # adjacent intervals merge into one run; a run may end at the last sample
+    assert refine_runs(samples, np.array([0, 1, 3])) == [list(range(0, 21)), list(range(30, 41))]
+    # backward detection: runs go in sample order
+    assert refine_runs(samples[::-1], np.array([0, 2, 3])) == [list(range(40, 29, -1)), list(range(20, -1, -1))]
+
+
+def test_detect_adaptive_refines_and_stitches_each_run(tmp_path, monkeypatch):
+    vt.load_video_modules()
+    for sample_frames in (list(range(0, 81, 10)), list(range(80, -1, -10))):
+        calls: list[tuple[list[int], list[int]]] = []
+        monkeypatch.setattr(vt, "run_detect_pipeline", _scene_pipeline(calls))
+        live_json = tmp_path / "live.jsonl"
+        init_bbox = [0.0, 0.0, 100.0, 100.0]
+        live_meta = {"schema": "video_track.live.v1", "type": "meta", "segment_id": "base", "revision": 0,
+                     "init_bbox": init_bbox, "fps": 30.0, "init_frame": 0}
+        detect_adaptive(Path("scene.mp4"), live_json, None, None, sample_frames, live_meta, DEFAULT_ADAPTIVE_MIN_IOU, append=False)
+
+        # sample intervals 20-30, 40-50 + 50-60 (merged) and 70-80 (the last sample) disagree; each run gets a tracker reset
+        runs = [range(20, 31), range(40, 61), range(70, 81)]
+        if sample_frames[0] > sample_frames[-1]:
+            runs = [run[::-1] for run in runs[::-1]]
+        (sparse_frames, sparse_resets), (refine_frames, refine_resets) = calls
+        assert sparse_frames == sample_frames and sparse_resets == []
+        assert refine_frames == [frame for run in runs for frame in run]
+        assert refine_resets == [0, len(runs[0]), len(runs[0]) + len(runs[1])]
+
+        [segment] = vt.read_live_detection_segments(live_json)
+        store = segment["detections"]
+        assert store.frames.tolist() == sorted(set(sample_frames) | set(refine_frames))
+        newcomer_ids = set()
+        for position, frame in enumerate(store.frames.tolist()):
+            detections = store.frame(position)
+            ids = dict(zip(map(tuple, detections.xyxy.tolist()), detections.track_ids.tolist()))
+            boxes = _scene_boxes(frame)
+            # the refined tracks carry the sparse IDs over; the newcomer gets a fresh ID above them in each run
+            assert ids[tuple(boxes["distractor"])] == 2
+            if "target" in boxes:
+                assert ids[tuple(boxes["target"])] == 1
+            if "newcomer" in boxes:
+                newcomer_ids.add((frame > 60, ids[tuple(boxes["newcomer"])]))
+        assert sorted(newcomer_ids) == sorted([(False, 3), (True, 4)] if sample_frames[0] == 0 else [(True, 3), (False, 4)])
+
+        # finalize follows the same target as on every frame: exact at the detected frames, exact when interpolated
+        target_bboxes = follow_target(store, 0, tuple(init_bbox), 30.0)
+        frames = np.arange(81)
+        expected = np.array([_scene_boxes(frame).get("target", [np.nan] * 4) for frame in frames.tolist()])
+        np.testing.assert_array_equal(target_bboxes, expected[store.frames])
+        present = ~np.isnan(target_bboxes[:, 0])
+        visible = ~np.isnan(expected[:, 0])
+        interpolated = np.interp(frames[visible], store.frames[present], target_bboxes[present, 0])
+        np.testing.assert_array_equal(interpolated, expected[visible, 0])
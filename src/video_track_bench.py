@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+
+import video_track as vt
+
+# Bump when synthetic_frame() or synthetic_boxes() change, so videos kept in --video-dir are generated again.
+SYNTHETIC_VIDEO_VERSION = 1
+SYNTHETIC_VIDEO_FPS = 30.0
+SYNTHETIC_BOX_COUNT = 3
+SYNTHETIC_GENERATORS = ("ffmpeg", "opencv")
+SUITE_STAGES = (
+    "load_video_info",
+    "ffprobe_frame_count",
+    "decode",
+    "detect",
+    "live_write",
+    "live_read",
+    "live_compact",
+    "finalize",
+    "draw_box",
+    "stabilize",
+)
+# Record fields identifying a measurement; bench_compare matches baseline and current records on them.
+COMPARE_KEYS = ("bench", "impl", "direction", "stage", "video")
+
+
+def emit(record: dict[str, object]) -> None:
+    print(json.dumps(record, separators=(",", ":")), flush=True)
+
+
+def decoded_sha1(path: Path) -> str:
+    """SHA-1 over the decoded frames of path (container bytes differ between otherwise identical writes)."""
+    digest = hashlib.sha1()
+    cap = vt.cv2.VideoCapture(str(path))
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            digest.update(frame.tobytes())
+    finally:
+        cap.release()
+    return digest.hexdigest()
+
+
+def write_segment_video_seek(src: Path, dst: Path, start_frame: int, end_frame: int) -> list[int]:
+    """Reference for bench_segment: seek before every frame, as write_segment_video did before."""
+    cap = vt.cv2.VideoCapture(str(src))
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open {src}")
+    fps = cap.get(vt.cv2.CAP_PROP_FPS)
+    src_w = int(cap.get(vt.cv2.CAP_PROP_FRAME_WIDTH))
+    src_h = int(cap.get(vt.cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = vt.cv2.VideoWriter(str(dst), vt.cv2.VideoWriter_fourcc(*"mp4v"), fps, (src_w, src_h))
+    step = 1 if end_frame >= start_frame else -1
+    written_frame_map: list[int] = []
+    try:
+        for frame_index in range(start_frame, end_frame + step, step):
+            cap.set(vt.cv2.CAP_PROP_POS_FRAMES, frame_index)
+            ok, frame = cap.read()
+            if not ok:
+                break
+            writer.write(frame)
+            written_frame_map.append(frame_index)
+    finally:
+        writer.release()
+        cap.release()
+    return written_frame_map
+
+
+def bench_segment(args: argparse.Namespace) -> int:
+    vt.load_video_modules()
+
+    src = Path(args.input)
+    info = vt.load_video_info(src)
+    start_frame, end_frame = vt.resolve_time_frame_range(
+        start=args.start,
+        end=args.end,
+        duration=args.duration,
+        fps=info.fps,
+        frame_count=info.frame_count,
+        command_name="bench_segment",
+    )
+    with tempfile.TemporaryDirectory(prefix="video_track_bench.") as tmp:
+        tmp_dir = Path(tmp)
+        for direction, first, last in (("forward", start_frame, end_frame), ("reverse", end_frame, start_frame)):
+            runs: list[tuple[str, t.Callable[[Path], list[int]]]] = [
+                ("seek", lambda dst: write_segment_video_seek(src, dst, first, last)),
+                ("sequential", lambda dst: vt.write_segment_video(src, dst, first, last)[0]),
+            ]
+            if direction == "reverse":
+                runs.append(("sequential_spill", lambda dst: vt.write_segment_video(src, dst, first, last, spill_dir=tmp_dir)[0]))
+            reference: tuple[list[int], str] | None = None
+            for impl, run in runs:
+                dst = tmp_dir / f"{direction}.{impl}.mkv"
+                started_at = time.monotonic()
+                frame_map = run(dst)
+                seconds = time.monotonic() - started_at
+                digest = decoded_sha1(dst)
+                if reference is None:
+                    reference = (frame_map, digest)
+                emit(
+                    {
+                        "bench": "segment",
+                        "impl": impl,
+                        "direction": direction,
+                        "frames": len(frame_map),
+                        "seconds": round(seconds, 4),
+                        "fps": round(len(frame_map) / seconds, 2) if seconds > 0 else None,
+                        "same_as_seek": (frame_map, digest) == reference,
+                    }
+                )
+    return 0
+
+
+def parse_video_sizes(value: str) -> list[tuple[int, int]]:
+    sizes = []
+    for part in value.split(","):
+        try:
+            width, height = (int(side) for side in part.strip().lower().split("x"))
+        except ValueError as exc:
+            raise argparse.ArgumentTypeError("sizes must be comma-separated WxH, e.g. 640x360,1920x1080") from exc
+        if width < 64 or height < 64 or width % 2 or height % 2:
+            raise argparse.ArgumentTypeError(f"size {part.strip()}: width and height must be even and at least 64")
+        sizes.append((width, height))
+    return sizes
+
+
+def parse_positive_ints(value: str) -> list[int]:
+    try:
+        values = [int(part) for part in value.split(",")]
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError("expected comma-separated integers") from exc
+    if any(number <= 0 for number in values):
+        raise argparse.ArgumentTypeError("values must be positive")
+    return values
+
+
+def parse_suite_stages(value: str) -> tuple[str, ...]:
+    stages = tuple(dict.fromkeys(part.strip() for part in value.split(",") if part.strip()))
+    unknown = [stage for stage in stages if stage not in SUITE_STAGES]
+    if unknown or not stages:
+        raise argparse.ArgumentTypeError(f"stages must be a comma-separated subset of {','.join(SUITE_STAGES)}")
+    return stages
+
+
+class SyntheticVideo(t.NamedTuple):
+    width: int
+    height: int
+    frames: int
+    gop: int | None
+    generator: str
+
+    @property
+    def filename(self) -> str:
+        gop = "default" if self.gop is None else self.gop
+        return (
+            f"synthetic.v{SYNTHETIC_VIDEO_VERSION}.{self.width}x{self.height}.{self.frames}f.gop{gop}.{self.generator}.mkv"
+        )
+
+    def record(self) -> dict[str, object]:
+        return self._asdict()
+
+
+def synthetic_boxes(index: int, width: int, height: int) -> vt.np.ndarray:
+    """Integer xyxy boxes (SYNTHETIC_BOX_COUNT x 4) drawn on frame index: box k circles at its own period."""
+    boxes = vt.np.empty((SYNTHETIC_BOX_COUNT, 4), dtype=vt.np.float64)
+    for k in range(SYNTHETIC_BOX_COUNT):
+        box_w = width * (0.12 + 0.04 * k)
+        box_h = height * (0.30 - 0.05 * k)
+        phase = 2 * math.pi * index / (90 + 40 * k) + k
+        cx = width / 2 + (width - box_w) * 0.45 * math.sin(phase)
+        cy = height / 2 + (height - box_h) * 0.45 * math.cos(phase * (1 + 0.25 * k))
+        boxes[k] = [round(cx - box_w / 2), round(cy - box_h / 2), round(cx + box_w / 2), round(cy + box_h / 2)]
+    return boxes
+
+
+def synthetic_background(width: int, height: int) -> vt.np.ndarray:
+    """Seeded smooth noise, so frames compress like camera footage rather than flat colour."""
+    rng = vt.np.random.default_rng(SYNTHETIC_VIDEO_VERSION)
+    noise = rng.integers(0, 256, size=(max(2, height // 16), max(2, width // 16), 3), dtype=vt.np.uint8)
+    return vt.cv2.resize(noise, (width, height), interpolation=vt.cv2.INTER_CUBIC)
+
+
+def synthetic_frame(background: vt.np.ndarray, index: int) -> vt.np.ndarray:
+    height, width = background.shape[:2]
+    frame = vt.np.roll(background, 2 * index, axis=1)
+    colors = ((255, 255, 255), (0, 0, 255), (0, 200, 0))
+    for k, (x0, y0, x1, y1) in enumerate(synthetic_boxes(index, width, height).astype(int).tolist()):
+        vt.cv2.rectangle(frame, (x0, y0), (x1 - 1, y1 - 1), colors[k % len(colors)], -1)
+    return frame
+
+
+def write_synthetic_video(video: SyntheticVideo, dst: Path) -> None:
+    """Write video to dst: frames from synthetic_frame(), encoded with libx264 at the given GOP (ffmpeg) or with
+    OpenCV's mp4v writer and its default GOP (opencv)."""
+    tmp = dst.with_name(f"{dst.stem}.{os.getpid()}.tmp{dst.suffix}")
+    background = synthetic_background(video.width, video.height)
+    started_at = time.monotonic()
+    if video.generator == "ffmpeg":
+        cmd = [
+            "ffmpeg",
+            "-hide_banner",
+            "-v",
+            "error",
+            "-y",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "-s",
+            f"{video.width}x{video.height}",
+            "-r",
+            str(SYNTHETIC_VIDEO_FPS),
+            "-i",
+            "-",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-crf",
+            "20",
+            "-pix_fmt",
+            "yuv420p",
+            "-g",
+            str(video.gop),
+            "-keyint_min",
+            str(video.gop),
+            "-sc_threshold",
+            "0",
+            str(tmp),
+        ]
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        assert process.stdin is not None
+        try:
+            for index in range(video.frames):
+                process.stdin.write(synthetic_frame(background, index).data)
+        finally:
+            process.stdin.close()
+            returncode = process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with exit code {returncode} writing {tmp}")
+    else:
+        writer = vt.cv2.VideoWriter(
+            str(tmp),
+            vt.cv2.VideoWriter_fourcc(*"mp4v"),
+            SYNTHETIC_VIDEO_FPS,
+            (video.width, video.height),
+        )
+        if not writer.isOpened():
+            raise RuntimeError(f"Could not write {tmp}")
+        try:
+            for index in range(video.frames):
+                writer.write(synthetic_frame(background, index))
+        finally:
+            writer.release()
+    os.replace(tmp, dst)
+    vt.logger.info("synthetic video: %s in %.1fs", dst, time.monotonic() - started_at)
+
+
+class StubTensor(t.NamedTuple):
+    array: vt.np.ndarray
+
+    def cpu(self) -> StubTensor:
+        return self
+
+    def numpy(self) -> vt.np.ndarray:
+        return self.array
+
+
+class StubBoxes(t.NamedTuple):
+    id: StubTensor
+    xyxy: StubTensor
+    conf: StubTensor
+
+
+class StubResult(t.NamedTuple):
+    boxes: StubBoxes
+
+
+class SyntheticDetector:
+    """Stand-in for YOLO: track() returns the synthetic boxes of the next frame, so the detect stage measures the
+    pipeline and detection bookkeeping around inference instead of inference."""
+
+    names = {0: "box"}
+
+    def __init__(self, video: SyntheticVideo) -> None:
+        self.video = video
+        self.index = 0
+        self.track_ids = vt.np.arange(1, SYNTHETIC_BOX_COUNT + 1)
+        self.conf = vt.np.full(SYNTHETIC_BOX_COUNT, 0.9, dtype=vt.np.float32)
+
+    def track(self, source: vt.np.ndarray, **kwargs: object) -> list[StubResult]:
+        boxes = synthetic_boxes(self.index, self.video.width, self.video.height).astype(vt.np.float32)
+        self.index += 1
+        return [StubResult(StubBoxes(StubTensor(self.track_ids), StubTensor(boxes), StubTensor(self.conf)))]
+
+
+def synthetic_detections(video: SyntheticVideo, index: int) -> vt.FrameDetections:
+    return vt.make_frame_detections(
+        vt.np.arange(1, SYNTHETIC_BOX_COUNT + 1),
+        synthetic_boxes(index, video.width, video.height),
+        vt.np.full(SYNTHETIC_BOX_COUNT, 0.9),
+    )
+
+
+def synthetic_init_crop(video: SyntheticVideo, index: int) -> tuple[float, float, float, float]:
+    x0, y0, x1, y1 = synthetic_boxes(index, video.width, video.height)[0].tolist()
+    return x1 - x0, y1 - y0, x0, y0
+
+
+def write_synthetic_live(src: Path, video: SyntheticVideo, info: vt.VideoInfo, live_json: Path) -> None:
+    """Live detections of the target (box 0) as detect writes them: a base segment over every frame, then a
+    revision 1 segment re-detecting the middle half, so read, compact and finalize have segments to merge."""
+    segments = [
+        ("base", 0, list(range(video.frames))),
+        ("fix-001", 1, list(range(video.frames // 4, video.frames * 3 // 4))),
+    ]
+    with vt.open_live_writer(live_json, append=False) as writer:
+        for segment_id, revision, frame_indices in segments:
+            if not frame_indices:
+                continue
+            writer.write_meta(
+                vt.live_segment_meta(
+                    src,
+                    info,
+                    synthetic_init_crop(video, frame_indices[0]),
+                    0.0,
+                    {"model": "synthetic"},
+                    segment_id=segment_id,
+                    revision=revision,
+                    frame_indices=None if revision == 0 else frame_indices,
+                    direction="forward",
+                )
+            )
+            for segment_n, index in enumerate(frame_indices):
+                writer.write_frame(index, synthetic_detections(video, index), segment_id, revision, segment_n)
+
+
+def decode_all_frames(src: Path) -> int:
+    cap = vt.cv2.VideoCapture(str(src))
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open {src}")
+    frames = 0
+    try:
+        while True:
+            ok, _frame = cap.read()
+            if not ok:
+                return frames
+            frames += 1
+    finally:
+        cap.release()
+
+
+def suite_commit() -> str | None:
+    """git describe of the tree being measured (with -dirty for uncommitted changes), or None outside git."""
+    try:
+        result = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).resolve().parent,
+            check=False,
+            text=True,
+            capture_output=True,
+        )
+    except FileNotFoundError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def bench_suite(args: argparse.Namespace) -> int:
+    vt.load_video_modules()
+    from video_track_draw_box import draw_video
+    from video_track_stabilize import DEFAULT_SMOOTH_SECONDS, stabilize_video
+
+    if args.repeat < 1:
+        raise SystemExit("--repeat must be at least 1")
+    gops: list[int | None] = list(args.gops)
+    if args.generator == "opencv":
+        vt.logger.info("bench_suite: the opencv generator uses the mp4v writer's GOP; ignoring --gops")
+        gops = [None]
+    videos = [
+        SyntheticVideo(width, height, frames, gop, args.generator)
+        for width, height in args.sizes
+        for frames in args.frames
+        for gop in gops
+    ]
+    common = {"bench": "suite", "commit": suite_commit(), "opencv": vt.cv2.__version__}
+
+    with tempfile.TemporaryDirectory(prefix="video_track_bench.") as tmp:
+        tmp_dir = Path(tmp)
+        video_dir = tmp_dir if args.video_dir is None else Path(args.video_dir)
+        video_dir.mkdir(parents=True, exist_ok=True)
+        for video in videos:
+            src = video_dir / video.filename
+            if not src.exists():
+                write_synthetic_video(video, src)
+            info = vt.load_video_info(src)
+            live_json = tmp_dir / "live.jsonl"
+            write_synthetic_live(src, video, info, live_json)
+            bboxes = vt.np.array([synthetic_boxes(index, video.width, video.height)[0] for index in range(info.frame_count)])
+
+            def measure(
+                stage: str,
+                run: t.Callable[[], object],
+                frames: int = info.frame_count,
+                setup: t.Callable[[], object] | None = None,
+            ) -> None:
+                if stage not in args.stages:
+                    return
+                runs = []
+                result = None
+                for _ in range(args.repeat):
+                    if setup is not None:
+                        setup()
+                    started_at = time.monotonic()
+                    result = run()
+                    runs.append(time.monotonic() - started_at)
+                seconds = min(runs)
+                record = {
+                    **common,
+                    "stage": stage,
+                    "video": video.record(),
+                    "frames": frames,
+                    "seconds": round(seconds, 4),
+                    "fps": round(frames / seconds, 2) if seconds > 0 else None,
+                    "runs": [round(value, 4) for value in runs],
+                }
+                if stage in ("load_video_info", "ffprobe_frame_count", "decode", "detect"):
+                    record["result_frames"] = result.frame_count if isinstance(result, vt.VideoInfo) else result
+                emit(record)
+
+            def detect() -> int:
+                builder = vt.DetectionStoreBuilder()
+                return vt.run_detect_pipeline(
+                    src,
+                    SyntheticDetector(video),
+                    None,
+                    None,
+                    lambda item: builder.append(item.original_index, item.detections),
+                    desc="bench detect",
+                    total=info.frame_count,
+                )
+
+            compact_json = tmp_dir / "compact.jsonl"
+            measure("load_video_info", lambda: vt.load_video_info(src))
+            measure("ffprobe_frame_count", lambda: vt.ffprobe_frame_count(src))
+            measure("decode", lambda: decode_all_frames(src))
+            measure("detect", detect)
+            measure("live_write", lambda: write_synthetic_live(src, video, info, tmp_dir / "live_write.jsonl"))
+            measure("live_read", lambda: vt.read_live_detection_data(live_json))
+            measure(
+                "live_compact",
+                lambda: vt.compact_live_detection_data(compact_json),
+                setup=lambda: shutil.copyfile(live_json, compact_json),
+            )
+            measure("finalize", lambda: vt.finalize_track_data(src, live_json, None, None))
+            measure(
+                "draw_box",
+                lambda: draw_video(
+                    src,
+                    tmp_dir / "boxed.mp4v.mkv",
+                    tmp_dir / "boxed.h264.mkv",
+                    bboxes,
+                    (0, 255, 0),
+                    3,
+                    False,
+                    False,
+                    None,
+                    None,
+                    encoders=args.encoders,
+                ),
+            )
+            measure(
+                "stabilize",
+                lambda: stabilize_video(
+                    src,
+                    tmp_dir / "stabilized.mp4v.mkv",
+                    tmp_dir / "stabilized.h264.mkv",
+                    bboxes,
+                    1.35,
+                    DEFAULT_SMOOTH_SECONDS,
+                    False,
+                    False,
+                    encoders=args.encoders,
+                ),
+            )
+    return 0
+
+
+def load_bench_records(path: Path) -> dict[str, dict[str, object]]:
+    records = {}
+    with path.open("r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            record = json.loads(line)
+            if "seconds" not in record:
+                continue
+            key = json.dumps({name: record.get(name) for name in COMPARE_KEYS}, sort_keys=True)
+            records[key] = record
+    return records
+
+
+def bench_compare(args: argparse.Namespace) -> int:
+    """Print baseline and current seconds for every measurement in both files; exit 1 if any got slower than
+    --threshold allows."""
+    baseline = load_bench_records(Path(args.baseline))
+    current = load_bench_records(Path(args.current))
+    regressions = 0
+    for key, record in current.items():
+        base = baseline.get(key)
+        if base is None or not base["seconds"] or record["seconds"] is None:
+            continue
+        ratio = record["seconds"] / base["seconds"]
+        regression = ratio > 1 + args.threshold
+        regressions += regression
+        emit(
+            {
+                **{name: record[name] for name in COMPARE_KEYS if name in record},
+                "baseline_commit": base.get("commit"),
+                "commit": record.get("commit"),
+                "baseline_seconds": base["seconds"],
+                "seconds": record["seconds"],
+                "ratio": round(ratio, 3),
+                "regression": regression,
+            }
+        )
+    missing = len(baseline.keys() - current.keys())
+    if missing:
+        vt.logger.warning("bench_compare: %s baseline measurements have no current counterpart", missing)
+    return 1 if regressions else 0
@@ -7,6 +7,8 @@ import time
 from pathlib import Path
 
 import video_track as vt
+from video_track_frame_cache import FrameCacheOptions, frame_cache_options
+from video_track_output import OUTPUT_ENCODERS, OutputWriter, derive_mp4v_from_h264, mp4v_encoder, pipe_encoder
 from video_track_stabilize import DEFAULT_SMOOTH_SECONDS, compute_stabilize_crop_geometry
 
 
@@ -133,11 +135,14 @@ def draw_video(
     stabilize_margin: float = 1.35,
     stabilize_smooth_seconds: float = DEFAULT_SMOOTH_SECONDS,
     stabilize_crop_color: tuple[int, int, int] = (0, 0, 255),
+    frame_cache: FrameCacheOptions | None = None,
+    encoders: tuple[str, ...] = OUTPUT_ENCODERS,
+    mp4v_from_h264: bool = False,
 ) -> None:
     started_at = time.monotonic()
     if preview:
         vt.ensure_preview_available()
-    cap = vt.cv2.VideoCapture(str(src))
+    cap = vt.open_video_capture(src, frame_cache)
     if not cap.isOpened():
         raise RuntimeError(f"Could not open {src}")
 
@@ -161,27 +166,24 @@ def draw_video(
             stabilize_margin,
             stabilize_smooth_seconds,
         )
-    if preview:
-        vt.open_preview_window("video_track draw_box", src_w, src_h)
-
-    writer = vt.cv2.VideoWriter(
-        str(mp4v_video),
-        vt.cv2.VideoWriter_fourcc(*"mp4v"),
-        fps,
-        (src_w, src_h),
-    )
-    if not writer.isOpened():
-        raise RuntimeError(f"Could not write {mp4v_video}")
-    h264_process = open_h264_writer(
-        src,
-        h264_video,
-        fps,
-        src_w,
-        src_h,
-        dry_run,
-        audio_start_seconds,
-        audio_duration_seconds,
-    )
+    frame_encoders = []
+    if "mp4v" in encoders and not mp4v_from_h264:
+        frame_encoders.append(mp4v_encoder(mp4v_video, fps, src_w, src_h))
+    h264_process = None
+    if "h264" in encoders:
+        h264_process = open_h264_writer(
+            src,
+            h264_video,
+            fps,
+            src_w,
+            src_h,
+            dry_run,
+            audio_start_seconds,
+            audio_duration_seconds,
+        )
+    if h264_process is not None:
+        frame_encoders.append(pipe_encoder("h264", h264_process, lambda: close_h264_writer(h264_process)))
+    output = OutputWriter("draw_box", (src_h, src_w, 3), frame_encoders)
 
     if range_start:
         cap.set(vt.cv2.CAP_PROP_POS_FRAMES, range_start)
@@ -202,12 +204,18 @@ def draw_video(
             stabilize_smooth_seconds,
             stabilize_smooth_radius,
         )
+    preview_renderer = None
+    if preview:
+        from video_track_preview import PreviewRenderer, draw_status_preview
+
+        preview_renderer = PreviewRenderer("video_track draw_box", src_w, src_h, draw_status_preview)
     index = range_start
     written = 0
     try:
-        with vt.tqdm_progress(total=output_frame_count, desc="draw_box", unit="frame") as progress:
+        with output, vt.tqdm_progress(total=output_frame_count, desc="draw_box", unit="frame") as progress:
             while index <= range_end:
-                ok, frame = cap.read()
+                # Boxes are drawn in place, so read into an output buffer (cached frames are read-only views).
+                ok, frame = cap.read(output.next_buffer())
                 if not ok:
                     break
                 if index < len(bboxes):
@@ -220,12 +228,9 @@ def draw_video(
                     pt1 = (int(round(x0)), int(round(y0)))
                     pt2 = (int(round(x1)), int(round(y1)))
                     vt.cv2.rectangle(frame, pt1, pt2, stabilize_crop_color, thickness)
-                writer.write(frame)
-                if h264_process is not None and h264_process.stdin is not None:
-                    h264_process.stdin.write(frame.tobytes())
+                output.write(frame)
                 written += 1
-                if preview:
-                    style = vt.preview_style(frame)
+                if preview_renderer is not None and preview_renderer.due():
                     pct = ((written - 1) / max(1, output_frame_count - 1) * 100.0) if output_frame_count else 100.0
                     status_text = vt.detect_preview_status(
                         index,
@@ -235,27 +240,15 @@ def draw_video(
                         range_start,
                         range_end,
                     )
-                    vt.draw_preview_text(
-                        frame,
-                        f"{status_text}\nq/esc: kill",
-                        style.margin,
-                        style.line_y,
-                        style.text_scale,
-                        style.text_thickness,
-                        (255, 255, 255),
-                    )
-                    vt.cv2.imshow("video_track draw_box", frame)
-                    key = vt.cv2.waitKey(1) & 0xFF
-                    if key in (27, ord("q")):
-                        raise KeyboardInterrupt("preview interrupted")
+                    preview_renderer.submit(frame, status_text)
                 index += 1
                 progress.update(1)
     finally:
         cap.release()
-        writer.release()
-        close_h264_writer(h264_process)
-        if preview:
-            vt.cv2.destroyWindow("video_track draw_box")
+        if preview_renderer is not None:
+            preview_renderer.close()
+    if "mp4v" in encoders and mp4v_from_h264:
+        derive_mp4v_from_h264(h264_video, mp4v_video, dry_run)
     vt.logger.info("draw_box done: %s frames in %.1fs", written, time.monotonic() - started_at)
 
 
@@ -272,6 +265,8 @@ def draw_box(args: argparse.Namespace) -> int:
         raise ValueError("--stabilize-margin must be positive")
     if args.stabilize_smooth_seconds < 0:
         raise ValueError("--stabilize-smooth-seconds must be non-negative")
+    if args.mp4v_from_h264 and "h264" not in args.encoders:
+        raise SystemExit("--mp4v-from-h264 needs h264 in --encoders")
 
     range_args = [args.start, args.end, args.duration]
     range_arg_count = sum(value is not None for value in range_args)
@@ -300,7 +295,8 @@ def draw_box(args: argparse.Namespace) -> int:
         vt.frame_range_label(range_start, range_end, info.fps),
     )
 
-    vt.logger.info("draw_box mp4v no-audio video: %s", mp4v_dst)
+    if "mp4v" in args.encoders:
+        vt.logger.info("draw_box mp4v no-audio video: %s", mp4v_dst)
     draw_video(
         src,
         mp4v_dst,
@@ -318,5 +314,8 @@ def draw_box(args: argparse.Namespace) -> int:
         args.stabilize_margin,
         args.stabilize_smooth_seconds,
         args.stabilize_crop_color,
+        frame_cache_options(args),
+        args.encoders,
+        args.mp4v_from_h264,
     )
     return 0
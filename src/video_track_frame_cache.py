@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+import typing as t
+from pathlib import Path
+
+import numpy as np
+
+import video_track as vt
+
+# Opt-in cache of decoded frames shared by detect, draw_box and stabilize (--frame-cache).
+#
+# One entry per (source path, size, mtime, scale) in the cache directory:
+#   <key>.json    FRAME_CACHE_SCHEMA meta: source identity, fps, frame count, cached frame size
+#   <key>.frames  raw BGR frames, frame_count x height x width x 3 uint8 (a sparse file; only cached frames use disk)
+#   <key>.filled  one uint8 per frame, set after the frame has been written to <key>.frames
+# Frames are cached as they are first decoded, so the first pass costs no extra decode and later passes (or ranges
+# of them) read memmap views instead of decoding. Entries are evicted least recently used first (by <key>.json
+# mtime) once the cache directory holds more than its size limit; entries used in the last EVICT_GRACE_SECONDS are
+# left to the processes that may have them open.
+
+FRAME_CACHE_SCHEMA = "video_track.frame_cache.v1"
+DEFAULT_FRAME_CACHE_DIR = Path(os.environ.get("VIDEO_TRACK_FRAME_CACHE_DIR", "~/.cache/video_track/frames")).expanduser()
+DEFAULT_FRAME_CACHE_MAX_GB = 64.0
+EVICT_GRACE_SECONDS = 60.0  # entries used more recently may be open in another process (draw_box, detect --shards)
+
+
+class FrameCacheOptions(t.NamedTuple):
+    directory: Path
+    max_bytes: int
+    scale: float = 1.0
+
+
+def frame_cache_options(args: object) -> FrameCacheOptions | None:
+    """FrameCacheOptions from the --frame-cache* arguments, or None when --frame-cache is not given."""
+    if not args.frame_cache:
+        return None
+    if args.frame_cache_max_gb <= 0:
+        raise SystemExit("--frame-cache-max-gb must be positive")
+    scale = getattr(args, "proxy_scale", 1.0)
+    return FrameCacheOptions(Path(args.frame_cache_dir), int(args.frame_cache_max_gb * 1024**3), scale)
+
+
+def frame_cache_key(src: Path, scale: float) -> tuple[str, dict[str, object]]:
+    stat = src.stat()
+    identity = {"source": str(src.resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "scale": scale}
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:20], identity
+
+
+def entry_paths(directory: Path, key: str) -> tuple[Path, Path, Path]:
+    return directory / f"{key}.json", directory / f"{key}.frames", directory / f"{key}.filled"
+
+
+def disk_usage(path: Path) -> int:
+    try:
+        return path.stat().st_blocks * 512
+    except FileNotFoundError:
+        return 0
+
+
+def open_sized(path: Path, size: int) -> None:
+    """Create path with the given size, keeping the contents if it already has that size (another pass may use it)."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def remove_entry(directory: Path, key: str) -> None:
+    for path in entry_paths(directory, key):
+        path.unlink(missing_ok=True)
+
+
+def evict_frame_cache(directory: Path, max_bytes: int, keep: str, keep_bytes: int) -> None:
+    """Remove least recently used entries until they fit in max_bytes next to keep, which may grow to keep_bytes.
+
+    Entries used within EVICT_GRACE_SECONDS are kept even if the cache stays over its limit.
+    """
+    entries = []
+    now = time.time()
+    for meta_path in directory.glob("*.json"):
+        key = meta_path.stem
+        if key == keep:
+            continue
+        try:
+            used_at = meta_path.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if now - used_at < EVICT_GRACE_SECONDS:
+            continue
+        entries.append((used_at, key, sum(disk_usage(path) for path in entry_paths(directory, key))))
+    total = sum(size for _used_at, _key, size in entries)
+    for _used_at, key, size in sorted(entries):
+        if total <= max_bytes - keep_bytes:
+            break
+        remove_entry(directory, key)
+        total -= size
+        vt.logger.info("frame cache evicted %s (%.1f GiB)", key, size / 1024**3)
+
+
+class CachedVideoCapture:
+    """The part of cv2.VideoCapture the video_track passes use, serving frames from a frame cache entry.
+
+    read() returns a read-only view of the cached frame, or copies it into image when given. Frames that are not
+    cached yet are decoded from the source (seeking only when reads are not sequential) and cached.
+    """
+
+    def __init__(self, src: Path, options: FrameCacheOptions, key: str, meta: dict[str, object]) -> None:
+        self.src = src
+        self.options = options
+        self.key = key
+        self.scale = options.scale
+        self.fps = float(meta["fps"])
+        self.frame_count = int(meta["frame_count"])
+        self.width = int(meta["width"])
+        self.height = int(meta["height"])
+        self.frames_bytes = self.frame_count * self.height * self.width * 3
+        meta_path, frames_path, filled_path = entry_paths(options.directory, key)
+        self.meta_path = meta_path
+        self.frames = np.memmap(frames_path, dtype=np.uint8, mode="r+", shape=(self.frame_count, self.height, self.width, 3))
+        self.filled = np.memmap(filled_path, dtype=np.uint8, mode="r+", shape=(self.frame_count,))
+        self.position = 0
+        self.source: object | None = None
+        self.source_position = 0
+        self.hits = 0
+        self.misses = 0
+
+    def isOpened(self) -> bool:
+        return True
+
+    def get(self, prop: int) -> float:
+        if prop == vt.cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == vt.cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frame_count)
+        if prop == vt.cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == vt.cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == vt.cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return self.open_source().get(prop)
+
+    def set(self, prop: int, value: float) -> bool:
+        if prop != vt.cv2.CAP_PROP_POS_FRAMES:
+            raise ValueError(f"CachedVideoCapture cannot set property {prop}")
+        self.position = int(value)
+        return True
+
+    def open_source(self) -> object:
+        if self.source is None:
+            self.source = vt.cv2.VideoCapture(str(self.src))
+            if not self.source.isOpened():
+                raise RuntimeError(f"Could not open {self.src}")
+            self.source_position = 0
+        return self.source
+
+    def decode(self, index: int) -> np.ndarray | None:
+        source = self.open_source()
+        if index != self.source_position:
+            source.set(vt.cv2.CAP_PROP_POS_FRAMES, index)
+        ok, frame = source.read()
+        if not ok:
+            self.source_position = -1
+            return None
+        self.source_position = index + 1
+        if frame.shape[:2] != (self.height, self.width):
+            frame = vt.cv2.resize(frame, (self.width, self.height), interpolation=vt.cv2.INTER_AREA)
+        if index >= self.frame_count:
+            return frame
+        self.frames[index] = frame
+        self.filled[index] = 1
+        return self.frames[index]
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        index = self.position
+        if 0 <= index < self.frame_count and self.filled[index]:
+            frame = self.frames[index]
+            self.hits += 1
+        else:
+            frame = self.decode(index)
+            if frame is None:
+                return False, None
+            self.misses += 1
+        self.position = index + 1
+        if image is not None and image.shape == frame.shape:
+            image[...] = frame
+            return True, image
+        view = frame.view()
+        view.flags.writeable = False
+        return True, view
+
+    def release(self) -> None:
+        if self.source is not None:
+            self.source.release()
+            self.source = None
+        self.frames.flush()
+        self.filled.flush()
+        vt.logger.info(
+            "frame cache %s: %s frames from cache, %s decoded, %s/%s frames cached",
+            self.key,
+            self.hits,
+            self.misses,
+            int(np.count_nonzero(self.filled)),
+            self.frame_count,
+        )
+        try:
+            os.utime(self.meta_path)
+        except FileNotFoundError:
+            vt.logger.warning("frame cache %s was evicted by another process while in use", self.key)
+        evict_frame_cache(self.options.directory, self.options.max_bytes, self.key, self.frames_bytes)
+
+
+def open_cached_capture(src: Path, options: FrameCacheOptions) -> CachedVideoCapture | object:
+    """Open src through the frame cache, falling back to cv2.VideoCapture when the video cannot fit in it."""
+    key, identity = frame_cache_key(src, options.scale)
+    directory = options.directory
+    directory.mkdir(parents=True, exist_ok=True)
+    meta_path, frames_path, filled_path = entry_paths(directory, key)
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        meta = None
+    if meta is None or meta.get("schema") != FRAME_CACHE_SCHEMA:
+        for other_meta_path in directory.glob("*.json"):
+            if other_meta_path.stem == key:
+                continue  # another process (detect --shards) may have just created this entry
+            try:
+                other = json.loads(other_meta_path.read_text(encoding="utf-8"))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if other.get("source") == identity["source"] and other.get("scale") == options.scale:
+                vt.logger.info("frame cache: %s changed, dropping %s", src, other_meta_path.stem)
+                remove_entry(directory, other_meta_path.stem)
+        info = vt.load_video_info(src)
+        width, height = vt.proxy_frame_size(info.width, info.height, options.scale)
+        meta = {
+            "schema": FRAME_CACHE_SCHEMA,
+            **identity,
+            "fps": info.fps,
+            "frame_count": info.frame_count,
+            "source_width": info.width,
+            "source_height": info.height,
+            "width": width,
+            "height": height,
+        }
+    frames_bytes = int(meta["frame_count"]) * int(meta["height"]) * int(meta["width"]) * 3
+    if frames_bytes > options.max_bytes:
+        vt.logger.warning(
+            "frame cache: %s needs %.1f GiB, more than the %.1f GiB limit; reading without the cache",
+            src,
+            frames_bytes / 1024**3,
+            options.max_bytes / 1024**3,
+        )
+        return vt.cv2.VideoCapture(str(src))
+    open_sized(frames_path, frames_bytes)
+    open_sized(filled_path, int(meta["frame_count"]))
+    if not meta_path.exists():
+        tmp_path = meta_path.with_suffix(f".json.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(meta, indent=2) + "\n", encoding="utf-8")
+        os.replace(tmp_path, meta_path)
+    os.utime(meta_path)
+    evict_frame_cache(directory, options.max_bytes, key, frames_bytes)
+    cap = CachedVideoCapture(src, options, key, meta)
+    vt.logger.info(
+        "frame cache %s: %s (%sx%s, %s/%s frames cached)",
+        key,
+        src,
+        cap.width,
+        cap.height,
+        int(np.count_nonzero(cap.filled)),
+        cap.frame_count,
+    )
+    return cap
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+import video_track as vt
+
+# Binary alternative to the video_track.live.v1 JSONL, used when the live path ends with LIVE_BIN_SUFFIX.
+#
+# <live>.bin is append-only and the source of truth. Everything in it is a whole number of UNIT-byte units:
+#   file header   magic, version, unit size
+#   meta record   META tag, segment number, JSON length; the segment meta JSON follows, zero-padded to whole units
+#   frame record  FRAM tag, segment number, n, segment_n, count; count detection rows (ROW_DTYPE) follow
+# so the whole file can be viewed as one ROW_DTYPE array and a frame's detections are a row range of it.
+#
+# <live>.bin.segments holds one SEGMENT_DTYPE row per meta record (the segment/revision table) and <live>.bin.idx
+# one INDEX_DTYPE row per frame record (the offset index). Both are appended after the data they describe; when
+# they do not match <live>.bin (crash, older copy) they are rebuilt from it.
+
+LIVE_BIN_SUFFIX = ".bin"
+UNIT = 24
+MAGIC = b"VTLIVEB1"
+VERSION = 1
+META_TAG = b"META"
+FRAME_TAG = b"FRAM"
+
+FILE_HEADER = struct.Struct("<8sIIQ")  # magic, version, unit size, reserved
+META_HEADER = struct.Struct("<4sIQQ")  # tag, segment, JSON length, reserved
+FRAME_HEADER = struct.Struct("<4sIqiI")  # tag, segment, n, segment_n, count
+SEGMENT_ROW = struct.Struct("<qQQ")  # revision, meta unit, JSON length
+INDEX_ROW = struct.Struct("<IIqQ")  # segment, count, n, first row unit
+
+ROW_DTYPE = np.dtype([("track_id", "<i4"), ("xyxy", "<f4", (4,)), ("conf", "<f4")])
+FRAME_HEADER_DTYPE = np.dtype([("tag", "S4"), ("segment", "<u4"), ("n", "<i8"), ("segment_n", "<i4"), ("count", "<u4")])
+SEGMENT_DTYPE = np.dtype([("revision", "<i8"), ("meta_unit", "<u8"), ("meta_length", "<u8")])
+INDEX_DTYPE = np.dtype([("segment", "<u4"), ("count", "<u4"), ("n", "<i8"), ("row", "<u8")])
+
+for _struct in (FILE_HEADER, META_HEADER, FRAME_HEADER, SEGMENT_ROW, INDEX_ROW):
+    assert _struct.size == UNIT
+for _dtype in (ROW_DTYPE, FRAME_HEADER_DTYPE, SEGMENT_DTYPE, INDEX_DTYPE):
+    assert _dtype.itemsize == UNIT
+
+
+def is_live_bin_path(path: Path) -> bool:
+    return path.suffix == LIVE_BIN_SUFFIX
+
+
+def segments_path(path: Path) -> Path:
+    return Path(f"{path}.segments")
+
+
+def index_path(path: Path) -> Path:
+    return Path(f"{path}.idx")
+
+
+def units_of(length: int) -> int:
+    return (length + UNIT - 1) // UNIT
+
+
+class LiveBinTable:
+    def __init__(self, data: np.ndarray, segments: np.ndarray, index: np.ndarray, end_unit: int) -> None:
+        self.data = data
+        self.segments = segments
+        self.index = index
+        self.end_unit = end_unit
+        self.rows = data[: end_unit * UNIT].view(ROW_DTYPE)
+        self.frame_headers = data[: end_unit * UNIT].view(FRAME_HEADER_DTYPE)
+        self.metas = [self.meta(segment) for segment in range(len(segments))]
+
+    def meta(self, segment: int) -> dict[str, object]:
+        start = (int(self.segments["meta_unit"][segment]) + 1) * UNIT
+        return json.loads(bytes(self.data[start : start + int(self.segments["meta_length"][segment])]))
+
+
+def read_sidecar(path: Path, dtype: np.dtype) -> np.ndarray:
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return np.empty(0, dtype=dtype)
+    return np.fromfile(path, dtype=dtype, count=size // dtype.itemsize)
+
+
+def committed_end_unit(segments: np.ndarray, index: np.ndarray) -> int:
+    end = 1
+    if len(segments):
+        end = max(end, int(segments["meta_unit"][-1]) + 1 + units_of(int(segments["meta_length"][-1])))
+    if len(index):
+        end = max(end, int(index["row"][-1]) + int(index["count"][-1]))
+    return end
+
+
+def common_sidecar_rows(segments: np.ndarray, index: np.ndarray) -> tuple[np.ndarray, np.ndarray, int]:
+    """The rows of both sidecars up to where the shorter one ends, and that unit; the records after it are scanned.
+
+    One sidecar can stop short of the other (an older copy, or frames not flushed yet after a meta record), and
+    nothing past its end says which of the other's records it misses.
+    """
+    segments_end = committed_end_unit(segments, np.empty(0, dtype=INDEX_DTYPE))
+    index_end = committed_end_unit(np.empty(0, dtype=SEGMENT_DTYPE), index)
+    end = min(segments_end, index_end)
+    return segments[segments["meta_unit"] < end], index[index["row"] <= end], end
+
+
+def sidecars_match(data: np.ndarray, segments: np.ndarray, index: np.ndarray) -> bool:
+    total_units = len(data) // UNIT
+    if committed_end_unit(segments, index) > total_units:
+        return False
+    if len(segments):
+        tag, _segment, length, _reserved = META_HEADER.unpack_from(data, int(segments["meta_unit"][-1]) * UNIT)
+        if tag != META_TAG or length != int(segments["meta_length"][-1]):
+            return False
+    if len(index):
+        row = index[-1]
+        tag, segment, n, _segment_n, count = FRAME_HEADER.unpack_from(data, (int(row["row"]) - 1) * UNIT)
+        if (tag, segment, n, count) != (FRAME_TAG, int(row["segment"]), int(row["n"]), int(row["count"])):
+            return False
+        if segment >= len(segments):
+            return False
+    return True
+
+
+def scan_live_bin(data: np.ndarray, start_unit: int) -> tuple[list[tuple[int, int, int]], list[tuple[int, int, int, int]], int]:
+    """Walk the records from start_unit; returns segment rows, index rows and the unit after the last whole record."""
+    total_units = len(data) // UNIT
+    segment_rows: list[tuple[int, int, int]] = []
+    index_rows: list[tuple[int, int, int, int]] = []
+    unit = start_unit
+    while unit < total_units:
+        tag = bytes(data[unit * UNIT : unit * UNIT + 4])
+        if tag == META_TAG:
+            _tag, _segment, length, _reserved = META_HEADER.unpack_from(data, unit * UNIT)
+            end = unit + 1 + units_of(length)
+            if end > total_units:
+                break
+            meta = json.loads(bytes(data[(unit + 1) * UNIT : (unit + 1) * UNIT + length]))
+            segment_rows.append((int(meta.get("revision", 0)), unit, length))
+        elif tag == FRAME_TAG:
+            _tag, segment, n, _segment_n, count = FRAME_HEADER.unpack_from(data, unit * UNIT)
+            end = unit + 1 + count
+            if end > total_units:
+                break
+            index_rows.append((segment, count, n, unit + 1))
+        else:
+            break
+        unit = end
+    return segment_rows, index_rows, unit
+
+
+def load_live_bin(path: Path) -> LiveBinTable:
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(data) < UNIT:
+        raise ValueError(f"Live bin file is truncated: {path}")
+    magic, version, unit_size, _reserved = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or unit_size != UNIT:
+        raise ValueError(f"Unsupported live bin file: {path}")
+
+    segments = read_sidecar(segments_path(path), SEGMENT_DTYPE)
+    index = read_sidecar(index_path(path), INDEX_DTYPE)
+    rewrite = False
+    if not sidecars_match(data, segments, index):
+        vt.logger.warning("live bin sidecars do not match %s; rebuilding them", path)
+        segments = np.empty(0, dtype=SEGMENT_DTYPE)
+        index = np.empty(0, dtype=INDEX_DTYPE)
+        rewrite = True
+    segments, index, start_unit = common_sidecar_rows(segments, index)
+    segment_rows, index_rows, end_unit = scan_live_bin(data, start_unit)
+    if segment_rows or index_rows:
+        segments = np.concatenate([segments, np.array(segment_rows, dtype=SEGMENT_DTYPE)])
+        index = np.concatenate([index, np.array(index_rows, dtype=INDEX_DTYPE)])
+        rewrite = True
+    if rewrite:
+        segments.tofile(segments_path(path))
+        index.tofile(index_path(path))
+    return LiveBinTable(data, segments, index, end_unit)
+
+
+class LiveBinWriter:
+    """Append segments and frames to a live bin file; data is flushed before the index rows that point into it."""
+
+    def __init__(self, path: Path, append: bool) -> None:
+        self.path = path
+        self.segment_numbers: dict[str, int] = {}
+        if append and path.exists() and path.stat().st_size > 0:
+            table = load_live_bin(path)
+            self.end_unit = table.end_unit
+            self.segment_count = len(table.segments)
+            for segment, meta in enumerate(table.metas):
+                self.segment_numbers[str(meta.get("segment_id", "base"))] = segment
+            del table
+            os.truncate(path, self.end_unit * UNIT)
+            self.data = path.open("ab")
+            self.segments = segments_path(path).open("ab")
+            self.index = index_path(path).open("ab")
+        else:
+            self.end_unit = 1
+            self.segment_count = 0
+            self.data = path.open("wb")
+            self.data.write(FILE_HEADER.pack(MAGIC, VERSION, UNIT, 0))
+            self.segments = segments_path(path).open("wb")
+            self.index = index_path(path).open("wb")
+        self.pending_index = bytearray()
+        self.last_flush = time.monotonic()
+
+    def __enter__(self) -> LiveBinWriter:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def write_meta(self, meta: dict[str, object]) -> None:
+        payload = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+        segment = self.segment_count
+        self.segment_count += 1
+        self.segment_numbers[str(meta.get("segment_id", "base"))] = segment
+        self.data.write(META_HEADER.pack(META_TAG, segment, len(payload), 0))
+        self.data.write(payload.ljust(units_of(len(payload)) * UNIT, b"\0"))
+        meta_unit = self.end_unit
+        self.end_unit += 1 + units_of(len(payload))
+        self.flush()
+        self.segments.write(SEGMENT_ROW.pack(int(meta.get("revision", 0)), meta_unit, len(payload)))
+        self.segments.flush()
+
+    def write_frame(
+        self,
+        index: int,
+        frame_detections: vt.FrameDetections,
+        segment_id: str,
+        revision: int,
+        segment_n: int,
+    ) -> None:
+        segment = self.segment_numbers.get(segment_id)
+        if segment is None:
+            raise ValueError(f"live bin frame {index} has no meta record for segment {segment_id!r}")
+        count = len(frame_detections.track_ids)
+        rows = np.empty(count, dtype=ROW_DTYPE)
+        rows["track_id"] = frame_detections.track_ids
+        rows["xyxy"] = frame_detections.xyxy
+        rows["conf"] = frame_detections.conf
+        self.data.write(FRAME_HEADER.pack(FRAME_TAG, segment, index, segment_n, count))
+        self.data.write(memoryview(rows).cast("B"))
+        self.pending_index += INDEX_ROW.pack(segment, count, index, self.end_unit + 1)
+        self.end_unit += 1 + count
+        if time.monotonic() - self.last_flush >= vt.LIVE_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        self.data.flush()
+        self.index.write(self.pending_index)
+        self.index.flush()
+        self.pending_index.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self.data.close()
+        self.segments.close()
+        self.index.close()
+
+
+def next_live_bin_revision(path: Path) -> int:
+    """Highest segment revision + 1; the segment table is checked against the data first (see load_live_bin).
+
+    write_meta() flushes the meta record before its segment row, so after a crash between the two the last row is
+    not the last revision.
+    """
+    table = load_live_bin(path)
+    return int(table.segments["revision"].max(initial=0)) + 1
+
+
+def read_live_bin_segments(path: Path) -> list[dict[str, object]]:
+    """Same result as read_live_detection_segments() for JSONL; detections are gathered from the memory-mapped rows."""
+    table = load_live_bin(path)
+    segments: dict[str, dict[str, object]] = {}
+    group_of_segment = np.empty(len(table.segments), dtype=np.int64)
+    for segment, meta in enumerate(table.metas):
+        segment_id = str(meta.get("segment_id", "base"))
+        if segment_id not in segments:
+            segments[segment_id] = {"segment_id": segment_id, "order": len(segments)}
+        segments[segment_id]["meta"] = meta
+        segments[segment_id]["revision"] = int(meta.get("revision", 0))
+        group_of_segment[segment] = segments[segment_id]["order"]
+    if not segments:
+        raise ValueError(f"Live bin has no meta record: {path}")
+
+    entry_groups = group_of_segment[table.index["segment"]]
+    for segment in segments.values():
+        entries = np.flatnonzero(entry_groups == segment["order"])
+        if len(entries) == 0:
+            raise ValueError(f"Live bin segment has no frame records: {segment['segment_id']}")
+        segment["detections"] = vt.detection_store_from_records(
+            table.index["n"][entries],
+            table.index["row"][entries].astype(np.int64),
+            table.index["count"][entries].astype(np.int64),
+            table.rows["track_id"],
+            table.rows["xyxy"],
+            table.rows["conf"],
+        )
+    return sorted(segments.values(), key=lambda item: (int(item["revision"]), int(item["order"])))
+
+
+def compact_live_bin(path: Path) -> None:
+    """Drop frame records superseded by a later revision of the same frame, and segments left without frames.
+
+    Nothing is rewritten when no record is superseded; otherwise the kept records are copied as raw bytes.
+    """
+    table = load_live_bin(path)
+    index = table.index
+    revisions = table.segments["revision"][index["segment"]]
+    order = np.lexsort((np.arange(len(index)), revisions, index["n"]))
+    sorted_n = index["n"][order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = sorted_n[1:] != sorted_n[:-1]
+    winners = order[last]
+    if len(winners) == len(index):
+        vt.logger.info("live bin has no superseded frame records: %s", path)
+        return
+
+    kept_segments = np.unique(index["segment"][winners]).astype(np.int64)
+    kept_segments = kept_segments[np.lexsort((kept_segments, table.segments["revision"][kept_segments]))]
+    renumber = np.full(len(table.segments), -1, dtype=np.int64)
+    renumber[kept_segments] = np.arange(len(kept_segments))
+
+    tmp = path.with_name(path.name + ".tmp")
+    segment_rows = bytearray()
+    index_rows = bytearray()
+    with tmp.open("wb") as file:
+        file.write(FILE_HEADER.pack(MAGIC, VERSION, UNIT, 0))
+        unit = 1
+        for segment in kept_segments.tolist():
+            meta_unit = int(table.segments["meta_unit"][segment])
+            meta_length = int(table.segments["meta_length"][segment])
+            file.write(META_HEADER.pack(META_TAG, int(renumber[segment]), meta_length, 0))
+            file.write(table.data[(meta_unit + 1) * UNIT : (meta_unit + 1 + units_of(meta_length)) * UNIT])
+            segment_rows += SEGMENT_ROW.pack(int(table.segments["revision"][segment]), unit, meta_length)
+            unit += 1 + units_of(meta_length)
+        for entry in winners.tolist():
+            row = int(index["row"][entry])
+            count = int(index["count"][entry])
+            header = table.frame_headers[row - 1]
+            segment = int(renumber[int(index["segment"][entry])])
+            file.write(FRAME_HEADER.pack(FRAME_TAG, segment, int(header["n"]), int(header["segment_n"]), count))
+            file.write(table.data[row * UNIT : (row + count) * UNIT])
+            index_rows += INDEX_ROW.pack(segment, count, int(header["n"]), unit + 1)
+            unit += 1 + count
+    del table
+    tmp.replace(path)
+    segments_path(path).write_bytes(segment_rows)
+    index_path(path).write_bytes(index_rows)
+    vt.logger.info(
+        "live bin compacted: %s segments, %s -> %s frame records -> %s",
+        len(kept_segments),
+        len(index),
+        len(winners),
+        path,
+    )
+
+
+def convert_jsonl_to_live_bin(src: Path, dst: Path) -> None:
+    with src.open("r", encoding="utf-8") as file, LiveBinWriter(dst, append=False) as writer:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("schema") != "video_track.live.v1":
+                raise ValueError(f"Unsupported live JSON schema on line {line_number}: {record.get('schema')!r}")
+            if record.get("type") == "meta":
+                writer.write_meta(record)
+            elif record.get("type") == "frame":
+                writer.write_frame(
+                    int(record["n"]),
+                    vt.decode_live_frame_record(record),
+                    str(record.get("segment_id", "base")),
+                    int(record.get("revision", 0)),
+                    int(record.get("segment_n", record["n"])),
+                )
+
+
+def convert_live_bin_to_jsonl(src: Path, dst: Path) -> None:
+    table = load_live_bin(src)
+    records = sorted(
+        [(int(unit), "meta", segment) for segment, unit in enumerate(table.segments["meta_unit"].tolist())]
+        + [(int(row), "frame", entry) for entry, row in enumerate(table.index["row"].tolist())]
+    )
+    with dst.open("w", encoding="utf-8") as file:
+        for _unit, kind, position in records:
+            if kind == "meta":
+                record = table.metas[position]
+            else:
+                entry = table.index[position]
+                meta = table.metas[int(entry["segment"])]
+                row = int(entry["row"])
+                rows = table.rows[row : row + int(entry["count"])]
+                record = vt.live_detection_record(
+                    int(entry["n"]),
+                    vt.make_frame_detections(rows["track_id"], rows["xyxy"], rows["conf"]),
+                    str(meta.get("segment_id", "base")),
+                    int(meta.get("revision", 0)),
+                    int(table.frame_headers[row - 1]["segment_n"]),
+                )
+            file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def convert_live(args: argparse.Namespace) -> int:
+    vt.load_video_modules()
+
+    src = Path(args.input)
+    dst = Path(args.output)
+    if is_live_bin_path(src) == is_live_bin_path(dst):
+        raise SystemExit(f"convert_live converts between JSONL and {LIVE_BIN_SUFFIX}; got {src} -> {dst}")
+    started_at = time.monotonic()
+    if is_live_bin_path(dst):
+        convert_jsonl_to_live_bin(src, dst)
+    else:
+        convert_live_bin_to_jsonl(src, dst)
+    vt.logger.info("live detections converted: %s -> %s in %.1fs", src, dst, time.monotonic() - started_at)
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# tests (pytest)
+# ---------------------------------------------------------------------------
+
+
+def _live_records() -> list[dict[str, object]]:
+    """A base segment over frames 0-5 and a revision 1 segment re-detecting frames 2-3; float32-exact values."""
+    vt.load_video_modules()
+    records: list[dict[str, object]] = []
+    for segment_id, revision, frames in (("base", 0, range(6)), ("fix-001", 1, range(2, 4))):
+        records.append({"schema": "video_track.live.v1", "type": "meta", "segment_id": segment_id, "revision": revision,
+                        "fps": 30.0})
+        for segment_n, n in enumerate(frames):
+            count = (n + revision) % 3
+            detections = vt.make_frame_detections(
+                np.arange(count) + 10 * revision,
+                [[n + 0.5, 2.25, n + 10.5, 20.0 + revision]] * count,
+                [0.5] * count,
+            )
+            records.append(vt.live_detection_record(n, detections, segment_id, revision, segment_n))
+    return records
+
+
+def _write_jsonl(path: Path, records: list[dict[str, object]]) -> None:
+    path.write_text("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records), encoding="utf-8")
+
+
+def _assert_same_segments(a: list[dict[str, object]], b: list[dict[str, object]]) -> None:
+    assert [(s["segment_id"], s["revision"], s["meta"]) for s in a] == [(s["segment_id"], s["revision"], s["meta"]) for s in b]
+    for segment_a, segment_b in zip(a, b):
+        store_a, store_b = segment_a["detections"], segment_b["detections"]
+        for name in ("frames", "offsets", "track_ids", "xyxy", "conf"):
+            np.testing.assert_array_equal(getattr(store_a, name), getattr(store_b, name), err_msg=name)
+
+
+def test_jsonl_bin_round_trip(tmp_path):
+    src = tmp_path / "live.jsonl"
+    _write_jsonl(src, _live_records())
+    convert_jsonl_to_live_bin(src, tmp_path / "live.bin")
+    _assert_same_segments(vt.read_live_detection_segments(tmp_path / "live.bin"), vt.read_live_detection_segments(src))
+    convert_live_bin_to_jsonl(tmp_path / "live.bin", tmp_path / "back.jsonl")
+    assert (tmp_path / "back.jsonl").read_text(encoding="utf-8") == src.read_text(encoding="utf-8")
+    assert next_live_bin_revision(tmp_path / "live.bin") == 2
+
+
+def test_next_revision_counts_meta_records_missing_from_the_sidecar(tmp_path):
+    records = _live_records()
+    records.append({"schema": "video_track.live.v1", "type": "meta", "segment_id": "fix-002", "revision": 2, "fps": 30.0})
+    _write_jsonl(tmp_path / "live.jsonl", records)
+    path = tmp_path / "live.bin"
+    convert_jsonl_to_live_bin(tmp_path / "live.jsonl", path)
+    assert next_live_bin_revision(path) == vt.next_revision(tmp_path / "live.jsonl") == 3
+    # crashed after the meta record was flushed, before its segment row
+    segments_path(path).write_bytes(segments_path(path).read_bytes()[: -SEGMENT_DTYPE.itemsize])
+    assert next_live_bin_revision(path) == 3
+
+
+def test_truncated_final_record_is_dropped(tmp_path):
+    records = _live_records()
+    assert records[-1]["detections"]  # the torn record: cut inside its last detection row
+    _write_jsonl(tmp_path / "live.jsonl", records)
+    _write_jsonl(tmp_path / "expected.jsonl", records[:-1])
+    path = tmp_path / "live.bin"
+    convert_jsonl_to_live_bin(tmp_path / "live.jsonl", path)
+    os.truncate(path, path.stat().st_size - UNIT // 2)
+    _assert_same_segments(vt.read_live_detection_segments(path), vt.read_live_detection_segments(tmp_path / "expected.jsonl"))
+
+    # Appending cuts the torn tail off before writing.
+    with LiveBinWriter(path, append=True) as writer:
+        writer.write_frame(5, vt.make_frame_detections([7], [[1.0, 2.0, 3.0, 4.0]], [0.25]), "fix-001", 1, 9)
+    store = read_live_bin_segments(path)[1]["detections"]
+    assert store.frames.tolist() == [2, 5]
+    assert store.track_ids[-1] == 7
+
+
+def test_stale_or_missing_sidecars_are_rebuilt(tmp_path):
+    _write_jsonl(tmp_path / "live.jsonl", _live_records())
+    path = tmp_path / "live.bin"
+    convert_jsonl_to_live_bin(tmp_path / "live.jsonl", path)
+    expected = vt.read_live_detection_segments(tmp_path / "live.jsonl")
+    sidecars = {sidecar: sidecar.read_bytes() for sidecar in (segments_path(path), index_path(path))}
+
+    index_path(path).unlink()
+    _assert_same_segments(read_live_bin_segments(path), expected)
+    # an older copy: the rows stop short of the data, so the missing ones are scanned from the data
+    index_path(path).write_bytes(sidecars[index_path(path)][: 2 * INDEX_DTYPE.itemsize])
+    _assert_same_segments(read_live_bin_segments(path), expected)
+    # rows that do not point at the matching records
+    segments_path(path).write_bytes(sidecars[segments_path(path)][::-1])
+    _assert_same_segments(read_live_bin_segments(path), expected)
+    segments_path(path).unlink()
+    index_path(path).write_bytes(b"\xff" * INDEX_DTYPE.itemsize * 50)
+    _assert_same_segments(read_live_bin_segments(path), expected)
+    assert {sidecar: sidecar.read_bytes() for sidecar in sidecars} == sidecars
+
+
+def test_compact_live_bin_matches_jsonl_compaction(tmp_path):
+    records = _live_records()
+    # a segment left without frames once its only frame is superseded
+    records.insert(1, {"schema": "video_track.live.v1", "type": "meta", "segment_id": "old", "revision": 0, "fps": 30.0})
+    records.insert(2, vt.live_detection_record(4, vt.make_frame_detections([3], [[0.0, 0.0, 1.0, 1.0]]), "old", 0, 0))
+    _write_jsonl(tmp_path / "live.jsonl", records)
+    convert_jsonl_to_live_bin(tmp_path / "live.jsonl", tmp_path / "live.bin")
+    vt.compact_live_detection_data(tmp_path / "live.jsonl")
+    compact_live_bin(tmp_path / "live.bin")
+    _assert_same_segments(read_live_bin_segments(tmp_path / "live.bin"), vt.read_live_detection_segments(tmp_path / "live.jsonl"))
+    convert_live_bin_to_jsonl(tmp_path / "live.bin", tmp_path / "back.jsonl")
+    assert (tmp_path / "back.jsonl").read_text(encoding="utf-8") == (tmp_path / "live.jsonl").read_text(encoding="utf-8")
+    assert sidecars_match(np.fromfile(tmp_path / "live.bin", dtype=np.uint8), read_sidecar(segments_path(tmp_path / "live.bin"), SEGMENT_DTYPE), read_sidecar(index_path(tmp_path / "live.bin"), INDEX_DTYPE))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import queue
+import subprocess
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+import numpy as np
+
+import video_track as vt
+
+OUTPUT_ENCODERS = ("mp4v", "h264")
+OUTPUT_QUEUE_SIZE = 8
+
+
+def parse_output_encoders(value: str) -> tuple[str, ...]:
+    encoders = tuple(dict.fromkeys(part.strip() for part in value.split(",") if part.strip()))
+    unknown = [encoder for encoder in encoders if encoder not in OUTPUT_ENCODERS]
+    if unknown or not encoders:
+        raise argparse.ArgumentTypeError(f"encoders must be a comma-separated subset of {','.join(OUTPUT_ENCODERS)}")
+    return encoders
+
+
+class FrameEncoder(t.NamedTuple):
+    name: str
+    write: t.Callable[[np.ndarray], None]
+    close: t.Callable[[], None]
+
+
+def mp4v_encoder(path: Path, fps: float, width: int, height: int) -> FrameEncoder:
+    writer = vt.cv2.VideoWriter(str(path), vt.cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not write {path}")
+    return FrameEncoder("mp4v", writer.write, writer.release)
+
+
+def pipe_encoder(name: str, process: subprocess.Popen[bytes], close: t.Callable[[], None]) -> FrameEncoder:
+    """Encoder writing raw frames to process's stdin straight from the frame buffer (no tobytes() copy)."""
+    assert process.stdin is not None
+    stdin = process.stdin
+
+    def write(frame: np.ndarray) -> None:
+        stdin.write(np.ascontiguousarray(frame).data)
+
+    return FrameEncoder(name, write, close)
+
+
+class OutputWriter:
+    """Encode rendered frames on background threads, one per encoder, each fed by a bounded queue.
+
+    A frame passed to write() must not be modified afterwards. next_buffer() hands out frame buffers from a ring that
+    is large enough that a buffer is only handed out again once every encoder is done with it, so the render loop
+    can decode or draw into them without allocating.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        shape: tuple[int, int, int],
+        encoders: list[FrameEncoder],
+        *,
+        queue_size: int = OUTPUT_QUEUE_SIZE,
+    ) -> None:
+        self.name = name
+        self.encoders = encoders
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(queue_size + 2)]
+        self.next_position = 0
+        self.stop = threading.Event()
+        self.errors: list[BaseException] = []
+        self.queues: list[queue.Queue[object]] = [queue.Queue(maxsize=queue_size) for _ in encoders]
+        self.timers = [vt.StageTimer(encoder.name) for encoder in encoders]
+        self.render_timer = vt.StageTimer("render")
+        self.started_at = time.monotonic()
+        self.closed = False
+        self.threads = [
+            threading.Thread(target=self.run, args=(encoder, frames, timer), name=f"{name}-{encoder.name}", daemon=True)
+            for encoder, frames, timer in zip(encoders, self.queues, self.timers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self) -> OutputWriter:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, *exc_info: object) -> None:
+        if exc is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception as close_exc:
+            if close_exc is not exc:
+                vt.logger.warning("%s output writer: %s", self.name, close_exc)
+
+    def run(self, encoder: FrameEncoder, frames: queue.Queue[object], timer: vt.StageTimer) -> None:
+        try:
+            while True:
+                frame = vt.pipeline_get(frames, self.stop, timer)
+                if frame is vt._PIPELINE_END:
+                    return
+                started_at = time.monotonic()
+                encoder.write(frame)
+                timer.busy += time.monotonic() - started_at
+                timer.count += 1
+        except BaseException as exc:
+            self.errors.append(exc)
+            self.stop.set()
+
+    def next_buffer(self) -> np.ndarray:
+        buffer = self.buffers[self.next_position % len(self.buffers)]
+        self.next_position += 1
+        return buffer
+
+    def write(self, frame: np.ndarray) -> None:
+        for frames in self.queues:
+            if not vt.pipeline_put(frames, frame, self.stop, self.render_timer):
+                break
+        if self.errors:
+            raise self.errors[0]
+        self.render_timer.count += 1
+
+    def close(self) -> None:
+        """Encode the queued frames, close the encoders and raise the first encoder error."""
+        if self.closed:
+            return
+        self.closed = True
+        for frames in self.queues:
+            vt.pipeline_put(frames, vt._PIPELINE_END, self.stop, self.render_timer)
+        for thread in self.threads:
+            thread.join()
+        for encoder in self.encoders:
+            try:
+                encoder.close()
+            except BaseException as exc:
+                self.errors.append(exc)
+        if self.errors:
+            raise self.errors[0]
+        vt.logger.info(
+            "%s output: %s; render waited %.1fs for the encoders; %s frames in %.1fs",
+            self.name,
+            "; ".join(timer.summary() for timer in self.timers) or "no encoders",
+            self.render_timer.wait,
+            self.render_timer.count,
+            time.monotonic() - self.started_at,
+        )
+
+
+def build_mp4v_from_h264_command(h264_video: Path, mp4v_video: Path) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-v",
+        "error",
+        "-y",
+        "-i",
+        str(h264_video),
+        "-map",
+        "0:v:0",
+        "-an",
+        "-c:v",
+        "mpeg4",
+        "-q:v",
+        "2",
+        str(mp4v_video),
+    ]
+
+
+def derive_mp4v_from_h264(h264_video: Path, mp4v_video: Path, dry_run: bool) -> None:
+    """Write the no-audio mp4v video by transcoding the h264 output instead of encoding it while rendering."""
+    cmd = build_mp4v_from_h264_command(h264_video, mp4v_video)
+    cmd_text = vt.shell_join(cmd)
+    if dry_run:
+        print(cmd_text)
+        return
+    vt.logger.info(cmd_text)
+    started_at = time.monotonic()
+    subprocess.run(cmd, check=True)
+    vt.logger.info("mp4v video from h264: %s in %.1fs", mp4v_video, time.monotonic() - started_at)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import threading
+import time
+import typing as t
+
+import numpy as np
+
+import video_track as vt
+
+PREVIEW_MAX_FPS = 15.0
+PREVIEW_POLL_INTERVAL = 0.02
+
+
+class PreviewRenderer:
+    """--preview_gui window driven by a GUI thread of its own.
+
+    submit() is a no-op until the next display slot (at most max_fps per second); then it downscales the frame to
+    the window size and leaves it in a single slot, replacing any frame the GUI thread has not shown yet. The GUI
+    thread calls draw(frame, scale, *args) to render overlays onto that downscaled frame (scale maps source to
+    preview coordinates), shows it and polls keys. After q/esc, due() raises KeyboardInterrupt.
+    """
+
+    def __init__(
+        self,
+        window_name: str,
+        frame_width: int,
+        frame_height: int,
+        draw: t.Callable[..., np.ndarray] | None = None,
+        *,
+        max_fps: float = PREVIEW_MAX_FPS,
+    ) -> None:
+        vt.ensure_preview_available()
+        self.window_name = window_name
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        window_width, _window_height = vt.preview_window_size(frame_width, frame_height)
+        self.scale = min(1.0, window_width / frame_width) if frame_width > 0 else 1.0
+        self.size = vt.proxy_frame_size(frame_width, frame_height, self.scale)
+        self.draw = draw
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.next_due = 0.0
+        self.condition = threading.Condition()
+        self.pending: tuple[np.ndarray, tuple[object, ...]] | None = None
+        self.closed = False
+        self.interrupted = False
+        self.errors: list[BaseException] = []
+        self.offered = 0
+        self.shown = 0
+        self.thread = threading.Thread(target=self.run, name=f"preview-{window_name}", daemon=True)
+        self.thread.start()
+
+    def __enter__(self) -> PreviewRenderer:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def due(self) -> bool:
+        """Whether a frame submitted now would be shown; call before preparing preview-only data."""
+        if self.interrupted:
+            raise KeyboardInterrupt("preview interrupted")
+        if self.errors:
+            raise self.errors[0]
+        self.offered += 1
+        return time.monotonic() >= self.next_due
+
+    def submit(self, frame: np.ndarray, *args: object) -> None:
+        now = time.monotonic()
+        if now < self.next_due:
+            return
+        self.next_due = now + self.interval
+        if self.scale < 1:
+            preview = vt.cv2.resize(frame, self.size, interpolation=vt.cv2.INTER_AREA)
+        else:
+            preview = frame.copy()
+        with self.condition:
+            self.pending = (preview, args)
+            self.condition.notify()
+
+    def run(self) -> None:
+        try:
+            vt.open_preview_window(self.window_name, self.frame_width, self.frame_height)
+            while True:
+                with self.condition:
+                    if self.pending is None and not self.closed:
+                        self.condition.wait(PREVIEW_POLL_INTERVAL)
+                    item, self.pending = self.pending, None
+                    closed = self.closed
+                if item is not None:
+                    frame, args = item
+                    image = frame if self.draw is None else self.draw(frame, self.scale, *args)
+                    vt.cv2.imshow(self.window_name, image)
+                    self.shown += 1
+                key = vt.cv2.waitKey(1) & 0xFF
+                if key in (27, ord("q")):
+                    self.interrupted = True
+                if closed:
+                    return
+        except BaseException as exc:
+            self.errors.append(exc)
+        finally:
+            try:
+                vt.cv2.destroyWindow(self.window_name)
+            except vt.cv2.error:
+                pass
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        vt.logger.debug("%s: showed %s of %s frames", self.window_name, self.shown, self.offered)
+
+
+def draw_status_preview(
+    frame: np.ndarray,
+    scale: float,
+    status_text: str,
+    bbox: tuple[float, float, float, float] | None = None,
+) -> np.ndarray:
+    """PreviewRenderer draw callback for draw_box and stabilize: an optional box (source coordinates) and the status.
+
+    Draws in place; the renderer hands draw() a frame of its own.
+    """
+    style = vt.preview_style(frame)
+    if bbox is not None:
+        x0, y0, x1, y1 = (int(round(value * scale)) for value in bbox)
+        vt.cv2.rectangle(frame, (x0, y0), (x1, y1), (0, 255, 0), style.box_thickness)
+    vt.draw_preview_text(
+        frame,
+        f"{status_text}\nq/esc: kill",
+        style.margin,
+        style.line_y,
+        style.text_scale,
+        style.text_thickness,
+        (255, 255, 255),
+    )
+    return frame
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import concurrent.futures
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import video_track as vt
+from video_track_frame_cache import FrameCacheOptions
+
+DEFAULT_SHARD_OVERLAP = 30
+STITCH_MIN_IOU = 0.5
+
+
+def shard_frame_indices(frame_indices: list[int], shards: int, overlap: int) -> list[tuple[list[int], int]]:
+    """Split frame_indices (in processing order) into contiguous chunks.
+
+    Every chunk but the first is prefixed with up to `overlap` frames from the end of the previous chunk, so the
+    tracker warms up and the chunks can be stitched. Returns (frames to process, number of warm-up frames) per chunk.
+    """
+    shards = max(1, min(shards, len(frame_indices)))
+    bounds = [round(shard * len(frame_indices) / shards) for shard in range(shards + 1)]
+    chunks: list[tuple[list[int], int]] = []
+    for start, end in zip(bounds, bounds[1:]):
+        warmup = min(overlap, start)
+        chunks.append((frame_indices[start - warmup : end], warmup))
+    return chunks
+
+
+def shard_live_path(live_json: Path, shard: int) -> Path:
+    return live_json.with_suffix(f".shard-{shard:02d}{live_json.suffix}")
+
+
+def detect_shard_worker(
+    src: str,
+    part: str,
+    model: str,
+    class_id: int | None,
+    frame_indices: list[int],
+    shard: int,
+    threads: int,
+    frame_cache: FrameCacheOptions | None,
+    proxy_scale: float,
+) -> int:
+    """Run YOLO tracking over frame_indices in its own process and write raw detections to the part file."""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    vt.load_video_modules()
+    vt.cv2.setNumThreads(threads)
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(threads)
+    detector = YOLO(model)
+    segment_id = f"shard-{shard:02d}"
+    with vt.open_live_writer(Path(part), append=False) as writer:
+        writer.write_meta({"schema": "video_track.live.v1", "type": "meta", "segment_id": segment_id, "revision": 0})
+
+        def consume(item: vt.DetectedFrame) -> None:
+            writer.write_frame(item.original_index, item.detections, segment_id, 0, item.index)
+
+        return vt.run_detect_pipeline(
+            Path(src),
+            detector,
+            class_id,
+            frame_indices,
+            consume,
+            desc=f"detect {segment_id}",
+            total=len(frame_indices),
+            frame_cache=frame_cache,
+            proxy_scale=proxy_scale,
+            need_frame=False,
+        )
+
+
+def stitch_track_ids(
+    previous: vt.DetectionStore,
+    current: vt.DetectionStore,
+    overlap_frames: list[int],
+) -> dict[int, int]:
+    """Match track IDs of current to those of previous by summed IoU over the overlap frames (greedy, best first)."""
+    frames = vt.np.array(sorted(overlap_frames), dtype=vt.np.int64)
+    previous_overlap = previous.reindex(frames)
+    current_overlap = current.reindex(frames)
+    scores: dict[tuple[int, int], float] = {}
+    for position in range(len(frames)):
+        a = previous_overlap.frame(position)
+        b = current_overlap.frame(position)
+        if len(a.track_ids) == 0 or len(b.track_ids) == 0:
+            continue
+        ious = vt.bbox_iou_matrix(a.xyxy, b.xyxy)
+        for i, j in zip(*vt.np.nonzero(ious >= STITCH_MIN_IOU)):
+            key = (int(a.track_ids[i]), int(b.track_ids[j]))
+            scores[key] = scores.get(key, 0.0) + float(ious[i, j])
+
+    mapping: dict[int, int] = {}
+    used: set[int] = set()
+    for (previous_id, current_id), _score in sorted(scores.items(), key=lambda item: -item[1]):
+        if current_id in mapping or previous_id in used:
+            continue
+        mapping[current_id] = previous_id
+        used.add(previous_id)
+    return mapping
+
+
+def remap_track_ids(store: vt.DetectionStore, mapping: dict[int, int], next_id: int) -> tuple[vt.DetectionStore, int]:
+    """Replace track IDs via mapping; unmapped IDs get fresh IDs from next_id. Returns the store and the next free ID."""
+    unique_ids, inverse = vt.np.unique(store.track_ids, return_inverse=True)
+    new_ids = vt.np.empty(len(unique_ids), dtype=vt.np.int64)
+    for position, track_id in enumerate(unique_ids.tolist()):
+        if track_id in mapping:
+            new_ids[position] = mapping[track_id]
+        else:
+            new_ids[position] = next_id
+            next_id += 1
+    remapped = vt.DetectionStore(store.frames, store.offsets, new_ids[inverse], store.xyxy, store.conf)
+    return remapped, next_id
+
+
+def detect_shards(
+    src: Path,
+    live_json: Path,
+    model: str,
+    class_id: int | None,
+    frame_indices: list[int],
+    shards: int,
+    overlap: int,
+    threads: int,
+    live_meta: dict[str, object],
+    *,
+    append: bool,
+    frame_cache: FrameCacheOptions | None = None,
+    proxy_scale: float = 1.0,
+) -> None:
+    """Detect frame_indices in `shards` worker processes and append the stitched result to live_json.
+
+    Each shard is written as its own meta block followed by the frames it owns (without its warm-up frames), all
+    under live_meta's segment_id/revision, so finalize reads them as one segment with track IDs that continue across
+    shard boundaries.
+    """
+    started_at = time.monotonic()
+    chunks = shard_frame_indices(frame_indices, shards, overlap)
+    if threads <= 0:
+        threads = max(1, (os.cpu_count() or 1) // len(chunks))
+    parts = [shard_live_path(live_json, shard) for shard in range(len(chunks))]
+    vt.logger.info(
+        "detect shards: %s frames in %s shards (overlap %s frames, %s threads each)",
+        len(frame_indices),
+        len(chunks),
+        overlap,
+        threads,
+    )
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(chunks), mp_context=context) as executor:
+        futures = [
+            executor.submit(detect_shard_worker, str(src), str(part), model, class_id, chunk, shard, threads, frame_cache, proxy_scale)
+            for shard, ((chunk, _warmup), part) in enumerate(zip(chunks, parts))
+        ]
+        try:
+            counts = [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    detect_elapsed = time.monotonic() - started_at
+
+    segment_id = str(live_meta["segment_id"])
+    revision = int(live_meta["revision"])
+    frame_positions = {frame_index: position for position, frame_index in enumerate(frame_indices)}
+    previous: vt.DetectionStore | None = None
+    next_id = 0
+    with vt.open_live_writer(live_json, append) as writer:
+        for shard, ((chunk, warmup), part) in enumerate(zip(chunks, parts)):
+            store = vt.read_live_detection_segments(part)[0]["detections"]
+            assert isinstance(store, vt.DetectionStore)
+            if previous is None:
+                mapping = {int(track_id): int(track_id) for track_id in vt.np.unique(store.track_ids)}
+                next_id = max(mapping.values(), default=0) + 1
+            else:
+                mapping = stitch_track_ids(previous, store, chunk[:warmup])
+            store, next_id = remap_track_ids(store, mapping, next_id)
+            owned = chunk[warmup:]
+            vt.logger.debug(
+                "detect shard %s: frames %s..%s, %s/%s tracks stitched to the previous shard",
+                shard,
+                owned[0],
+                owned[-1],
+                len(mapping) if previous is not None else 0,
+                len(vt.np.unique(store.track_ids)),
+            )
+            writer.write_meta(
+                {
+                    **live_meta,
+                    "shard": {
+                        "index": shard,
+                        "count": len(chunks),
+                        "frame_range": [owned[0], owned[-1]],
+                        "overlap": warmup,
+                    },
+                }
+            )
+            positions = vt.np.searchsorted(store.frames, owned)
+            for frame_index, position in zip(owned, positions.tolist()):
+                if position >= len(store) or int(store.frames[position]) != frame_index:
+                    continue
+                writer.write_frame(frame_index, store.frame(position), segment_id, revision, frame_positions[frame_index])
+            previous = store
+    for part in parts:
+        part.unlink()
+        for sidecar in (Path(f"{part}.segments"), Path(f"{part}.idx")):
+            sidecar.unlink(missing_ok=True)
+    vt.logger.info(
+        "detect shards done: %s frames detected in %.1fs, stitched in %.1fs -> %s",
+        sum(counts),
+        detect_elapsed,
+        time.monotonic() - started_at - detect_elapsed,
+        live_json,
+    )
+
+
+# ---------------------------------------------------------------------------
+# tests (pytest)
+# ---------------------------------------------------------------------------
+
+
+def _store(frames: range, tracks: dict[int, tuple[float, float, range]]) -> vt.DetectionStore:
+    """Boxes 10 wide and high at (x + frame, y) for track_id -> (x, y, frames the track is in)."""
+    vt.load_video_modules()
+    builder = vt.DetectionStoreBuilder()
+    for frame in frames:
+        ids = [track_id for track_id, (_x, _y, present) in tracks.items() if frame in present]
+        xyxy = [[tracks[i][0] + frame, tracks[i][1], tracks[i][0] + frame + 10, tracks[i][1] + 10] for i in ids]
+        builder.append(frame, vt.make_frame_detections(ids, xyxy, [0.9] * len(ids)))
+    return builder.build()
+
+
+def test_shard_frame_indices():
+    frame_indices = list(range(100, 110))
+    chunks = shard_frame_indices(frame_indices, 3, 2)
+    assert [warmup for _chunk, warmup in chunks] == [0, 2, 2]
+    assert [frame for chunk, warmup in chunks for frame in chunk[warmup:]] == frame_indices
+    for (previous, _), (chunk, warmup) in zip(chunks, chunks[1:]):
+        assert chunk[:warmup] == previous[-warmup:]
+
+    # more shards than frames: one frame per chunk, warm-up limited to the frames before it
+    chunks = shard_frame_indices([5, 4, 3], 8, 30)
+    assert chunks == [([5], 0), ([5, 4], 1), ([5, 4, 3], 2)]
+    assert shard_frame_indices([7], 4, 3) == [([7], 0)]
+
+
+def test_stitch_and_remap_track_ids():
+    # previous shard: A (id 1), B (id 2), C (id 5, gone before the overlap)
+    previous = _store(range(0, 10), {1: (0, 0, range(0, 10)), 2: (0, 50, range(0, 10)), 5: (0, 100, range(0, 5))})
+    # current shard over frames 8..14: the tracker swapped the IDs of A and B, 9 is a second, weaker match of A,
+    # and 3 is a new object
+    current = _store(
+        range(8, 15),
+        {7: (0, 0, range(8, 15)), 1: (0, 50, range(8, 15)), 9: (2, 0, range(8, 15)), 3: (0, 200, range(8, 15))},
+    )
+    mapping = stitch_track_ids(previous, current, [8, 9])
+    assert mapping == {7: 1, 1: 2}
+    assert len(set(mapping.values())) == len(mapping)
+
+    next_id = int(previous.track_ids.max()) + 1
+    remapped, next_id = remap_track_ids(current, mapping, next_id)
+    assert next_id == 8
+    position = int(vt.np.searchsorted(remapped.frames, 12))
+    frame = remapped.frame(position)
+    original = current.frame(position)
+    assert dict(zip(original.track_ids.tolist(), frame.track_ids.tolist())) == {7: 1, 1: 2, 3: 6, 9: 7}
+    vt.np.testing.assert_array_equal(remapped.xyxy, current.xyxy)
+
+    # no overlap frames: nothing carries over
+    assert stitch_track_ids(previous, current, []) == {}
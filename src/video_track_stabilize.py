@@ -7,6 +7,8 @@ import time
 from pathlib import Path
 
 import video_track as vt
+from video_track_frame_cache import FrameCacheOptions, frame_cache_options
+from video_track_output import OUTPUT_ENCODERS, OutputWriter, derive_mp4v_from_h264, mp4v_encoder, pipe_encoder
 
 
 DEFAULT_SMOOTH_SECONDS = 8.0
@@ -201,11 +203,14 @@ def stabilize_video(
     smooth_seconds: float,
     preview: bool,
     dry_run: bool,
+    frame_cache: FrameCacheOptions | None = None,
+    encoders: tuple[str, ...] = OUTPUT_ENCODERS,
+    mp4v_from_h264: bool = False,
 ) -> None:
     started_at = time.monotonic()
     if preview:
         vt.ensure_preview_available()
-    cap = vt.cv2.VideoCapture(str(src))
+    cap = vt.open_video_capture(src, frame_cache)
     if not cap.isOpened():
         raise RuntimeError(f"Could not open {src}")
 
@@ -213,9 +218,6 @@ def stabilize_video(
     frame_count = int(cap.get(vt.cv2.CAP_PROP_FRAME_COUNT))
     src_w = int(cap.get(vt.cv2.CAP_PROP_FRAME_WIDTH))
     src_h = int(cap.get(vt.cv2.CAP_PROP_FRAME_HEIGHT))
-    if preview:
-        vt.open_preview_window("video_track stabilize", src_w, src_h)
-
     out_w, out_h = src_w, src_h
     centers, crop_sizes, _crop_bboxes, smooth_radius = compute_stabilize_crop_geometry(
         bboxes,
@@ -225,15 +227,13 @@ def stabilize_video(
         margin,
         smooth_seconds,
     )
-    writer = vt.cv2.VideoWriter(
-        str(mp4v_video),
-        vt.cv2.VideoWriter_fourcc(*"mp4v"),
-        fps,
-        (out_w, out_h),
-    )
-    if not writer.isOpened():
-        raise RuntimeError(f"Could not write {mp4v_video}")
-    h264_process = open_h264_writer(src, h264_video, fps, out_w, out_h, dry_run)
+    frame_encoders = []
+    if "mp4v" in encoders and not mp4v_from_h264:
+        frame_encoders.append(mp4v_encoder(mp4v_video, fps, out_w, out_h))
+    h264_process = open_h264_writer(src, h264_video, fps, out_w, out_h, dry_run) if "h264" in encoders else None
+    if h264_process is not None:
+        frame_encoders.append(pipe_encoder("h264", h264_process, lambda: close_h264_writer(h264_process)))
+    output = OutputWriter("stabilize", (out_h, out_w, 3), frame_encoders)
 
     vt.logger.info(
         "stabilize start: %s frames, %.3f fps, %sx%s -> %sx%s, smooth=%.3fs radius=%s frames, dynamic_crop=%sx%s..%sx%s",
@@ -250,9 +250,14 @@ def stabilize_video(
         int(vt.np.max(crop_sizes[:, 0])),
         int(vt.np.max(crop_sizes[:, 1])),
     )
+    preview_renderer = None
+    if preview:
+        from video_track_preview import PreviewRenderer, draw_status_preview
+
+        preview_renderer = PreviewRenderer("video_track stabilize", src_w, src_h, draw_status_preview)
     index = 0
     try:
-        with vt.tqdm_progress(total=frame_count, desc="stabilize", unit="frame") as progress:
+        with output, vt.tqdm_progress(total=frame_count, desc="stabilize", unit="frame") as progress:
             while True:
                 ok, frame = cap.read()
                 if not ok:
@@ -262,16 +267,13 @@ def stabilize_video(
                 crop = crop_with_soft_pad(frame, centers[index], crop_w, crop_h)
                 foreground = vt.cv2.resize(crop, (out_w, out_h), interpolation=vt.cv2.INTER_CUBIC)
                 background = make_background(frame, out_w, out_h)
-                frame_out = vt.cv2.addWeighted(foreground, 0.94, background, 0.06, 0)
-                writer.write(frame_out)
-                if h264_process is not None and h264_process.stdin is not None:
-                    h264_process.stdin.write(frame_out.tobytes())
-                if preview:
-                    preview_frame = frame_out.copy()
-                    style = vt.preview_style(preview_frame)
+                frame_out = vt.cv2.addWeighted(foreground, 0.94, background, 0.06, 0, dst=output.next_buffer())
+                output.write(frame_out)
+                if preview_renderer is not None and preview_renderer.due():
+                    bbox = None
                     if index < len(bboxes):
                         pt1, pt2 = stabilize_bbox_to_output(bboxes[index], centers[index], crop_w, crop_h, out_w, out_h)
-                        vt.cv2.rectangle(preview_frame, pt1, pt2, (0, 255, 0), style.box_thickness)
+                        bbox = (*pt1, *pt2)
                     pct = (index / max(1, frame_count - 1) * 100.0) if frame_count else 100.0
                     status_text = vt.detect_preview_status(
                         index,
@@ -281,27 +283,15 @@ def stabilize_video(
                         0,
                         max(0, frame_count - 1),
                     )
-                    vt.draw_preview_text(
-                        preview_frame,
-                        f"{status_text}\nq/esc: kill",
-                        style.margin,
-                        style.line_y,
-                        style.text_scale,
-                        style.text_thickness,
-                        (255, 255, 255),
-                    )
-                    vt.cv2.imshow("video_track stabilize", preview_frame)
-                    key = vt.cv2.waitKey(1) & 0xFF
-                    if key in (27, ord("q")):
-                        raise KeyboardInterrupt("preview interrupted")
+                    preview_renderer.submit(frame_out, status_text, bbox)
                 index += 1
                 progress.update(1)
     finally:
         cap.release()
-        writer.release()
-        close_h264_writer(h264_process)
-        if preview:
-            vt.cv2.destroyWindow("video_track stabilize")
+        if preview_renderer is not None:
+            preview_renderer.close()
+    if "mp4v" in encoders and mp4v_from_h264:
+        derive_mp4v_from_h264(h264_video, mp4v_video, dry_run)
     vt.logger.info("stabilize done: %s frames in %.1fs", index, time.monotonic() - started_at)
 
 
@@ -316,10 +306,25 @@ def stabilize(args: argparse.Namespace) -> int:
         raise ValueError("--margin must be positive")
     if args.smooth_seconds < 0:
         raise ValueError("--smooth-seconds must be non-negative")
+    if args.mp4v_from_h264 and "h264" not in args.encoders:
+        raise SystemExit("--mp4v-from-h264 needs h264 in --encoders")
 
     track_data = vt.read_track_data(track_json)
     bboxes = vt.xywh_list_to_xyxy_array(track_data["frames"])
 
-    vt.logger.info("stabilize mp4v no-audio video: %s", mp4v_dst)
-    stabilize_video(src, mp4v_dst, h264_dst, bboxes, args.margin, args.smooth_seconds, args.preview_gui, args.dry_run)
+    if "mp4v" in args.encoders:
+        vt.logger.info("stabilize mp4v no-audio video: %s", mp4v_dst)
+    stabilize_video(
+        src,
+        mp4v_dst,
+        h264_dst,
+        bboxes,
+        args.margin,
+        args.smooth_seconds,
+        args.preview_gui,
+        args.dry_run,
+        frame_cache_options(args),
+        args.encoders,
+        args.mp4v_from_h264,
+    )
     return 0